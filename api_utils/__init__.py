@@ -5,7 +5,8 @@ API工具模块
 
 # 应用初始化
 from .app import (
-    create_app
+    create_app,
+    run_uvicorn
 )
 
 # 路由处理器
@@ -19,6 +20,16 @@ from .routes import (
     chat_completions,
     cancel_request,
     get_queue_status,
+    submit_job,
+    get_job,
+    cancel_job,
+    upload_file,
+    get_file,
+    get_file_content,
+    create_batch,
+    get_batch,
+    list_batches,
+    cancel_batch,
     websocket_log_endpoint
 )
 
@@ -27,15 +38,29 @@ from .utils import (
     generate_sse_chunk,
     generate_sse_stop_chunk,
     generate_sse_error_chunk,
+    coalesce_sse_stream,
+    resolve_sse_flush_policy,
     use_stream_response,
     clear_stream_queue,
     use_helper_get_response,
     validate_chat_request,
     prepare_combined_prompt,
     estimate_tokens,
+    estimate_prompt_tokens,
+    IncrementalTokenEstimator,
+    Tokenizer,
+    load_tokenizer,
+    get_tokenizer,
+    set_tokenizer,
     calculate_usage_stats
 )
 
+# 响应缓存
+from .response_cache import (
+    ResponseCache,
+    compute_request_cache_key
+)
+
 # 请求处理器
 from .request_processor import (
     _process_request_refactored
@@ -49,6 +74,7 @@ from .queue_worker import (
 __all__ = [
     # 应用初始化
     'create_app',
+    'run_uvicorn',
     # 路由处理器
     'read_index',
     'get_css',
@@ -59,18 +85,39 @@ __all__ = [
     'chat_completions',
     'cancel_request',
     'get_queue_status',
+    'submit_job',
+    'get_job',
+    'cancel_job',
+    'upload_file',
+    'get_file',
+    'get_file_content',
+    'create_batch',
+    'get_batch',
+    'list_batches',
+    'cancel_batch',
     'websocket_log_endpoint',
     # 工具函数
     'generate_sse_chunk',
     'generate_sse_stop_chunk',
     'generate_sse_error_chunk',
+    'coalesce_sse_stream',
+    'resolve_sse_flush_policy',
     'use_stream_response',
     'clear_stream_queue',
     'use_helper_get_response',
     'validate_chat_request',
     'prepare_combined_prompt',
     'estimate_tokens',
+    'estimate_prompt_tokens',
+    'IncrementalTokenEstimator',
+    'Tokenizer',
+    'load_tokenizer',
+    'get_tokenizer',
+    'set_tokenizer',
     'calculate_usage_stats',
+    # 响应缓存
+    'ResponseCache',
+    'compute_request_cache_key',
     # 请求处理器
     '_process_request_refactored',
     # 队列工作器
@@ -0,0 +1,104 @@
+"""
+准入控制模块
+按最近请求服务时间的指数移动平均 (EWMA) × 排队位置估算新请求的等待时间，
+预计无法在截止时间 (ADMISSION_MAX_QUEUE_WAIT_SECONDS 或请求的 max_queue_wait_seconds) 内开始处理、
+或队列长度达到 ADMISSION_MAX_QUEUE_LENGTH 时直接返回 503 和估算的 Retry-After，而不是让客户端排队数分钟后超时。
+"""
+
+import math
+import time
+from typing import Any, Dict, Optional
+
+from config import ADMISSION_MAX_QUEUE_WAIT_SECONDS, ADMISSION_MAX_QUEUE_LENGTH
+
+# 服务时间 EWMA 的平滑系数，以及还没有样本时使用的估计值 (秒)
+_EWMA_ALPHA = 0.2
+_INITIAL_SERVICE_SECONDS = 20.0
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self) -> str:
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+class AdmissionController:
+    """记录 Worker 的服务时间并估算排队等待时间"""
+
+    def __init__(self, max_queue_wait_seconds: float = ADMISSION_MAX_QUEUE_WAIT_SECONDS,
+                 max_queue_length: int = ADMISSION_MAX_QUEUE_LENGTH):
+        self.max_queue_wait_seconds = max_queue_wait_seconds
+        self.max_queue_length = max_queue_length
+        self.avg_service_seconds: Optional[float] = None
+        self.samples = 0
+        self.rejected = 0
+        self._current_started_at: Optional[float] = None
+
+    # --- Worker 侧 ---
+    def start_service(self) -> None:
+        self._current_started_at = time.monotonic()
+
+    def finish_service(self) -> None:
+        """当前请求处理结束（包括释放锁后的清理），计入服务时间"""
+        if self._current_started_at is None:
+            return
+        duration = time.monotonic() - self._current_started_at
+        self._current_started_at = None
+        if self.avg_service_seconds is None:
+            self.avg_service_seconds = duration
+        else:
+            self.avg_service_seconds += _EWMA_ALPHA * (duration - self.avg_service_seconds)
+        self.samples += 1
+
+    # --- 估算 ---
+    @property
+    def service_estimate(self) -> float:
+        return self.avg_service_seconds if self.avg_service_seconds is not None else _INITIAL_SERVICE_SECONDS
+
+    def estimate_wait(self, position: int) -> float:
+        """排在 position 个请求之后的请求预计多久开始处理 (秒)"""
+        wait = position * self.service_estimate
+        if self._current_started_at is not None:
+            elapsed = time.monotonic() - self._current_started_at
+            wait += max(0.0, self.service_estimate - elapsed)
+        return wait
+
+    def resolve_deadline(self, requested: Optional[float]) -> Optional[float]:
+        """请求指定的截止时间与全局配置取较严格者，均未设置时返回 None"""
+        limits = [v for v in (requested, self.max_queue_wait_seconds) if v is not None and v > 0]
+        return min(limits) if limits else None
+
+    def check(self, queue_length: int, requested_deadline: Optional[float] = None) -> Optional[float]:
+        """检查新请求能否入队，返回其排队截止时间 (秒，None 表示不限)；无法满足时抛出 AdmissionRejected"""
+        if self.max_queue_length > 0 and queue_length >= self.max_queue_length:
+            self.rejected += 1
+            raise AdmissionRejected(
+                f"队列已满 ({queue_length}/{self.max_queue_length})",
+                self.estimate_wait(queue_length - self.max_queue_length + 1)
+            )
+        deadline = self.resolve_deadline(requested_deadline)
+        if deadline is None:
+            return None
+        estimated_wait = self.estimate_wait(queue_length)
+        if estimated_wait > deadline:
+            self.rejected += 1
+            raise AdmissionRejected(
+                f"预计排队 {estimated_wait:.0f} 秒，超过截止时间 {deadline:g} 秒",
+                estimated_wait - deadline
+            )
+        return deadline
+
+    def stats(self, queue_length: int) -> Dict[str, Any]:
+        return {
+            "avg_service_seconds": round(self.avg_service_seconds, 2) if self.avg_service_seconds is not None else None,
+            "samples": self.samples,
+            "estimated_wait_seconds": round(self.estimate_wait(queue_length), 1),
+            "max_queue_wait_seconds": self.max_queue_wait_seconds or None,
+            "max_queue_length": self.max_queue_length or None,
+            "rejected": self.rejected,
+        }
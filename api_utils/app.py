@@ -3,18 +3,22 @@ FastAPI应用初始化和生命周期管理
 """
 
 import asyncio
+import math
 import multiprocessing
-import os
+import signal
 import sys
+import time
 from contextlib import asynccontextmanager
-from typing import Optional
+from typing import Any, Optional
 
-from fastapi import FastAPI, Request
+from fastapi import FastAPI
 from fastapi.responses import JSONResponse
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.types import ASGIApp
-from typing import Callable, Awaitable
-from playwright.async_api import Browser as AsyncBrowser, Playwright as AsyncPlaywright
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Receive, Scope, Send
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from playwright.async_api import Browser as AsyncBrowser, Playwright as AsyncPlaywright
 
 # --- 配置模块导入 ---
 from config import *
@@ -23,23 +27,33 @@ from config import *
 from models import WebSocketConnectionManager
 
 # --- logging_utils模块导入 ---
-from logging_utils import setup_server_logging, restore_original_streams
+from logging_utils import setup_server_logging, restore_original_streams, shutdown_server_logging
 
 # --- browser_utils模块导入 ---
 from browser_utils import (
     _initialize_page_logic,
     _close_page_logic,
     load_excluded_models,
-    _handle_initial_model_state_and_storage
+    _handle_initial_model_state_and_storage,
+    restore_model_list_from_cache,
+    model_list_refresh_loop,
+    drain_error_snapshots
 )
+from browser_utils.params_cache import revalidate_page_params_cache
+from browser_utils.page_supervisor import PageSupervisor
 
-import stream
 from asyncio import Queue, Lock
 from . import auth_utils
+from .response_cache import ResponseCache
+from .request_coalescing import RequestCoalescer
+from .rate_limiter import RateLimiter
+from .admission import AdmissionController
+from .jobs import JobRunner
+from .batches import BatchManager
 
 # 全局状态变量（这些将在server.py中被引用）
-playwright_manager: Optional[AsyncPlaywright] = None
-browser_instance: Optional[AsyncBrowser] = None
+playwright_manager: Optional["AsyncPlaywright"] = None
+browser_instance: Optional["AsyncBrowser"] = None
 page_instance = None
 is_playwright_ready = False
 is_browser_connected = False
@@ -58,10 +72,22 @@ excluded_model_ids = set()
 request_queue = None
 processing_lock = None
 worker_task = None
+startup_task = None
+startup_error = None
+startup_timings = {}
+model_list_refresh_task = None
 
 page_params_cache = {}
 params_cache_lock = None
 
+response_cache = None
+request_coalescer = None
+page_supervisor = None
+rate_limiter = None
+admission_controller = None
+job_runner = None
+batch_manager = None
+
 log_ws_manager = None
 
 STREAM_QUEUE = None
@@ -70,14 +96,13 @@ STREAM_PROCESS = None
 # --- Lifespan Context Manager ---
 def _setup_logging():
     import server
-    log_level_env = os.environ.get('SERVER_LOG_LEVEL', 'INFO')
-    redirect_print_env = os.environ.get('SERVER_REDIRECT_PRINT', 'false')
+    runtime_settings = get_runtime_settings()
     server.log_ws_manager = WebSocketConnectionManager()
     return setup_server_logging(
         logger_instance=server.logger,
         log_ws_manager=server.log_ws_manager,
-        log_level_name=log_level_env,
-        redirect_print_str=redirect_print_env
+        log_level_name=runtime_settings.server_log_level,
+        redirect_print_str=runtime_settings.server_redirect_print
     )
 
 def _initialize_globals():
@@ -88,14 +113,30 @@ def _initialize_globals():
     server.params_cache_lock = Lock()
     auth_utils.initialize_keys()
     server.logger.info("API keys and global locks initialized.")
+    if RESPONSE_CACHE_ENABLED:
+        server.response_cache = ResponseCache.from_config()
+        disk_info = RESPONSE_CACHE_DB_PATH or "disabled"
+        server.logger.info(f"Response cache enabled (memory entries: {RESPONSE_CACHE_MAX_ENTRIES}, disk: {disk_info}).")
+    if REQUEST_COALESCING_ENABLED:
+        server.request_coalescer = RequestCoalescer()
+    server.rate_limiter = RateLimiter.from_config()
+    server.logger.info(f"Rate limiter initialized (account: {server.rate_limiter.account}, rpm: {RATE_LIMIT_RPM or 'unlimited'}).")
+    server.admission_controller = AdmissionController()
+    server.logger.info(f"Admission control initialized (max queue wait: {f'{ADMISSION_MAX_QUEUE_WAIT_SECONDS:g}s' if ADMISSION_MAX_QUEUE_WAIT_SECONDS else 'unlimited'}, max queue length: {ADMISSION_MAX_QUEUE_LENGTH or 'unlimited'}).")
+    if JOBS_DB_PATH:
+        server.job_runner = JobRunner.from_config()
+        server.batch_manager = BatchManager.from_config(server.job_runner)
+        recovered = server.job_runner.start()
+        recovered_batches = server.batch_manager.recover()
+        server.logger.info(f"Async jobs enabled (db: {JOBS_DB_PATH}, max inflight: {JOBS_MAX_INFLIGHT}, recovered jobs: {recovered}, in-progress batches: {recovered_batches}).")
 
 def _initialize_proxy_settings():
     import server
-    STREAM_PORT = os.environ.get('STREAM_PORT')
-    if STREAM_PORT == '0':
-        PROXY_SERVER_ENV = os.environ.get('HTTPS_PROXY') or os.environ.get('HTTP_PROXY')
+    runtime_settings = get_runtime_settings()
+    if not runtime_settings.stream_proxy_enabled:
+        PROXY_SERVER_ENV = runtime_settings.https_proxy
     else:
-        PROXY_SERVER_ENV = f"http://127.0.0.1:{STREAM_PORT or 3120}/"
+        PROXY_SERVER_ENV = f"http://127.0.0.1:{runtime_settings.stream_proxy_port}/"
     
     if PROXY_SERVER_ENV:
         server.PLAYWRIGHT_PROXY_SETTINGS = {'server': PROXY_SERVER_ENV}
@@ -105,54 +146,173 @@ def _initialize_proxy_settings():
     else:
         server.logger.info("No proxy configured for Playwright.")
 
-async def _start_stream_proxy():
+@asynccontextmanager
+async def _startup_phase(name: str):
+    """记录启动阶段耗时 (毫秒)，保存在 server.startup_timings 中并通过 /health 展示"""
     import server
-    STREAM_PORT = os.environ.get('STREAM_PORT')
-    if STREAM_PORT != '0':
-        port = int(STREAM_PORT or 3120)
-        STREAM_PROXY_SERVER_ENV = os.environ.get('UNIFIED_PROXY_CONFIG') or os.environ.get('HTTPS_PROXY') or os.environ.get('HTTP_PROXY')
-        server.logger.info(f"Starting STREAM proxy on port {port} with upstream proxy: {STREAM_PROXY_SERVER_ENV}")
-        server.STREAM_QUEUE = multiprocessing.Queue()
-        server.STREAM_PROCESS = multiprocessing.Process(target=stream.start, args=(server.STREAM_QUEUE, port, STREAM_PROXY_SERVER_ENV))
-        server.STREAM_PROCESS.start()
-        server.logger.info("STREAM proxy process started.")
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed_ms = round((time.perf_counter() - started) * 1000, 1)
+        server.startup_timings[name] = elapsed_ms
+        server.logger.info(f"Startup phase '{name}' finished in {elapsed_ms:.0f} ms.")
 
-async def _initialize_browser_and_page():
+async def _start_stream_proxy():
+    import server
+    runtime_settings = get_runtime_settings()
+    if runtime_settings.stream_proxy_enabled:
+        async with _startup_phase("stream_proxy"):
+            # stream 依赖 aiohttp/cryptography 等较重的模块，只在启用流式代理时导入
+            import stream
+            port = runtime_settings.stream_proxy_port
+            STREAM_PROXY_SERVER_ENV = runtime_settings.unified_proxy_config or runtime_settings.https_proxy
+            server.logger.info(f"Starting STREAM proxy on port {port} with upstream proxy: {STREAM_PROXY_SERVER_ENV}")
+            server.STREAM_QUEUE = multiprocessing.Queue()
+            server.STREAM_PROCESS = multiprocessing.Process(target=stream.start, args=(server.STREAM_QUEUE, port, STREAM_PROXY_SERVER_ENV))
+            server.STREAM_PROCESS.start()
+            server.logger.info("STREAM proxy process started.")
+
+async def _load_local_state():
+    async with _startup_phase("local_state"):
+        await asyncio.to_thread(load_excluded_models, EXCLUDED_MODELS_FILENAME)
+        await asyncio.to_thread(restore_model_list_from_cache)
+
+async def _start_playwright_and_connect():
     import server
     from playwright.async_api import async_playwright
     
-    server.logger.info("Starting Playwright...")
-    server.playwright_manager = await async_playwright().start()
-    server.is_playwright_ready = True
-    server.logger.info("Playwright started.")
+    async with _startup_phase("playwright_start"):
+        server.logger.info("Starting Playwright...")
+        server.playwright_manager = await async_playwright().start()
+        server.is_playwright_ready = True
+        server.logger.info("Playwright started.")
 
-    ws_endpoint = os.environ.get('CAMOUFOX_WS_ENDPOINT')
-    launch_mode = os.environ.get('LAUNCH_MODE', 'unknown')
+    runtime_settings = get_runtime_settings()
+    ws_endpoint = runtime_settings.camoufox_ws_endpoint
 
-    if not ws_endpoint and launch_mode != "direct_debug_no_browser":
+    if not ws_endpoint and runtime_settings.browser_required:
         raise ValueError("CAMOUFOX_WS_ENDPOINT environment variable is missing.")
 
     if ws_endpoint:
-        server.logger.info(f"Connecting to browser at: {ws_endpoint}")
-        server.browser_instance = await server.playwright_manager.firefox.connect(ws_endpoint, timeout=30000)
-        server.is_browser_connected = True
-        server.logger.info(f"Connected to browser: {server.browser_instance.version}")
-        
-        server.page_instance, server.is_page_ready = await _initialize_page_logic(server.browser_instance)
+        async with _startup_phase("browser_connect"):
+            server.logger.info(f"Connecting to browser at: {ws_endpoint}")
+            server.browser_instance = await server.playwright_manager.firefox.connect(ws_endpoint, timeout=30000)
+            server.is_browser_connected = True
+            server.logger.info(f"Connected to browser: {server.browser_instance.version}")
+
+async def _initialize_browser_and_page():
+    import server
+
+    if server.browser_instance:
+        async with _startup_phase("page_init"):
+            server.page_instance, server.is_page_ready = await _initialize_page_logic(server.browser_instance)
         if server.is_page_ready:
-            await _handle_initial_model_state_and_storage(server.page_instance)
+            async with _startup_phase("model_state"):
+                await _handle_initial_model_state_and_storage(server.page_instance)
+            async with _startup_phase("params_revalidate"):
+                async with server.params_cache_lock:
+                    await revalidate_page_params_cache(server.page_instance, server.current_ai_studio_model_id, server.page_params_cache)
             server.logger.info("Page initialized successfully.")
+            if PAGE_FAILOVER_ENABLED:
+                server.page_supervisor = PageSupervisor()
+                server.page_supervisor.attach(server.page_instance, server.browser_instance)
+                server.logger.info(f"Page failover supervisor started (warm standby: {PAGE_STANDBY_ENABLED}).")
         else:
             server.logger.error("Page initialization failed.")
     
     if not server.model_list_fetch_event.is_set():
         server.model_list_fetch_event.set()
 
+def _fail_queued_requests(detail: str):
+    """启动失败时结束预热期间排队的请求"""
+    import server
+    from fastapi import HTTPException
+    while server.request_queue and not server.request_queue.empty():
+        item = server.request_queue.get_nowait()
+        future = item.get("result_future")
+        if future and not future.done():
+            future.set_exception(HTTPException(status_code=503, detail=f"[{item.get('req_id')}] {detail}", headers={"Retry-After": "30"}))
+
+async def _run_startup():
+    """
+    在后台完成启动。lifespan 不等待此任务即交出控制权，HTTP 服务在预热期间即可响应 /health，
+    聊天请求进入队列，待 Worker 启动后处理。互不依赖的步骤并发执行。
+    """
+    import server
+    from server import queue_worker
+    logger = server.logger
+    started = time.perf_counter()
+
+    try:
+        results = await asyncio.gather(
+            _start_stream_proxy(),
+            _start_playwright_and_connect(),
+            _load_local_state(),
+            return_exceptions=True
+        )
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        await _initialize_browser_and_page()
+        
+        if server.is_page_ready or not get_runtime_settings().browser_required:
+            server.worker_task = asyncio.create_task(queue_worker())
+            logger.info("Request processing worker started.")
+            if server.is_page_ready and MODEL_LIST_REFRESH_INTERVAL_SECONDS > 0:
+                server.model_list_refresh_task = asyncio.create_task(model_list_refresh_loop())
+        else:
+            raise RuntimeError("Failed to initialize browser/page, worker not started.")
+
+        server.startup_timings["total"] = round((time.perf_counter() - started) * 1000, 1)
+        logger.info(f"Server startup complete in {server.startup_timings['total']:.0f} ms. Phases (ms): {server.startup_timings}")
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        server.startup_error = str(e) or e.__class__.__name__
+        logger.critical(f"Application startup failed: {e}", exc_info=True)
+        _fail_queued_requests("服务启动失败。")
+        # 停止服务并由启动入口以非零状态退出 (见 run_uvicorn)。
+        # 直接以 uvicorn 命令行启动时没有 Server 对象，改由 uvicorn 的信号处理完成关闭流程
+        if server.uvicorn_server is not None:
+            server.uvicorn_server.should_exit = True
+        else:
+            signal.raise_signal(signal.SIGTERM)
+    finally:
+        server.is_initializing = False
+
+def run_uvicorn(app: Any, **kwargs):
+    """
+    以 uvicorn.Server 运行应用直到停止 (参数同 uvicorn.run)。
+    后台启动失败时，服务关闭后以状态 1 退出，使启动脚本和进程管理器 (supervisord、docker) 能区分启动失败与正常停止
+    """
+    import uvicorn
+    import server
+    server.uvicorn_server = uvicorn.Server(uvicorn.Config(app, **kwargs))
+    server.uvicorn_server.run()
+    if not server.uvicorn_server.started:
+        # 与 uvicorn.run 相同：服务未能启动 (如端口被占用)
+        sys.exit(3)
+    if server.startup_error:
+        sys.exit(f"Application startup failed: {server.startup_error}")
+
 async def _shutdown_resources():
     import server
     logger = server.logger
     logger.info("Shutting down resources...")
     
+    if server.startup_task and not server.startup_task.done():
+        server.startup_task.cancel()
+        try:
+            await server.startup_task
+        except (asyncio.CancelledError, Exception):
+            pass
+        logger.info("Startup task cancelled.")
+
+    if server.job_runner:
+        await server.job_runner.close()
+        logger.info("Async job runner stopped.")
+
     if server.STREAM_PROCESS:
         server.STREAM_PROCESS.terminate()
         logger.info("STREAM proxy terminated.")
@@ -165,6 +325,20 @@ async def _shutdown_resources():
             pass
         logger.info("Worker task stopped.")
 
+    if server.model_list_refresh_task and not server.model_list_refresh_task.done():
+        server.model_list_refresh_task.cancel()
+        try:
+            await asyncio.wait_for(server.model_list_refresh_task, timeout=5.0)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            pass
+        logger.info("Model list refresh task stopped.")
+
+    if server.page_supervisor:
+        await server.page_supervisor.close()
+        logger.info("Page failover supervisor stopped.")
+
+    await drain_error_snapshots()
+
     if server.page_instance:
         await _close_page_logic()
     
@@ -176,11 +350,13 @@ async def _shutdown_resources():
         await server.playwright_manager.stop()
         logger.info("Playwright stopped.")
 
+    if server.response_cache:
+        server.response_cache.close()
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """FastAPI application life cycle management"""
     import server
-    from server import queue_worker
 
     original_streams = sys.stdout, sys.stderr
     initial_stdout, initial_stderr = _setup_logging()
@@ -188,40 +364,33 @@ async def lifespan(app: FastAPI):
 
     _initialize_globals()
     _initialize_proxy_settings()
-    load_excluded_models(EXCLUDED_MODELS_FILENAME)
     
     server.is_initializing = True
-    logger.info("Starting AI Studio Proxy Server...")
+    server.startup_error = None
+    server.startup_timings = {}
+    logger.info("Starting AI Studio Proxy Server (warming up in background)...")
+    server.startup_task = asyncio.create_task(_run_startup())
 
     try:
-        await _start_stream_proxy()
-        await _initialize_browser_and_page()
-        
-        launch_mode = os.environ.get('LAUNCH_MODE', 'unknown')
-        if server.is_page_ready or launch_mode == "direct_debug_no_browser":
-            server.worker_task = asyncio.create_task(queue_worker())
-            logger.info("Request processing worker started.")
-        else:
-            raise RuntimeError("Failed to initialize browser/page, worker not started.")
-
-        logger.info("Server startup complete.")
-        server.is_initializing = False
         yield
-    except Exception as e:
-        logger.critical(f"Application startup failed: {e}", exc_info=True)
-        await _shutdown_resources()
-        raise RuntimeError(f"Application startup failed: {e}") from e
     finally:
         logger.info("Shutting down server...")
         await _shutdown_resources()
         restore_original_streams(initial_stdout, initial_stderr)
         restore_original_streams(*original_streams)
         logger.info("Server shutdown complete.")
+        shutdown_server_logging()
+
 
+class APIKeyAuthMiddleware:
+    """
+    API 密钥认证中间件（纯 ASGI 实现）。
+    认证通过后直接调用下游应用，不像 BaseHTTPMiddleware 那样经由额外的任务和内存流转发响应体，
+    SSE 等流式响应逐块直接写出，客户端断开也能直接传递给下游。
+    """
 
-class APIKeyAuthMiddleware(BaseHTTPMiddleware):
     def __init__(self, app: ASGIApp):
-        super().__init__(app)
+        self.app = app
         self.excluded_paths = [
             "/v1/models",
             "/health",
@@ -232,33 +401,38 @@ class APIKeyAuthMiddleware(BaseHTTPMiddleware):
             "/favicon.ico"
         ]
 
-    async def dispatch(self, request: Request, call_next: Callable[[Request], Awaitable]):
-        if not auth_utils.API_KEYS:  # 如果 API_KEYS 为空，则不进行验证
-            return await call_next(request)
-
+    def _requires_auth(self, path: str) -> bool:
         # 检查是否是需要保护的路径
-        if not request.url.path.startswith("/v1/"):
-            return await call_next(request)
-
+        if not path.startswith("/v1/"):
+            return False
         # 检查是否是排除的路径
         for excluded_path in self.excluded_paths:
-            if request.url.path == excluded_path or request.url.path.startswith(excluded_path + "/"):
-                return await call_next(request)
+            if path == excluded_path or path.startswith(excluded_path + "/"):
+                return False
+        return True
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        # 只处理 HTTP 请求；没有配置 API 密钥时不进行验证
+        if scope["type"] != "http" or not self._requires_auth(scope["path"]) or not auth_utils.keys_required():
+            await self.app(scope, receive, send)
+            return
 
         # 支持多种认证头格式以兼容OpenAI标准
+        headers = Headers(scope=scope)
         api_key = None
 
         # 1. 优先检查标准的 Authorization: Bearer <token> 头
-        auth_header = request.headers.get("Authorization")
+        auth_header = headers.get("Authorization")
         if auth_header and auth_header.startswith("Bearer "):
             api_key = auth_header[7:]  # 移除 "Bearer " 前缀
 
         # 2. 回退到自定义的 X-API-Key 头（向后兼容）
         if not api_key:
-            api_key = request.headers.get("X-API-Key")
+            api_key = headers.get("X-API-Key")
 
-        if not api_key or not auth_utils.verify_api_key(api_key):
-            return JSONResponse(
+        key_info = auth_utils.get_key_info(api_key) if api_key else None
+        if key_info is None:
+            response = JSONResponse(
                 status_code=401,
                 content={
                     "error": {
@@ -269,7 +443,30 @@ class APIKeyAuthMiddleware(BaseHTTPMiddleware):
                     }
                 }
             )
-        return await call_next(request)
+            await response(scope, receive, send)
+            return
+
+        # 按密钥元数据中的 rpm 限速
+        retry_after = key_info.acquire()
+        if retry_after > 0:
+            response = JSONResponse(
+                status_code=429,
+                headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+                content={
+                    "error": {
+                        "message": f"Rate limit exceeded for this API key ({key_info.rpm:g} requests per minute). Retry after {retry_after:.0f} seconds.",
+                        "type": "rate_limit_error",
+                        "param": None,
+                        "code": "api_key_rate_limited"
+                    }
+                }
+            )
+            await response(scope, receive, send)
+            return
+
+        # 与 request.state.api_key_info 对应
+        scope.setdefault("state", {})["api_key_info"] = key_info
+        await self.app(scope, receive, send)
 
 def create_app() -> FastAPI:
     """创建FastAPI应用实例"""
@@ -288,6 +485,8 @@ def create_app() -> FastAPI:
         read_index, get_css, get_js, get_api_info,
         health_check, list_models, chat_completions,
         cancel_request, get_queue_status, websocket_log_endpoint,
+        submit_job, get_job, cancel_job,
+        upload_file, get_file, get_file_content, create_batch, get_batch, list_batches, cancel_batch,
         get_api_keys, add_api_key, test_api_key, delete_api_key
     )
     from fastapi.responses import FileResponse
@@ -301,6 +500,16 @@ def create_app() -> FastAPI:
     app.post("/v1/chat/completions")(chat_completions)
     app.post("/v1/cancel/{req_id}")(cancel_request)
     app.get("/v1/queue")(get_queue_status)
+    app.post("/v1/jobs", status_code=202)(submit_job)
+    app.get("/v1/jobs/{job_id}")(get_job)
+    app.post("/v1/jobs/{job_id}/cancel")(cancel_job)
+    app.post("/v1/files")(upload_file)
+    app.get("/v1/files/{file_id}")(get_file)
+    app.get("/v1/files/{file_id}/content")(get_file_content)
+    app.post("/v1/batches")(create_batch)
+    app.get("/v1/batches")(list_batches)
+    app.get("/v1/batches/{batch_id}")(get_batch)
+    app.post("/v1/batches/{batch_id}/cancel")(cancel_batch)
     app.websocket("/ws/logs")(websocket_log_endpoint)
 
     # API密钥管理端点
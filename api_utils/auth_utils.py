@@ -1,32 +1,241 @@
+import hashlib
+import json
 import os
-from typing import Set
+import tempfile
+import threading
+import time
+from dataclasses import dataclass, field
+from types import MappingProxyType
+from typing import Any, Dict, List, Mapping, NamedTuple, Optional, Tuple
+
+from .rate_limiter import TokenBucket
 
-API_KEYS: Set[str] = set()
 KEY_FILE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "key.txt")
+# key.txt is re-checked (one stat call) at most this often; edits made outside the admin API
+# are picked up on the next request after the interval.
+KEY_FILE_CHECK_INTERVAL_SECONDS = 2.0
+
+
+@dataclass
+class ApiKeyInfo:
+    """
+    A configured API key. Optional metadata follows the key on the same line of key.txt
+    as a JSON object, e.g. `sk-team-a {"name": "team-a", "rpm": 30, "models": ["gemini-2.5-pro"]}`.
+    """
+    key: str
+    digest: bytes
+    metadata: Dict[str, Any] = field(default_factory=dict)
+    bucket: Optional[TokenBucket] = None
+
+    @property
+    def rpm(self) -> Optional[float]:
+        rpm = self.metadata.get("rpm")
+        return float(rpm) if isinstance(rpm, (int, float)) and rpm > 0 else None
+
+    @property
+    def allowed_models(self) -> Optional[List[str]]:
+        models = self.metadata.get("models")
+        return [str(m) for m in models] if isinstance(models, list) and models else None
+
+    def allows_model(self, model_id: str) -> bool:
+        allowed = self.allowed_models
+        return allowed is None or model_id in allowed
+
+    def acquire(self) -> float:
+        """Takes one request from this key's rpm allowance; returns 0, or the seconds to wait when exhausted."""
+        if self.rpm is None:
+            return 0.0
+        if self.bucket is None:
+            self.bucket = TokenBucket(self.rpm)
+        wait = self.bucket.wait_seconds()
+        if wait <= 0:
+            self.bucket.take()
+        return wait
+
+    def masked(self) -> str:
+        return f"{self.key[:4]}...{self.key[-4:]}"
+
+
+class _KeyStore(NamedTuple):
+    """An immutable snapshot of key.txt: key -> info, digest -> info and the file signature it was read at."""
+    keys: Mapping[str, ApiKeyInfo]
+    by_digest: Mapping[bytes, ApiKeyInfo]
+    signature: Optional[Tuple[int, int]]
+
+
+# Published with a single assignment, so readers on the event loop never see a half-loaded set.
+_store = _KeyStore(MappingProxyType({}), MappingProxyType({}), None)
+# Serializes reloads and the admin API's read-modify-write of key.txt, which run in worker threads.
+_lock = threading.Lock()
+_last_checked = 0.0
+
+
+def _digest(key: str) -> bytes:
+    return hashlib.sha256(key.encode("utf-8")).digest()
+
+
+def _parse_line(line: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+    line = line.strip()
+    if not line or line.startswith("#"):
+        return None
+    key, _, rest = line.partition(" ")
+    metadata: Any = {}
+    rest = rest.strip()
+    if rest:
+        try:
+            metadata = json.loads(rest)
+        except ValueError:
+            metadata = None
+        if not isinstance(metadata, dict):
+            # Not a metadata object: treat the whole line as the key, as before metadata existed
+            return line, {}
+    return key, metadata
+
+
+def _line_key(line: str) -> Optional[str]:
+    parsed = _parse_line(line)
+    return parsed[0] if parsed else None
+
+
+def _format_line(key: str, metadata: Dict[str, Any]) -> str:
+    return f"{key} {json.dumps(metadata, ensure_ascii=False)}" if metadata else key
+
+
+def _stat_signature() -> Optional[Tuple[int, int]]:
+    try:
+        stat = os.stat(KEY_FILE_PATH)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def api_keys() -> Mapping[str, ApiKeyInfo]:
+    """The currently loaded keys (key -> info), read-only."""
+    return _store.keys
+
 
 def load_api_keys():
-    """Loads API keys from the key file into the API_KEYS set."""
-    global API_KEYS
-    API_KEYS.clear()
-    if os.path.exists(KEY_FILE_PATH):
-        with open(KEY_FILE_PATH, "r") as f:
+    """Loads API keys (and their metadata) from the key file into the in-memory store."""
+    with _lock:
+        _load_locked()
+
+
+def _load_locked():
+    global _store
+    signature = _stat_signature()
+    keys: Dict[str, ApiKeyInfo] = {}
+    if signature is not None:
+        with open(KEY_FILE_PATH, "r", encoding="utf-8") as f:
             for line in f:
-                key = line.strip()
-                if key:
-                    API_KEYS.add(key)
+                parsed = _parse_line(line)
+                if parsed is None:
+                    continue
+                key, metadata = parsed
+                previous = _store.keys.get(key)
+                info = ApiKeyInfo(key=key, digest=_digest(key), metadata=metadata)
+                if previous is not None and previous.rpm == info.rpm:
+                    info.bucket = previous.bucket
+                keys[key] = info
+    _store = _KeyStore(
+        MappingProxyType(keys), MappingProxyType({info.digest: info for info in keys.values()}), signature
+    )
+
+
+def refresh_keys_if_changed(force: bool = False):
+    """Reloads the key file when its mtime/size changed; stats the file at most every few seconds."""
+    global _last_checked
+    now = time.monotonic()
+    if not force and now - _last_checked < KEY_FILE_CHECK_INTERVAL_SECONDS:
+        return
+    _last_checked = now
+    if _stat_signature() != _store.signature:
+        load_api_keys()
+
 
 def initialize_keys():
     """Initializes API keys. Ensures key.txt exists and loads keys."""
+    global _last_checked
     if not os.path.exists(KEY_FILE_PATH):
         with open(KEY_FILE_PATH, "w") as f:
             pass  # Create an empty file
     load_api_keys()
+    _last_checked = time.monotonic()
+
+
+def keys_required() -> bool:
+    """Whether requests must carry an API key (at least one key is configured)."""
+    refresh_keys_if_changed()
+    return bool(_store.keys)
+
+
+def get_key_info(api_key: str) -> Optional[ApiKeyInfo]:
+    """Looks up a key by its SHA-256 digest, so the plaintext key is never compared directly."""
+    refresh_keys_if_changed()
+    return _store.by_digest.get(_digest(api_key))
+
 
 def verify_api_key(api_key_from_header: str) -> bool:
     """
     Verifies the API key.
-    Returns True if API_KEYS is empty (no validation) or if the key is valid.
+    Returns True if no keys are configured (no validation) or if the key is valid.
+    """
+    if not keys_required():
+        return True
+    return get_key_info(api_key_from_header) is not None
+
+
+def _rewrite_key_file(transform) -> bool:
     """
-    if not API_KEYS:
+    Rewrites key.txt atomically (temp file + os.replace) and reloads it, all under the store lock.
+    transform maps the old lines to the new ones, or returns None to leave the file untouched;
+    returns whether the file was rewritten.
+    """
+    with _lock:
+        lines: List[str] = []
+        if os.path.exists(KEY_FILE_PATH):
+            with open(KEY_FILE_PATH, "r", encoding="utf-8") as f:
+                lines = [line.rstrip("\r\n") for line in f]
+        new_lines = transform(lines)
+        if new_lines is None:
+            return False
+        _write_lines(new_lines)
+        _load_locked()
         return True
-    return api_key_from_header in API_KEYS
\ No newline at end of file
+
+
+def _write_lines(new_lines: List[str]):
+    directory = os.path.dirname(KEY_FILE_PATH)
+    fd, tmp_path = tempfile.mkstemp(prefix=".key.", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write("\n".join(new_lines) + ("\n" if new_lines else ""))
+        if os.path.exists(KEY_FILE_PATH):
+            os.chmod(tmp_path, os.stat(KEY_FILE_PATH).st_mode & 0o777)
+        os.replace(tmp_path, KEY_FILE_PATH)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def add_api_key(key: str, metadata: Optional[Dict[str, Any]] = None) -> bool:
+    """Appends a key (with optional metadata), keeping existing lines and comments; False if it already exists."""
+    new_line = _format_line(key, metadata or {})
+
+    def transform(lines: List[str]) -> Optional[List[str]]:
+        if any(_line_key(line) == key for line in lines):
+            return None
+        return [line for line in lines if line.strip()] + [new_line]
+
+    return _rewrite_key_file(transform)
+
+
+def delete_api_key(key: str) -> bool:
+    """Removes every line for the given key; False if the key is not in the file."""
+
+    def transform(lines: List[str]) -> Optional[List[str]]:
+        if not any(_line_key(line) == key for line in lines):
+            return None
+        return [line for line in lines if line.strip() and _line_key(line) != key]
+
+    return _rewrite_key_file(transform)
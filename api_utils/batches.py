@@ -0,0 +1,407 @@
+"""
+批处理模块（兼容 OpenAI Batch API）
+上传的 JSONL 输入文件中每一行是一个 /v1/chat/completions 请求，创建批处理时逐行校验后作为低优先级任务
+一次性写入任务表 (jobs.py)，由 JobRunner 在请求队列空闲时调度，并优先选择与页面当前模型相同的请求。
+每个请求结束后结果立即追加到输出 / 错误 JSONL 文件；任务表即检查点，重启后按任务表重建输出文件并继续执行。
+"""
+
+import asyncio
+import json
+import os
+import time
+import uuid
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+from pydantic import ValidationError
+
+from config import BATCH_MAX_REQUESTS, BATCH_MAX_FILE_MB, JOBS_DB_PATH
+from models import ChatCompletionRequest
+
+from .jobs import JobRunner, JobStore, PRIORITY_BATCH
+
+SUPPORTED_ENDPOINTS = ("/v1/chat/completions",)
+SUPPORTED_COMPLETION_WINDOWS = ("24h",)
+# 处理中的批处理状态；其余为终态
+_ACTIVE_STATUSES = ("in_progress", "cancelling")
+# 请求体中与批处理无关的扩展字段
+_IGNORED_BODY_FIELDS = ("stream", "stream_flush_bytes", "stream_flush_interval_ms", "max_queue_wait_seconds")
+
+
+class BatchError(Exception):
+    """批处理请求无效，由路由转换为 400/404 响应"""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+def _file_object(row: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "id": row["id"],
+        "object": "file",
+        "bytes": row["bytes"],
+        "created_at": int(row["created_at"]),
+        "filename": row["filename"],
+        "purpose": row["purpose"],
+    }
+
+
+class BatchManager:
+    """批处理和文件的存储与调度，与 JobRunner 共用同一个 SQLite 数据库"""
+
+    def __init__(self, runner: JobRunner, files_dir: str, max_requests: int = BATCH_MAX_REQUESTS,
+                 max_file_bytes: int = BATCH_MAX_FILE_MB * 1024 * 1024):
+        self.runner = runner
+        self.store: JobStore = runner.store
+        self.files_dir = files_dir
+        self.max_requests = max_requests
+        self.max_file_bytes = max_file_bytes
+        # 输出文件的追加和批处理的完成检查串行执行
+        self._output_lock = asyncio.Lock()
+        os.makedirs(files_dir, exist_ok=True)
+        with self.store.transaction() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS files ("
+                "id TEXT PRIMARY KEY, filename TEXT NOT NULL, purpose TEXT NOT NULL, bytes INTEGER NOT NULL, "
+                "created_at REAL NOT NULL)"
+            )
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS batches ("
+                "id TEXT PRIMARY KEY, status TEXT NOT NULL, endpoint TEXT NOT NULL, completion_window TEXT NOT NULL, "
+                "input_file_id TEXT NOT NULL, output_file_id TEXT NOT NULL, error_file_id TEXT NOT NULL, "
+                "total INTEGER NOT NULL, metadata TEXT, created_at REAL NOT NULL, in_progress_at REAL, "
+                "cancelling_at REAL, completed_at REAL, cancelled_at REAL)"
+            )
+        runner.finish_callbacks.append(self.on_job_finished)
+        runner.purge_callbacks.append(self.purge_finished)
+
+    @classmethod
+    def from_config(cls, runner: JobRunner) -> "BatchManager":
+        files_dir = os.path.join(os.path.dirname(os.path.abspath(JOBS_DB_PATH)), "batch_files")
+        return cls(runner, files_dir)
+
+    def file_path(self, file_id: str) -> str:
+        return os.path.join(self.files_dir, f"{file_id}.jsonl")
+
+    # --- 文件 ---
+    async def save_upload(self, filename: str, purpose: str, chunks: AsyncIterator[bytes]) -> Dict[str, Any]:
+        """把上传内容逐块写入磁盘 (不在内存中保留整个文件)，返回 OpenAI 格式的文件对象"""
+        if purpose != "batch":
+            raise BatchError(f"不支持的 purpose '{purpose}'，只支持 'batch'。")
+        file_id = f"file-{uuid.uuid4().hex}"
+        path = self.file_path(file_id)
+        size = 0
+        try:
+            with open(path, "wb") as f:
+                async for chunk in chunks:
+                    size += len(chunk)
+                    if size > self.max_file_bytes:
+                        raise BatchError(f"文件超过 {self.max_file_bytes // (1024 * 1024)} MB 上限。", status_code=413)
+                    await asyncio.to_thread(f.write, chunk)
+        except BaseException:
+            if os.path.exists(path):
+                os.remove(path)
+            raise
+        row = {"id": file_id, "filename": filename, "purpose": purpose, "bytes": size, "created_at": time.time()}
+        await asyncio.to_thread(self._insert_file_row, row)
+        return _file_object(row)
+
+    def _insert_file_row(self, row: Dict[str, Any]) -> None:
+        with self.store.transaction() as db:
+            db.execute(
+                "INSERT INTO files (id, filename, purpose, bytes, created_at) VALUES (?, ?, ?, ?, ?)",
+                (row["id"], row["filename"], row["purpose"], row["bytes"], row["created_at"])
+            )
+
+    def _get_file_row(self, file_id: str) -> Optional[Dict[str, Any]]:
+        with self.store.transaction() as db:
+            row = db.execute("SELECT * FROM files WHERE id = ?", (file_id,)).fetchone()
+        if row is None:
+            return None
+        row = dict(row)
+        if row["purpose"] == "batch_output" and os.path.exists(self.file_path(file_id)):
+            # 输出文件随结果追加而增长
+            row["bytes"] = os.path.getsize(self.file_path(file_id))
+        return row
+
+    async def get_file(self, file_id: str) -> Optional[Dict[str, Any]]:
+        row = await asyncio.to_thread(self._get_file_row, file_id)
+        return _file_object(row) if row is not None else None
+
+    # --- 创建批处理 ---
+    def _parse_input(self, input_file_id: str, endpoint: str,
+                     check_model: Optional[Callable[[ChatCompletionRequest], None]]) -> List[Tuple[str, Dict[str, Any]]]:
+        """逐行校验输入文件，返回 [(custom_id, 请求体)]；有无效行时抛出 BatchError 并列出前几个错误"""
+        path = self.file_path(input_file_id)
+        if self._get_file_row(input_file_id) is None or not os.path.exists(path):
+            raise BatchError(f"输入文件 {input_file_id} 不存在。", status_code=404)
+        items: List[Tuple[str, Dict[str, Any]]] = []
+        seen_ids = set()
+        errors: List[str] = []
+        with open(path, "r", encoding="utf-8") as f:
+            for line_no, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    entry = json.loads(line)
+                    custom_id = entry.get("custom_id")
+                    if not isinstance(custom_id, str) or not custom_id:
+                        raise ValueError("缺少 custom_id")
+                    if custom_id in seen_ids:
+                        raise ValueError(f"custom_id '{custom_id}' 重复")
+                    if entry.get("method", "POST") != "POST" or entry.get("url", endpoint) != endpoint:
+                        raise ValueError(f"method/url 必须为 POST {endpoint}")
+                    body = {k: v for k, v in entry.get("body", {}).items() if k not in _IGNORED_BODY_FIELDS}
+                    request = ChatCompletionRequest(**body)
+                    if check_model is not None:
+                        check_model(request)
+                except (ValueError, TypeError, AttributeError, ValidationError, BatchError) as e:
+                    message = e.message if isinstance(e, BatchError) else str(e).splitlines()[0]
+                    errors.append(f"第 {line_no} 行: {message}")
+                    if len(errors) >= 10:
+                        break
+                    continue
+                seen_ids.add(custom_id)
+                items.append((custom_id, body))
+                if len(items) > self.max_requests:
+                    raise BatchError(f"批处理最多包含 {self.max_requests} 个请求。")
+        if errors:
+            raise BatchError("输入文件无效: " + "; ".join(errors))
+        if not items:
+            raise BatchError("输入文件中没有请求。")
+        return items
+
+    def _create_batch_rows(self, items: List[Tuple[str, Dict[str, Any]]], input_file_id: str, endpoint: str,
+                           completion_window: str, metadata: Optional[Dict[str, Any]]) -> str:
+        batch_id = f"batch_{uuid.uuid4().hex}"
+        output_file_id, error_file_id = f"file-{uuid.uuid4().hex}", f"file-{uuid.uuid4().hex}"
+        now = time.time()
+        for file_id in (output_file_id, error_file_id):
+            open(self.file_path(file_id), "w", encoding="utf-8").close()
+        with self.store.transaction() as db:
+            db.execute(
+                "INSERT INTO batches (id, status, endpoint, completion_window, input_file_id, output_file_id, "
+                "error_file_id, total, metadata, created_at, in_progress_at) VALUES (?, 'in_progress', ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (batch_id, endpoint, completion_window, input_file_id, output_file_id, error_file_id, len(items),
+                 json.dumps(metadata, ensure_ascii=False) if metadata else None, now, now)
+            )
+            db.executemany(
+                "INSERT INTO files (id, filename, purpose, bytes, created_at) VALUES (?, ?, 'batch_output', 0, ?)",
+                [(output_file_id, f"{batch_id}_output.jsonl", now), (error_file_id, f"{batch_id}_error.jsonl", now)]
+            )
+            for custom_id, body in items:
+                JobStore.insert(db, body, priority=PRIORITY_BATCH, batch_id=batch_id, custom_id=custom_id)
+        return batch_id
+
+    async def create_batch(self, input_file_id: str, endpoint: str, completion_window: str,
+                           metadata: Optional[Dict[str, Any]] = None,
+                           check_model: Optional[Callable[[ChatCompletionRequest], None]] = None) -> Dict[str, Any]:
+        if endpoint not in SUPPORTED_ENDPOINTS:
+            raise BatchError(f"不支持的 endpoint '{endpoint}'，只支持 {', '.join(SUPPORTED_ENDPOINTS)}。")
+        if completion_window not in SUPPORTED_COMPLETION_WINDOWS:
+            raise BatchError(f"不支持的 completion_window '{completion_window}'。")
+        items = await asyncio.to_thread(self._parse_input, input_file_id, endpoint, check_model)
+        batch_id = await asyncio.to_thread(
+            self._create_batch_rows, items, input_file_id, endpoint, completion_window, metadata
+        )
+        self.runner.wake()
+        return await self.get_batch(batch_id)
+
+    # --- 查询 ---
+    def _batch_object(self, db, row) -> Dict[str, Any]:
+        counts = dict(db.execute(
+            "SELECT status, COUNT(*) FROM jobs WHERE batch_id = ? GROUP BY status", (row["id"],)
+        ).fetchall())
+        return {
+            "id": row["id"],
+            "object": "batch",
+            "endpoint": row["endpoint"],
+            "errors": None,
+            "input_file_id": row["input_file_id"],
+            "completion_window": row["completion_window"],
+            "status": row["status"],
+            "output_file_id": row["output_file_id"],
+            "error_file_id": row["error_file_id"],
+            "created_at": int(row["created_at"]),
+            "in_progress_at": int(row["in_progress_at"]) if row["in_progress_at"] else None,
+            "expires_at": None,
+            "cancelling_at": int(row["cancelling_at"]) if row["cancelling_at"] else None,
+            "completed_at": int(row["completed_at"]) if row["completed_at"] else None,
+            "cancelled_at": int(row["cancelled_at"]) if row["cancelled_at"] else None,
+            "request_counts": {
+                "total": row["total"],
+                "completed": counts.get("succeeded", 0),
+                "failed": counts.get("failed", 0),
+            },
+            "metadata": json.loads(row["metadata"]) if row["metadata"] else None,
+        }
+
+    def _get_batch(self, batch_id: str) -> Optional[Dict[str, Any]]:
+        with self.store.transaction() as db:
+            row = db.execute("SELECT * FROM batches WHERE id = ?", (batch_id,)).fetchone()
+            return self._batch_object(db, row) if row is not None else None
+
+    async def get_batch(self, batch_id: str) -> Optional[Dict[str, Any]]:
+        return await asyncio.to_thread(self._get_batch, batch_id)
+
+    def _list_batches(self, limit: int, after: Optional[str]) -> Dict[str, Any]:
+        with self.store.transaction() as db:
+            if after:
+                rows = db.execute(
+                    "SELECT * FROM batches WHERE created_at < (SELECT created_at FROM batches WHERE id = ?) "
+                    "ORDER BY created_at DESC LIMIT ?", (after, limit + 1)
+                ).fetchall()
+            else:
+                rows = db.execute("SELECT * FROM batches ORDER BY created_at DESC LIMIT ?", (limit + 1,)).fetchall()
+            data = [self._batch_object(db, row) for row in rows[:limit]]
+        return {
+            "object": "list",
+            "data": data,
+            "first_id": data[0]["id"] if data else None,
+            "last_id": data[-1]["id"] if data else None,
+            "has_more": len(rows) > limit,
+        }
+
+    async def list_batches(self, limit: int = 20, after: Optional[str] = None) -> Dict[str, Any]:
+        return await asyncio.to_thread(self._list_batches, max(1, min(limit, 100)), after)
+
+    # --- 取消 ---
+    def _mark_cancelling(self, batch_id: str) -> Optional[List[str]]:
+        """标记为取消中并取消排队中的请求，返回仍在执行的任务 ID；批处理不存在或已结束时返回 None"""
+        now = time.time()
+        with self.store.transaction() as db:
+            cursor = db.execute(
+                "UPDATE batches SET status = 'cancelling', cancelling_at = ? WHERE id = ? AND status = 'in_progress'",
+                (now, batch_id)
+            )
+            if cursor.rowcount == 0:
+                return None
+            db.execute(
+                "UPDATE jobs SET status = 'cancelled', status_code = 499, error = '批处理已被取消', finished_at = ? "
+                "WHERE batch_id = ? AND status = 'queued'", (now, batch_id)
+            )
+            return [row["id"] for row in db.execute(
+                "SELECT id FROM jobs WHERE batch_id = ? AND status = 'running'", (batch_id,)
+            )]
+
+    async def cancel_batch(self, batch_id: str) -> Optional[Dict[str, Any]]:
+        running_job_ids = await asyncio.to_thread(self._mark_cancelling, batch_id)
+        if running_job_ids is not None:
+            for job_id in running_job_ids:
+                await self.runner.cancel(job_id)
+            async with self._output_lock:
+                await asyncio.to_thread(self._finalize_if_done, batch_id)
+        return await self.get_batch(batch_id)
+
+    # --- 结果输出 ---
+    @staticmethod
+    def _result_line(job: Dict[str, Any]) -> Tuple[bool, str]:
+        """返回 (是否成功, 输出行)，格式与 OpenAI Batch API 的输出文件一致"""
+        succeeded = job["status"] == "succeeded"
+        body = job["response"] if succeeded else {
+            "error": {"message": job["error"], "type": "batch_request_error", "code": job["status_code"]}
+        }
+        line = json.dumps({
+            "id": f"batch_req_{job['id'][len('job-'):]}",
+            "custom_id": job["custom_id"],
+            "response": {"status_code": job["status_code"], "request_id": job["id"], "body": body},
+            "error": None,
+        }, ensure_ascii=False)
+        return succeeded, line
+
+    def _append_result(self, job_id: str) -> Optional[str]:
+        """把结束的批处理请求追加到输出或错误文件，返回所属批处理 ID (不属于批处理时为 None)"""
+        job = self.store.get(job_id)
+        if job is None or not job["batch_id"] or job["status"] == "cancelled":
+            return job["batch_id"] if job else None
+        with self.store.transaction() as db:
+            row = db.execute(
+                "SELECT output_file_id, error_file_id FROM batches WHERE id = ?", (job["batch_id"],)
+            ).fetchone()
+        if row is None:
+            return None
+        succeeded, line = self._result_line(job)
+        with open(self.file_path(row["output_file_id"] if succeeded else row["error_file_id"]), "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+        return job["batch_id"]
+
+    def _finalize_if_done(self, batch_id: str) -> None:
+        """所有请求都已结束时把批处理标记为完成 (或已取消)"""
+        now = time.time()
+        with self.store.transaction() as db:
+            pending = db.execute(
+                "SELECT COUNT(*) FROM jobs WHERE batch_id = ? AND status IN ('queued', 'running')", (batch_id,)
+            ).fetchone()[0]
+            if pending:
+                return
+            db.execute(
+                "UPDATE batches SET status = 'completed', completed_at = ? WHERE id = ? AND status = 'in_progress'",
+                (now, batch_id)
+            )
+            db.execute(
+                "UPDATE batches SET status = 'cancelled', cancelled_at = ? WHERE id = ? AND status = 'cancelling'",
+                (now, batch_id)
+            )
+            row = db.execute("SELECT output_file_id, error_file_id FROM batches WHERE id = ?", (batch_id,)).fetchone()
+            for file_id in (row["output_file_id"], row["error_file_id"]):
+                path = self.file_path(file_id)
+                size = os.path.getsize(path) if os.path.exists(path) else 0
+                db.execute("UPDATE files SET bytes = ? WHERE id = ?", (size, file_id))
+
+    async def on_job_finished(self, job_id: str) -> None:
+        async with self._output_lock:
+            batch_id = await asyncio.to_thread(self._append_result, job_id)
+            if batch_id:
+                await asyncio.to_thread(self._finalize_if_done, batch_id)
+
+    # --- 检查点恢复与清理 ---
+    def _rebuild_outputs(self) -> int:
+        """按任务表重写处理中批处理的输出文件，丢弃上次退出前未记录完整的行"""
+        with self.store.transaction() as db:
+            batch_ids = [row["id"] for row in db.execute(
+                f"SELECT id FROM batches WHERE status IN ({', '.join('?' * len(_ACTIVE_STATUSES))})", _ACTIVE_STATUSES
+            )]
+        for batch_id in batch_ids:
+            with self.store.transaction() as db:
+                row = db.execute("SELECT output_file_id, error_file_id FROM batches WHERE id = ?", (batch_id,)).fetchone()
+                job_ids = [r["id"] for r in db.execute(
+                    "SELECT id FROM jobs WHERE batch_id = ? AND status IN ('succeeded', 'failed') ORDER BY finished_at",
+                    (batch_id,)
+                )]
+            with open(self.file_path(row["output_file_id"]), "w", encoding="utf-8") as output_file, \
+                    open(self.file_path(row["error_file_id"]), "w", encoding="utf-8") as error_file:
+                for job_id in job_ids:
+                    succeeded, line = self._result_line(self.store.get(job_id))
+                    (output_file if succeeded else error_file).write(line + "\n")
+            self._finalize_if_done(batch_id)
+        return len(batch_ids)
+
+    def recover(self) -> int:
+        """启动时 (调度开始前) 恢复处理中的批处理，返回批处理数"""
+        return self._rebuild_outputs()
+
+    def _purge(self, before: float) -> None:
+        """清理已结束的批处理 (连同其任务和输出文件)，以及不再被引用的上传文件"""
+        removed_file_ids: List[str] = []
+        with self.store.transaction() as db:
+            rows = db.execute(
+                "SELECT id, output_file_id, error_file_id FROM batches "
+                "WHERE status IN ('completed', 'cancelled') AND COALESCE(completed_at, cancelled_at) < ?", (before,)
+            ).fetchall()
+            for row in rows:
+                db.execute("DELETE FROM jobs WHERE batch_id = ?", (row["id"],))
+                db.execute("DELETE FROM batches WHERE id = ?", (row["id"],))
+                removed_file_ids += [row["output_file_id"], row["error_file_id"]]
+            removed_file_ids += [row["id"] for row in db.execute(
+                "SELECT id FROM files WHERE purpose = 'batch' AND created_at < ? "
+                "AND id NOT IN (SELECT input_file_id FROM batches)", (before,)
+            )]
+            db.executemany("DELETE FROM files WHERE id = ?", [(file_id,) for file_id in removed_file_ids])
+        for file_id in removed_file_ids:
+            if os.path.exists(self.file_path(file_id)):
+                os.remove(self.file_path(file_id))
+
+    async def purge_finished(self, before: float) -> None:
+        async with self._output_lock:
+            await asyncio.to_thread(self._purge, before)
@@ -36,6 +36,16 @@ def get_server_state() -> Dict[str, Any]:
         "is_page_ready": is_page_ready,
     }
 
+def get_startup_status() -> Dict[str, Any]:
+    from server import is_initializing, startup_error, startup_timings
+    if startup_error:
+        state = "failed"
+    elif is_initializing:
+        state = "warming"
+    else:
+        state = "ready"
+    return {"state": state, "error": startup_error, "phases_ms": dict(startup_timings)}
+
 def get_page_instance():
     from server import page_instance
     return page_instance
@@ -52,6 +62,34 @@ def get_excluded_model_ids() -> Set[str]:
     from server import excluded_model_ids
     return excluded_model_ids
 
+def get_response_cache():
+    from server import response_cache
+    return response_cache
+
+def get_request_coalescer():
+    from server import request_coalescer
+    return request_coalescer
+
+def get_page_supervisor():
+    from server import page_supervisor
+    return page_supervisor
+
+def get_rate_limiter():
+    from server import rate_limiter
+    return rate_limiter
+
+def get_admission_controller():
+    from server import admission_controller
+    return admission_controller
+
+def get_job_runner():
+    from server import job_runner
+    return job_runner
+
+def get_batch_manager():
+    from server import batch_manager
+    return batch_manager
+
 def get_current_ai_studio_model_id() -> str:
     from server import current_ai_studio_model_id
     return current_ai_studio_model_id
\ No newline at end of file
@@ -0,0 +1,406 @@
+"""
+异步任务模块（持久化请求队列）
+通过 /v1/jobs 提交的聊天请求写入 SQLite (WAL) 后立即返回任务 ID，由 JobRunner 按提交顺序取出，
+以非流式方式送入现有的请求队列交给 Worker 处理，结果写回数据库，客户端通过 /v1/jobs/{id} 获取。
+任务积压在数据库中而不是内存队列或 HTTP 连接上；进程重启后，未完成（含执行中断）的任务重新排队执行。
+批处理 (batches.py) 的每一行请求也作为一个低优先级任务保存在同一张表中，只在请求队列空闲时调度。
+"""
+
+import asyncio
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from asyncio import Future
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+from fastapi import HTTPException
+from pydantic import ValidationError
+
+from config import MODEL_NAME, JOBS_DB_PATH, JOBS_MAX_INFLIGHT, JOBS_MAX_ATTEMPTS, JOBS_RETENTION_HOURS
+
+# 这些状态码表示暂时无法处理（配额冷却、服务繁忙），任务稍后重试而不是直接失败
+_RETRYABLE_STATUS_CODES = (429, 503)
+_DEFAULT_RETRY_SECONDS = 30.0
+# 没有可执行任务时的最长休眠时间 (秒)
+_IDLE_POLL_SECONDS = 5.0
+# 请求队列中有实时请求、低优先级任务暂缓调度时的检查间隔 (秒)
+_LOW_PRIORITY_POLL_SECONDS = 1.0
+_PURGE_INTERVAL_SECONDS = 3600.0
+
+JOB_STATUSES = ("queued", "running", "succeeded", "failed", "cancelled")
+# 单独提交的任务优先级为 0，批处理任务为 1 (数值越大优先级越低)
+PRIORITY_NORMAL = 0
+PRIORITY_BATCH = 1
+
+# 在最初的表结构之后增加的列，打开旧数据库时补上
+_ADDED_COLUMNS = (
+    ("priority", "INTEGER NOT NULL DEFAULT 0"),
+    ("model", "TEXT"),
+    ("batch_id", "TEXT"),
+    ("custom_id", "TEXT"),
+    ("req_id", "TEXT"),
+)
+
+
+def _job_model(request_payload: Dict[str, Any]) -> Optional[str]:
+    """任务请求的目标模型 ID，未指定 (使用页面当前模型) 时为 None"""
+    model = request_payload.get("model")
+    if not model or model == MODEL_NAME:
+        return None
+    return str(model).split('/')[-1]
+
+
+def _new_req_id() -> str:
+    """与 /v1/chat/completions 相同格式的 7 位请求 ID，日志前缀、错误快照和追踪采样都依赖这一格式"""
+    return ''.join(random.choices('abcdefghijklmnopqrstuvwxyz0123456789', k=7))
+
+
+class JobStore:
+    """任务表的 SQLite 存储，所有方法都是同步的，由 JobRunner 在线程池中调用"""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        db_dir = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(db_dir, exist_ok=True)
+        self._db: Optional[sqlite3.Connection] = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, status TEXT NOT NULL, request TEXT NOT NULL, response TEXT, "
+            "error TEXT, status_code INTEGER, attempts INTEGER NOT NULL DEFAULT 0, "
+            "not_before REAL NOT NULL DEFAULT 0, created_at REAL NOT NULL, started_at REAL, finished_at REAL, "
+            "priority INTEGER NOT NULL DEFAULT 0, model TEXT, batch_id TEXT, custom_id TEXT, req_id TEXT)"
+        )
+        existing_columns = {row["name"] for row in self._db.execute("PRAGMA table_info(jobs)")}
+        for column, definition in _ADDED_COLUMNS:
+            if column not in existing_columns:
+                self._db.execute(f"ALTER TABLE jobs ADD COLUMN {column} {definition}")
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status_created ON jobs(status, created_at)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_jobs_batch ON jobs(batch_id, status)")
+        self._db.commit()
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """在锁内使用数据库连接，正常退出时提交，出错时回滚"""
+        with self._lock:
+            try:
+                yield self._db
+                self._db.commit()
+            except BaseException:
+                self._db.rollback()
+                raise
+
+    def close(self) -> None:
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    @staticmethod
+    def _row_to_dict(row: sqlite3.Row) -> Dict[str, Any]:
+        job = dict(row)
+        job["request"] = json.loads(job["request"])
+        job["response"] = json.loads(job["response"]) if job["response"] else None
+        return job
+
+    @staticmethod
+    def insert(db: sqlite3.Connection, request_payload: Dict[str, Any], priority: int = PRIORITY_NORMAL,
+               batch_id: Optional[str] = None, custom_id: Optional[str] = None) -> Dict[str, Any]:
+        """在调用方的事务中插入一个排队中的任务"""
+        job_id = f"job-{uuid.uuid4().hex}"
+        now = time.time()
+        db.execute(
+            "INSERT INTO jobs (id, status, request, created_at, priority, model, batch_id, custom_id) "
+            "VALUES (?, 'queued', ?, ?, ?, ?, ?, ?)",
+            (job_id, json.dumps(request_payload, ensure_ascii=False), now, priority,
+             _job_model(request_payload), batch_id, custom_id)
+        )
+        return {"id": job_id, "status": "queued", "created_at": now}
+
+    def create(self, request_payload: Dict[str, Any]) -> Dict[str, Any]:
+        with self.transaction() as db:
+            return self.insert(db, request_payload)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._row_to_dict(row) if row is not None else None
+
+    def recover(self) -> int:
+        """启动时把上次退出时仍在执行的任务放回队列"""
+        with self._lock:
+            cursor = self._db.execute("UPDATE jobs SET status = 'queued', started_at = NULL WHERE status = 'running'")
+            self._db.commit()
+        return cursor.rowcount
+
+    def claim_next(self, now: float, preferred_model: Optional[str] = None, include_low_priority: bool = True,
+                   req_id: Optional[str] = None) -> Optional[Tuple[str, Dict[str, Any], int]]:
+        """
+        取出下一个可执行任务并标记为执行中，返回 (任务 ID, 请求, 第几次执行)。
+        优先级高的先执行，同一优先级按提交顺序；批处理任务优先选择与页面当前模型相同的请求，减少模型切换。
+        req_id 是本次执行使用的请求 ID，记录在任务行中，便于按任务查找日志。
+        """
+        priority_filter = "" if include_low_priority else f"AND priority = {PRIORITY_NORMAL} "
+        with self._lock:
+            row = self._db.execute(
+                "SELECT id, request, attempts FROM jobs WHERE status = 'queued' AND not_before <= ? "
+                f"{priority_filter}"
+                "ORDER BY priority, "
+                "CASE WHEN priority > 0 AND model IS NOT NULL AND model IS NOT ? THEN 1 ELSE 0 END, "
+                "created_at LIMIT 1", (now, preferred_model)
+            ).fetchone()
+            if row is None:
+                return None
+            self._db.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, started_at = ?, req_id = ? WHERE id = ?",
+                (now, req_id, row["id"])
+            )
+            self._db.commit()
+        return row["id"], json.loads(row["request"]), row["attempts"] + 1
+
+    def next_ready_at(self) -> Optional[float]:
+        with self._lock:
+            row = self._db.execute("SELECT MIN(not_before) FROM jobs WHERE status = 'queued'").fetchone()
+        return row[0]
+
+    def complete(self, job_id: str, response: Dict[str, Any]) -> None:
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET status = 'succeeded', response = ?, status_code = 200, error = NULL, finished_at = ? "
+                "WHERE id = ?", (json.dumps(response, ensure_ascii=False), time.time(), job_id)
+            )
+            self._db.commit()
+
+    def finish(self, job_id: str, status: str, status_code: int, error: str) -> None:
+        """任务以失败或取消结束"""
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET status = ?, status_code = ?, error = ?, finished_at = ? WHERE id = ?",
+                (status, status_code, error, time.time(), job_id)
+            )
+            self._db.commit()
+
+    def reschedule(self, job_id: str, not_before: float, status_code: int, error: str) -> None:
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET status = 'queued', not_before = ?, status_code = ?, error = ?, started_at = NULL "
+                "WHERE id = ?", (not_before, status_code, error, job_id)
+            )
+            self._db.commit()
+
+    def cancel_queued(self, job_id: str) -> bool:
+        with self._lock:
+            cursor = self._db.execute(
+                "UPDATE jobs SET status = 'cancelled', status_code = 499, error = '任务已被取消', finished_at = ? "
+                "WHERE id = ? AND status = 'queued'", (time.time(), job_id)
+            )
+            self._db.commit()
+        return cursor.rowcount > 0
+
+    def purge_finished(self, before: float) -> int:
+        """清理已结束的单独任务；批处理任务随批处理一起清理"""
+        with self._lock:
+            cursor = self._db.execute(
+                "DELETE FROM jobs WHERE status IN ('succeeded', 'failed', 'cancelled') AND finished_at < ? "
+                "AND batch_id IS NULL", (before,)
+            )
+            self._db.commit()
+        return cursor.rowcount
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        counts = {status: 0 for status in JOB_STATUSES}
+        counts.update({status: count for status, count in rows})
+        return counts
+
+
+class DetachedRequest:
+    """代替 HTTP 请求对象交给 Worker：没有客户端连接，取消任务时视为客户端断开"""
+
+    def __init__(self):
+        self.cancelled = False
+
+    async def is_disconnected(self) -> bool:
+        return self.cancelled
+
+
+class JobRunner:
+    """从任务表中取出任务送入请求队列，同时在请求队列中的任务不超过 max_inflight 个"""
+
+    def __init__(self, store: JobStore, max_inflight: int = JOBS_MAX_INFLIGHT, max_attempts: int = JOBS_MAX_ATTEMPTS,
+                 retention_hours: float = JOBS_RETENTION_HOURS):
+        self.store = store
+        self.max_inflight = max(1, max_inflight)
+        self.max_attempts = max(1, max_attempts)
+        self.retention_seconds = retention_hours * 3600
+        self._inflight: Dict[str, DetachedRequest] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        self._wakeup = asyncio.Event()
+        self._loop_task: Optional[asyncio.Task] = None
+        self._last_purge = 0.0
+        # 任务结束 (成功、失败或取消) 后以任务 ID 调用；定期清理时以截止时间调用
+        self.finish_callbacks: List[Callable[[str], Awaitable[None]]] = []
+        self.purge_callbacks: List[Callable[[float], Awaitable[None]]] = []
+
+    @classmethod
+    def from_config(cls) -> "JobRunner":
+        return cls(JobStore(JOBS_DB_PATH))
+
+    def start(self) -> int:
+        """恢复中断的任务并启动调度循环，返回恢复的任务数"""
+        recovered = self.store.recover()
+        self._loop_task = asyncio.create_task(self._run())
+        return recovered
+
+    async def close(self) -> None:
+        """停止调度；执行中的任务在数据库中保持 running，下次启动时重新排队"""
+        for detached in self._inflight.values():
+            detached.cancelled = True
+        tasks = [t for t in (self._loop_task, *self._tasks) if t is not None and not t.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.store.close()
+
+    # --- 对外接口 ---
+    async def submit(self, request_payload: Dict[str, Any]) -> Dict[str, Any]:
+        job = await asyncio.to_thread(self.store.create, request_payload)
+        self.wake()
+        return job
+
+    def wake(self) -> None:
+        """有新任务写入数据库时唤醒调度循环"""
+        self._wakeup.set()
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return await asyncio.to_thread(self.store.get, job_id)
+
+    async def cancel(self, job_id: str) -> bool:
+        """取消排队中的任务；执行中的任务按客户端断开处理，由 Worker 中止"""
+        detached = self._inflight.get(job_id)
+        if detached is not None:
+            detached.cancelled = True
+            return True
+        return await asyncio.to_thread(self.store.cancel_queued, job_id)
+
+    async def stats(self) -> Dict[str, Any]:
+        return {
+            "inflight": len(self._inflight),
+            "max_inflight": self.max_inflight,
+            "jobs": await asyncio.to_thread(self.store.counts),
+        }
+
+    # --- 调度 ---
+    async def _run(self) -> None:
+        import server
+        logger = server.logger
+        while True:
+            try:
+                low_priority_deferred = False
+                while len(self._inflight) < self.max_inflight:
+                    # 请求队列中还有实时请求时，批处理任务暂不调度
+                    include_low_priority = server.request_queue is None or server.request_queue.empty()
+                    low_priority_deferred = not include_low_priority
+                    req_id = _new_req_id()
+                    claimed = await asyncio.to_thread(
+                        self.store.claim_next, time.time(), server.current_ai_studio_model_id, include_low_priority, req_id
+                    )
+                    if claimed is None:
+                        break
+                    job_id, request_payload, attempt = claimed
+                    detached = self._inflight[job_id] = DetachedRequest()
+                    task = asyncio.create_task(self._execute(job_id, req_id, request_payload, attempt, detached))
+                    self._tasks.add(task)
+                    task.add_done_callback(self._tasks.discard)
+                await self._purge_if_due()
+                timeout = _LOW_PRIORITY_POLL_SECONDS if low_priority_deferred else _IDLE_POLL_SECONDS
+                if len(self._inflight) < self.max_inflight:
+                    next_ready_at = await asyncio.to_thread(self.store.next_ready_at)
+                    if next_ready_at is not None:
+                        timeout = min(timeout, max(0.0, next_ready_at - time.time()))
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"异步任务调度出错: {e}", exc_info=True)
+                await asyncio.sleep(_IDLE_POLL_SECONDS)
+
+    async def _purge_if_due(self) -> None:
+        now = time.time()
+        if self.retention_seconds <= 0 or now - self._last_purge < _PURGE_INTERVAL_SECONDS:
+            return
+        self._last_purge = now
+        await asyncio.to_thread(self.store.purge_finished, now - self.retention_seconds)
+        for callback in self.purge_callbacks:
+            await callback(now - self.retention_seconds)
+
+    async def _notify_finished(self, job_id: str) -> None:
+        from server import logger
+        for callback in self.finish_callbacks:
+            try:
+                await callback(job_id)
+            except Exception as e:
+                logger.error(f"[{job_id}] 任务结束回调出错: {e}", exc_info=True)
+
+    async def _execute(self, job_id: str, req_id: str, request_payload: Dict[str, Any], attempt: int,
+                       detached: DetachedRequest) -> None:
+        from server import logger, request_queue
+        from models import ChatCompletionRequest
+        try:
+            try:
+                request = ChatCompletionRequest(**{**request_payload, "stream": False})
+            except (ValidationError, TypeError) as e:
+                # 任务跨进程重启保存，升级后请求模型变化可能导致已保存的请求不再有效，直接以失败结束
+                await self._handle_failure(job_id, req_id, attempt, 400, f"任务请求无效: {e}", None)
+                return
+            result_future = Future()
+            logger.info(f"[{req_id}] 异步任务 {job_id} 送入请求队列 (第 {attempt} 次执行)。")
+            await request_queue.put({
+                "req_id": req_id, "request_data": request, "http_request": detached,
+                "result_future": result_future, "enqueue_time": time.time(), "cancelled": False
+            })
+            try:
+                response = await result_future
+                await asyncio.to_thread(self.store.complete, job_id, json.loads(response.body))
+                logger.info(f"[{req_id}] 异步任务 {job_id} 完成。")
+                await self._notify_finished(job_id)
+            except HTTPException as e:
+                await self._handle_failure(job_id, req_id, attempt, e.status_code, str(e.detail), e.headers)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                await self._handle_failure(job_id, req_id, attempt, 500, f"{e.__class__.__name__}: {e}", None)
+        finally:
+            self._inflight.pop(job_id, None)
+            self._wakeup.set()
+
+    async def _handle_failure(self, job_id: str, req_id: str, attempt: int, status_code: int, error: str,
+                              headers: Optional[Dict[str, str]]) -> None:
+        from server import logger
+        if status_code == 499:
+            await asyncio.to_thread(self.store.finish, job_id, "cancelled", status_code, error)
+            logger.info(f"[{req_id}] 异步任务 {job_id} 已取消。")
+            await self._notify_finished(job_id)
+        elif status_code in _RETRYABLE_STATUS_CODES and attempt < self.max_attempts:
+            retry_after = _DEFAULT_RETRY_SECONDS
+            if headers and headers.get("Retry-After", "").isdigit():
+                retry_after = float(headers["Retry-After"])
+            await asyncio.to_thread(self.store.reschedule, job_id, time.time() + retry_after, status_code, error)
+            logger.info(f"[{req_id}] 异步任务 {job_id} 暂时无法处理 ({status_code})，{retry_after:g} 秒后重试。")
+        else:
+            await asyncio.to_thread(self.store.finish, job_id, "failed", status_code, error)
+            logger.warning(f"[{req_id}] 异步任务 {job_id} 失败 ({status_code}): {error}")
+            await self._notify_finished(job_id)
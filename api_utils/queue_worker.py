@@ -4,9 +4,69 @@
 """
 
 import asyncio
+import math
 import time
 from fastapi import HTTPException
 
+from config import PAGE_FAILOVER_WAIT_SECONDS, RATE_LIMIT_MAX_WAIT_SECONDS
+from models import PageFailoverError
+from .rate_limiter import resolve_request_model_id
+
+# 队首请求的模型冷却等待期间，重新检查队列中是否有其他可处理请求的间隔 (秒)
+_RATE_LIMIT_RECHECK_SECONDS = 1.0
+
+
+async def _requeue_after_failover(request_queue, request_item: dict, logger) -> None:
+    """页面故障切换完成后将正在处理的请求放回队首（每个请求只重排一次）"""
+    from server import page_supervisor
+
+    req_id = request_item["req_id"]
+    result_future = request_item["result_future"]
+    if request_item.get("failover_requeued") or page_supervisor is None or page_supervisor.failed:
+        # 故障切换已多次失败时不再等待，直接返回 503
+        if not result_future.done():
+            result_future.set_exception(HTTPException(status_code=503, detail=f"[{req_id}] AI Studio 页面失效，请稍后重试。", headers={"Retry-After": "30"}))
+        return
+
+    logger.info(f"[{req_id}] (Worker) 页面失效，等待故障切换完成后重新排队...")
+    recovered = await page_supervisor.wait_until_ready(PAGE_FAILOVER_WAIT_SECONDS)
+    if result_future.done():
+        return
+    if not recovered:
+        result_future.set_exception(HTTPException(status_code=503, detail=f"[{req_id}] 页面故障切换超时，请稍后重试。", headers={"Retry-After": "30"}))
+        return
+
+    request_item["failover_requeued"] = True
+    pending_items = []
+    while not request_queue.empty():
+        pending_items.append(request_queue.get_nowait())
+    await request_queue.put(request_item)
+    for item in pending_items:
+        await request_queue.put(item)
+    logger.info(f"[{req_id}] (Worker) 故障切换完成，请求已重新放回队首。")
+
+
+async def _yield_to_runnable_request(request_queue, request_item: dict, rate_limiter) -> bool:
+    """
+    队首请求的模型冷却中时，把它放到队列中第一个可以立即处理 (模型不在冷却/令牌等待中) 的请求之后，
+    避免单个 Worker 为一个模型等待时阻塞其他模型的请求。队列中没有这样的请求时不改变队列并返回 False。
+    """
+    pending_items = []
+    while not request_queue.empty():
+        pending_items.append(request_queue.get_nowait())
+        # 下面会重新放回队列 (put 会再次计数)，这里先结束本次取出
+        request_queue.task_done()
+    runnable_index = next((
+        index for index, item in enumerate(pending_items)
+        if not item.get("cancelled") and rate_limiter.retry_after(resolve_request_model_id(item["request_data"].model)) <= 0
+    ), None)
+    if runnable_index is not None:
+        request_item["rate_limit_deferred"] = True
+        pending_items.insert(runnable_index + 1, request_item)
+    for item in pending_items:
+        await request_queue.put(item)
+    return runnable_index is not None
+
 
 
 async def queue_worker():
@@ -48,6 +108,8 @@ async def queue_worker():
         result_future = None
         req_id = "UNKNOWN"
         completion_event = None
+        submit_btn_loc, client_disco_checker = None, None
+        page_failover_error = None
         
         try:
             # 检查队列中的项目，清理已断开连接的请求
@@ -60,6 +122,8 @@ async def queue_worker():
                 while checked_count < queue_size and checked_count < 10:
                     try:
                         item = request_queue.get_nowait()
+                        # 检查后会重新放回队列 (put 会再次计数)，这里先结束本次取出
+                        request_queue.task_done()
                         item_req_id = item.get("req_id", "unknown")
                         
                         if item_req_id in processed_ids:
@@ -105,12 +169,44 @@ async def queue_worker():
                 logger.info(f"[{req_id}] (Worker) 请求已取消，跳过。")
                 if not result_future.done():
                     result_future.set_exception(HTTPException(status_code=499, detail=f"[{req_id}] 请求已被用户取消"))
-                request_queue.task_done()
+                continue
+            
+            # 排队超过准入时确定的截止时间 (服务时间估算偏低或前面的请求耗时过长) 时不再处理；
+            # 因故障切换重排或为其他模型让出队首的请求不受截止时间限制
+            queue_deadline = request_item.get("queue_deadline")
+            if (queue_deadline is not None and not request_item.get("failover_requeued")
+                    and not request_item.get("rate_limit_deferred") and time.time() > queue_deadline):
+                from server import admission_controller
+                retry_after = admission_controller.estimate_wait(request_queue.qsize()) if admission_controller is not None else 30
+                logger.warning(f"[{req_id}] (Worker) 请求排队时间已超过截止时间，返回 503。")
+                if not result_future.done():
+                    result_future.set_exception(HTTPException(
+                        status_code=503, detail=f"[{req_id}] 请求排队时间超过截止时间，请稍后重试。",
+                        headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+                    ))
                 continue
             
             is_streaming_request = request_data.stream
             logger.info(f"[{req_id}] (Worker) 取出请求。模式: {'流式' if is_streaming_request else '非流式'}")
             
+            # 按模型令牌桶/配额冷却状态延迟处理，等待过久时返回 429。
+            # 队列中有其他可以立即处理的请求时先处理它们，只有没有其他请求可处理时才在这里等待
+            from server import rate_limiter
+            rate_limit_model_id = resolve_request_model_id(request_data.model)
+            yielded = False
+            while rate_limiter is not None:
+                wait_seconds = rate_limiter.retry_after(rate_limit_model_id)
+                if wait_seconds <= 0 or wait_seconds > RATE_LIMIT_MAX_WAIT_SECONDS:
+                    break
+                if await _yield_to_runnable_request(request_queue, request_item, rate_limiter):
+                    logger.info(f"[{req_id}] (Worker) 模型 {rate_limit_model_id} 冷却中 (剩余 {wait_seconds:.1f} 秒)，先处理队列中的其他请求。")
+                    yielded = True
+                    break
+                # 分段等待，期间新到达的其他模型请求可以插到前面
+                await asyncio.sleep(min(wait_seconds, _RATE_LIMIT_RECHECK_SECONDS))
+            if yielded:
+                continue
+            
             # 流式请求间隔控制
             current_time = time.time()
             if was_last_request_streaming and is_streaming_request and (current_time - last_request_completion_time < 1.0):
@@ -118,11 +214,22 @@ async def queue_worker():
                 logger.info(f"[{req_id}] (Worker) 连续流式请求，添加 {delay_time:.2f}s 延迟...")
                 await asyncio.sleep(delay_time)
             
+            processing_started_at = time.time()
+            if rate_limiter is not None:
+                retry_after = await rate_limiter.acquire(rate_limit_model_id, RATE_LIMIT_MAX_WAIT_SECONDS)
+                if retry_after is not None:
+                    logger.warning(f"[{req_id}] (Worker) 模型 {rate_limit_model_id} 冷却中 (剩余 {retry_after:.0f} 秒)，返回 429。")
+                    if not result_future.done():
+                        result_future.set_exception(HTTPException(
+                            status_code=429, detail=f"[{req_id}] 模型 {rate_limit_model_id} 触发配额/限流，冷却中，请稍后重试。",
+                            headers={"Retry-After": str(math.ceil(retry_after))}
+                        ))
+                    continue
+            
             if await http_request.is_disconnected():
                 logger.info(f"[{req_id}] (Worker) 客户端在等待锁时断开。取消。")
                 if not result_future.done():
                     result_future.set_exception(HTTPException(status_code=499, detail=f"[{req_id}] 客户端关闭了请求"))
-                request_queue.task_done()
                 continue
             
             logger.info(f"[{req_id}] (Worker) 等待处理锁...")
@@ -136,6 +243,9 @@ async def queue_worker():
                 elif result_future.done():
                     logger.info(f"[{req_id}] (Worker) Future 在处理前已完成/取消。跳过。")
                 else:
+                    from server import admission_controller
+                    if admission_controller is not None:
+                        admission_controller.start_service()
                     # 调用实际的请求处理函数
                     try:
                         from api_utils import _process_request_refactored
@@ -220,6 +330,9 @@ async def queue_worker():
                                 if not result_future.done():
                                     result_future.set_exception(HTTPException(status_code=500, detail=f"[{req_id}] Error waiting for stream completion: {ev_wait_err}"))
 
+                    except PageFailoverError as failover_err:
+                        logger.warning(f"[{req_id}] (Worker) {failover_err}")
+                        page_failover_error = failover_err
                     except Exception as process_err:
                         logger.error(f"[{req_id}] (Worker) _process_request_refactored execution error: {process_err}")
                         if not result_future.done():
@@ -247,6 +360,16 @@ async def queue_worker():
             except Exception as clear_err:
                 logger.error(f"[{req_id}] (Worker) 清空操作时发生错误: {clear_err}", exc_info=True)
 
+            # 服务时间包括释放锁后的清空操作，下一个请求要等它们完成才能开始
+            from server import admission_controller
+            if admission_controller is not None:
+                admission_controller.finish_service()
+
+            if page_failover_error is not None:
+                await _requeue_after_failover(request_queue, request_item, logger)
+            elif rate_limiter is not None and result_future.done() and not result_future.cancelled() and result_future.exception() is None:
+                rate_limiter.record_success(rate_limit_model_id, processing_started_at)
+
             was_last_request_streaming = is_streaming_request
             last_request_completion_time = time.time()
             
@@ -260,6 +383,7 @@ async def queue_worker():
             if result_future and not result_future.done():
                 result_future.set_exception(HTTPException(status_code=500, detail=f"[{req_id}] 服务器内部错误: {e}"))
         finally:
+            # 取出的请求在这里统一标记完成，包括上面提前 continue 的取消、超过截止时间和限流分支
             if request_item:
                 request_queue.task_done()
     
@@ -0,0 +1,170 @@
+"""
+速率限制感知模块
+按 (账号, 模型) 维护令牌桶。RATE_LIMIT_RPM 配置每分钟请求数 (0 表示不主动限速，仅在收到配额信号后冷却)。
+收到配额/限流信号（页面错误提示，或流式代理拦截到的 GenerateContent 429 状态）后进入冷却，
+连续信号的冷却时间指数增长并降低补充速率，之后的成功请求逐步恢复速率。
+Worker 在冷却/令牌等待较短时延迟请求，否则返回 429 和 Retry-After，由客户端或分片网关改投其他账号。
+"""
+
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Dict, Optional
+
+from config import (
+    MODEL_NAME, RATE_LIMIT_RPM, RATE_LIMIT_COOLDOWN_SECONDS, RATE_LIMIT_MAX_COOLDOWN_SECONDS,
+    get_runtime_settings
+)
+
+logger = logging.getLogger("AIStudioProxyServer")
+
+# 页面错误提示或上游响应中表示配额/限流的关键字（小写匹配）。
+# 只使用明确的配额措辞：单独的 "exceeded" 或 "429" 会把 "token limit exceeded" 等无关错误当作配额错误，
+# 使模型对所有客户端进入冷却。上游的 429 状态由流式代理直接报告，不依赖消息文本
+RATE_LIMIT_MESSAGE_PATTERNS = (
+    "quota", "rate limit", "rate-limit", "too many requests", "resource has been exhausted",
+    "resource_exhausted"
+)
+# 冷却后补充速率的最低比例，以及每次成功请求恢复的比例
+_MIN_RATE_FACTOR = 0.25
+_RATE_FACTOR_RECOVERY_STEP = 0.1
+
+
+def is_rate_limit_message(message: Optional[str]) -> bool:
+    if not message:
+        return False
+    lowered = message.lower()
+    return any(pattern in lowered for pattern in RATE_LIMIT_MESSAGE_PATTERNS)
+
+
+def resolve_request_model_id(requested_model: Optional[str]) -> str:
+    """请求实际使用的模型 ID（未指定或使用默认模型名时为页面当前模型）"""
+    import server
+    if requested_model and requested_model != MODEL_NAME:
+        return requested_model.split('/')[-1]
+    return server.current_ai_studio_model_id or MODEL_NAME
+
+
+class TokenBucket:
+    """单个模型的令牌桶和冷却状态"""
+
+    def __init__(self, rate_per_minute: float):
+        self.rate_per_minute = rate_per_minute
+        self.capacity = max(1.0, rate_per_minute)
+        self.tokens = self.capacity
+        self.rate_factor = 1.0
+        self.cooldown_until = 0.0
+        self.strikes = 0
+        self.limited_total = 0
+        self.last_signal: Optional[str] = None
+        self.last_signal_at = 0.0
+        self._updated_at = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        if self.rate_per_minute > 0:
+            refill_per_second = self.rate_per_minute * self.rate_factor / 60
+            self.tokens = min(self.capacity, self.tokens + (now - self._updated_at) * refill_per_second)
+        self._updated_at = now
+
+    def wait_seconds(self, now: Optional[float] = None) -> float:
+        """距离可以发送下一个请求的秒数"""
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        wait = max(0.0, self.cooldown_until - now)
+        if self.rate_per_minute > 0 and self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) * 60 / (self.rate_per_minute * self.rate_factor))
+        return wait
+
+    def take(self) -> None:
+        self._refill(time.monotonic())
+        if self.rate_per_minute > 0:
+            self.tokens -= 1
+
+    def on_rate_limited(self, message: str, retry_after: Optional[float] = None) -> float:
+        """记录配额信号并进入冷却，返回冷却秒数"""
+        now = time.monotonic()
+        self._refill(now)
+        self.strikes += 1
+        self.limited_total += 1
+        cooldown = retry_after if retry_after else min(
+            RATE_LIMIT_COOLDOWN_SECONDS * 2 ** (self.strikes - 1), RATE_LIMIT_MAX_COOLDOWN_SECONDS
+        )
+        self.cooldown_until = max(self.cooldown_until, now + cooldown)
+        self.tokens = 0.0
+        self.rate_factor = max(_MIN_RATE_FACTOR, self.rate_factor / 2)
+        self.last_signal = message[:300]
+        self.last_signal_at = time.time()
+        return cooldown
+
+    def on_success(self) -> None:
+        self.strikes = 0
+        self.rate_factor = min(1.0, self.rate_factor + _RATE_FACTOR_RECOVERY_STEP)
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        self._refill(now)
+        return {
+            "tokens": round(self.tokens, 2) if self.rate_per_minute > 0 else None,
+            "capacity": self.capacity if self.rate_per_minute > 0 else None,
+            "effective_rpm": round(self.rate_per_minute * self.rate_factor, 2) if self.rate_per_minute > 0 else None,
+            "cooldown_remaining_seconds": round(max(0.0, self.cooldown_until - now), 1),
+            "strikes": self.strikes,
+            "limited_total": self.limited_total,
+            "last_signal": self.last_signal,
+            "last_signal_at": self.last_signal_at or None,
+        }
+
+
+class RateLimiter:
+    """当前账号下按模型划分的令牌桶"""
+
+    def __init__(self, account: str, rate_per_minute: float = RATE_LIMIT_RPM):
+        self.account = account
+        self.rate_per_minute = rate_per_minute
+        self._buckets: Dict[str, TokenBucket] = {}
+
+    @classmethod
+    def from_config(cls) -> "RateLimiter":
+        auth_path = get_runtime_settings().active_auth_json_path
+        account = os.path.splitext(os.path.basename(auth_path))[0] if auth_path else "default"
+        return cls(account)
+
+    def bucket(self, model_id: str) -> TokenBucket:
+        bucket = self._buckets.get(model_id)
+        if bucket is None:
+            bucket = self._buckets[model_id] = TokenBucket(self.rate_per_minute)
+        return bucket
+
+    def retry_after(self, model_id: str) -> float:
+        return self.bucket(model_id).wait_seconds()
+
+    async def acquire(self, model_id: str, max_wait_seconds: float) -> Optional[float]:
+        """等待令牌（最多 max_wait_seconds 秒）并消耗一个；需要等待更久时不消耗令牌，返回建议的重试秒数"""
+        bucket = self.bucket(model_id)
+        while True:
+            wait = bucket.wait_seconds()
+            if wait <= 0:
+                bucket.take()
+                return None
+            if wait > max_wait_seconds:
+                return wait
+            await asyncio.sleep(wait)
+
+    def record_rate_limit(self, model_id: str, message: str, retry_after: Optional[float] = None) -> float:
+        cooldown = self.bucket(model_id).on_rate_limited(message, retry_after)
+        logger.warning(f"账号 {self.account} 的模型 {model_id} 触发配额/限流信号: {message[:200]}，冷却 {cooldown:.0f} 秒。")
+        return cooldown
+
+    def record_success(self, model_id: str, started_at: float) -> None:
+        """请求成功完成；处理期间收到过配额信号时不计为成功"""
+        bucket = self.bucket(model_id)
+        if bucket.last_signal_at < started_at:
+            bucket.on_success()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "account": self.account,
+            "rpm": self.rate_per_minute or None,
+            "models": {model_id: bucket.stats() for model_id, bucket in self._buckets.items()},
+        }
@@ -0,0 +1,158 @@
+"""
+请求合并模块（singleflight）
+相同的请求（与响应缓存相同的规范化键，且流式/非流式一致）在排队或执行期间到达时，
+不再重复入队，而是共享同一次执行的结果。流式响应由一个数据源扇出给所有订阅者，
+后加入的订阅者先收到已缓冲的前缀。
+发起者的客户端断开不会中止执行：只有发起者和所有订阅者都已离开时，Worker 才视为客户端断开。
+"""
+
+import asyncio
+from typing import Any, AsyncGenerator, AsyncIterator, Dict, List, Optional
+
+from fastapi import Response
+from fastapi.responses import StreamingResponse
+
+
+class SharedStream:
+    """将一个 SSE 数据源扇出给多个订阅者，数据源由后台任务独立读取，不受单个客户端读取速度影响"""
+
+    def __init__(self, source: AsyncIterator[str]):
+        self._source = source
+        self._chunks: List[Any] = []
+        self._done = False
+        self._error: Optional[BaseException] = None
+        self._changed = asyncio.Condition()
+        self._pump_task = asyncio.create_task(self._pump())
+
+    async def _pump(self) -> None:
+        try:
+            async for chunk in self._source:
+                self._chunks.append(chunk)
+                async with self._changed:
+                    self._changed.notify_all()
+        except Exception as e:
+            self._error = e
+        finally:
+            self._done = True
+            async with self._changed:
+                self._changed.notify_all()
+
+    def add_done_callback(self, callback) -> None:
+        self._pump_task.add_done_callback(lambda _task: callback())
+
+    async def subscribe(self) -> AsyncGenerator[Any, None]:
+        index = 0
+        while True:
+            if index < len(self._chunks):
+                chunk = self._chunks[index]
+                index += 1
+                yield chunk
+                continue
+            if self._done:
+                if self._error is not None:
+                    raise self._error
+                return
+            async with self._changed:
+                await self._changed.wait_for(lambda: index < len(self._chunks) or self._done)
+
+
+class InflightRequest:
+    """一次正在排队或执行的请求，result 为 SharedStream（流式）或 Response（非流式）"""
+
+    def __init__(self, key: str, req_id: str):
+        self.key = key
+        self.req_id = req_id
+        self.subscribers = 0
+        self.result: asyncio.Future = asyncio.get_running_loop().create_future()
+
+
+class CoalescedRequest:
+    """代替发起者的 HTTP 请求对象交给 Worker：发起者的客户端断开且没有订阅者时才视为断开"""
+
+    def __init__(self, http_request: Any, flight: InflightRequest, coalescer: "RequestCoalescer"):
+        self._http_request = http_request
+        self._flight = flight
+        self._coalescer = coalescer
+
+    async def is_disconnected(self) -> bool:
+        if self._flight.subscribers > 0 or not await self._http_request.is_disconnected():
+            return False
+        # 执行即将中止，不再接受新的订阅者，避免其收到被截断的响应
+        self._coalescer._release(self._flight)
+        return True
+
+
+class RequestCoalescer:
+    """按请求键登记进行中的执行，相同请求到达时附加到已有执行上"""
+
+    def __init__(self):
+        self._inflight: Dict[str, InflightRequest] = {}
+        self.coalesced_total = 0
+
+    def join(self, key: str) -> Optional[InflightRequest]:
+        flight = self._inflight.get(key)
+        if flight is not None:
+            flight.subscribers += 1
+            self.coalesced_total += 1
+        return flight
+
+    def leave(self, flight: InflightRequest) -> None:
+        flight.subscribers -= 1
+
+    def lead(self, key: str, req_id: str) -> InflightRequest:
+        flight = InflightRequest(key, req_id)
+        self._inflight[key] = flight
+        return flight
+
+    def detach(self, http_request: Any, flight: InflightRequest) -> CoalescedRequest:
+        """包装发起者的请求对象，放入请求队列代替原对象"""
+        return CoalescedRequest(http_request, flight, self)
+
+    def _release(self, flight: InflightRequest) -> None:
+        if self._inflight.get(flight.key) is flight:
+            del self._inflight[flight.key]
+
+    def publish(self, flight: InflightRequest, response: Response) -> Response:
+        """发布执行结果并返回给发起者的响应。流式响应在数据源结束前仍接受新的订阅者。"""
+        if isinstance(response, StreamingResponse):
+            shared = SharedStream(response.body_iterator)
+            shared.add_done_callback(lambda: self._release(flight))
+            flight.result.set_result(shared)
+            return StreamingResponse(shared.subscribe(), status_code=response.status_code, media_type=response.media_type)
+        self._release(flight)
+        flight.result.set_result(response)
+        return response
+
+    def fail(self, flight: InflightRequest, error: BaseException) -> None:
+        """执行失败时将异常传递给所有订阅者"""
+        self._release(flight)
+        if not flight.result.done():
+            flight.result.set_exception(error)
+            # 没有订阅者时避免 "exception was never retrieved" 警告
+            flight.result.exception()
+
+    async def subscribe(self, flight: InflightRequest) -> Response:
+        """等待执行结果并为订阅者构造独立的响应对象。订阅者离开 (读完、断开或失败) 时从计数中移除"""
+        try:
+            result = await asyncio.shield(flight.result)
+        except BaseException:
+            self.leave(flight)
+            raise
+        if isinstance(result, SharedStream):
+            return StreamingResponse(self._follow(flight, result), media_type="text/event-stream")
+        self.leave(flight)
+        return Response(content=result.body, status_code=result.status_code, media_type=result.media_type)
+
+    async def _follow(self, flight: InflightRequest, shared: SharedStream) -> AsyncGenerator[Any, None]:
+        try:
+            async for chunk in shared.subscribe():
+                yield chunk
+        finally:
+            self.leave(flight)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "inflight": len(self._inflight),
+            "subscribers": sum(flight.subscribers for flight in self._inflight.values()),
+            "coalesced_total": self.coalesced_total,
+        }
@@ -16,16 +16,22 @@ from fastapi.responses import JSONResponse, StreamingResponse
 from playwright.async_api import Page as AsyncPage, Locator, Error as PlaywrightAsyncError, expect as expect_async
 
 # --- 配置模块导入 ---
-from config import *
+from config import (
+    MODEL_NAME, CHAT_COMPLETION_ID_PREFIX,
+    SUBMIT_BUTTON_SELECTOR, RESPONSE_CONTAINER_SELECTOR, RESPONSE_TEXT_SELECTOR,
+    get_runtime_settings
+)
 
 # --- models模块导入 ---
-from models import ChatCompletionRequest, ClientDisconnectedError
+from models import ChatCompletionRequest, ClientDisconnectedError, PageFailoverError
 
 # --- browser_utils模块导入 ---
 from browser_utils import (
     switch_ai_studio_model,
-    save_error_snapshot
+    save_error_snapshot,
+    detect_and_extract_page_error
 )
+from browser_utils.params_cache import revalidate_page_params_cache
 
 # --- api_utils模块导入 ---
 from .utils import (
@@ -34,8 +40,14 @@ from .utils import (
     generate_sse_chunk,
     generate_sse_stop_chunk,
     use_stream_response,
-    calculate_usage_stats
+    calculate_usage_stats,
+    estimate_prompt_tokens,
+    IncrementalTokenEstimator,
+    coalesce_sse_stream,
+    resolve_sse_flush_policy
 )
+from .response_cache import build_cache_entry, store_response_in_cache
+from .rate_limiter import is_rate_limit_message, resolve_request_model_id
 from browser_utils.page_controller import PageController
 
 
@@ -196,9 +208,8 @@ async def _handle_parameter_cache(req_id: str, context: dict) -> None:
         cached_model_for_params = page_params_cache.get("last_known_model_id_for_params")
         
         if model_actually_switched or (current_ai_studio_model_id != cached_model_for_params):
-            logger.info(f"[{req_id}] 模型已更改，参数缓存失效。")
-            page_params_cache.clear()
-            page_params_cache["last_known_model_id_for_params"] = current_ai_studio_model_id
+            logger.info(f"[{req_id}] 模型已更改，按模型快照重建参数缓存并通过页面校验。")
+            await revalidate_page_params_cache(context['page'], current_ai_studio_model_id, page_params_cache)
 
 
 async def _prepare_and_validate_request(req_id: str, request: ChatCompletionRequest, check_client_disconnected: Callable) -> str:
@@ -223,8 +234,7 @@ async def _handle_response_processing(req_id: str, request: ChatCompletionReques
     current_ai_studio_model_id = context.get('current_ai_studio_model_id')
     
     # 检查是否使用辅助流
-    stream_port = os.environ.get('STREAM_PORT')
-    use_stream = stream_port != '0'
+    use_stream = get_runtime_settings().stream_proxy_enabled
     
     if use_stream:
         return await _handle_auxiliary_stream_response(req_id, request, context, result_future, submit_button_locator, check_client_disconnected)
@@ -250,15 +260,16 @@ async def _handle_auxiliary_stream_response(req_id: str, request: ChatCompletion
             completion_event = Event()
             
             async def create_stream_generator_from_helper(event_to_set: Event) -> AsyncGenerator[str, None]:
-                last_reason_pos = 0
-                last_body_pos = 0
+                # 代理只发送增量，这里按片段累计，结束时拼接一次用于写入响应缓存
+                reason_parts, body_parts, function_calls = [], [], []
                 model_name_for_stream = current_ai_studio_model_id or MODEL_NAME
                 chat_completion_id = f"{CHAT_COMPLETION_ID_PREFIX}{req_id}-{int(time.time())}-{random.randint(100, 999)}"
                 created_timestamp = int(time.time())
                 
-                # 用于收集完整内容以计算usage
-                full_reasoning_content = ""
-                full_body_content = ""
+                # 随增量累计completion token估算，结束时无需重新遍历完整内容
+                completion_estimator = IncrementalTokenEstimator()
+                # 是否完整结束（决定是否写入响应缓存）
+                stream_completed = False
 
                 try:
                     async for raw_data in use_stream_response(req_id):
@@ -290,16 +301,20 @@ async def _handle_auxiliary_stream_response(req_id: str, request: ChatCompletion
                         reason = data.get("reason", "")
                         body = data.get("body", "")
                         done = data.get("done", False)
-                        function = data.get("function", [])
+                        if data.get("function"):
+                            function_calls.extend(data["function"])
                         
-                        # 更新完整内容记录
-                        if reason:
-                            full_reasoning_content = reason
-                        if body:
-                            full_body_content = body
+                        if done:
+                            if reason == "internal_timeout":
+                                # 超时结束标志，不是推理内容
+                                reason = ""
+                            else:
+                                stream_completed = True
                         
                         # 处理推理内容
-                        if len(reason) > last_reason_pos:
+                        if reason:
+                            reason_parts.append(reason)
+                            completion_estimator.feed(reason)
                             output = {
                                 "id": chat_completion_id,
                                 "object": "chat.completion.chunk",
@@ -310,22 +325,23 @@ async def _handle_auxiliary_stream_response(req_id: str, request: ChatCompletion
                                     "delta":{
                                         "role": "assistant",
                                         "content": None,
-                                        "reasoning_content": reason[last_reason_pos:],
+                                        "reasoning_content": reason,
                                     },
                                     "finish_reason": None,
                                     "native_finish_reason": None,
                                 }]
                             }
-                            last_reason_pos = len(reason)
                             yield f"data: {json.dumps(output, ensure_ascii=False, separators=(',', ':'))}\n\n"
                         
                         # 处理主体内容
-                        if len(body) > last_body_pos:
+                        if body:
+                            body_parts.append(body)
+                            completion_estimator.feed(body)
                             finish_reason_val = None
                             if done:
                                 finish_reason_val = "stop"
                             
-                            delta_content = {"role": "assistant", "content": body[last_body_pos:]}
+                            delta_content = {"role": "assistant", "content": body}
                             choice_item = {
                                 "index": 0,
                                 "delta": delta_content,
@@ -333,9 +349,9 @@ async def _handle_auxiliary_stream_response(req_id: str, request: ChatCompletion
                                 "native_finish_reason": finish_reason_val,
                             }
 
-                            if done and function and len(function) > 0:
+                            if done and function_calls:
                                 tool_calls_list = []
-                                for func_idx, function_call_data in enumerate(function):
+                                for func_idx, function_call_data in enumerate(function_calls):
                                     tool_calls_list.append({
                                         "id": f"call_{generate_random_string(24)}",
                                         "index": func_idx,
@@ -357,16 +373,15 @@ async def _handle_auxiliary_stream_response(req_id: str, request: ChatCompletion
                                 "created": created_timestamp,
                                 "choices": [choice_item]
                             }
-                            last_body_pos = len(body)
                             yield f"data: {json.dumps(output, ensure_ascii=False, separators=(',', ':'))}\n\n"
                         
                         # 处理只有done=True但没有新内容的情况（仅有函数调用或纯结束）
                         elif done:
                             # 如果有函数调用但没有新的body内容
-                            if function and len(function) > 0:
+                            if function_calls:
                                 delta_content = {"role": "assistant", "content": None}
                                 tool_calls_list = []
-                                for func_idx, function_call_data in enumerate(function):
+                                for func_idx, function_call_data in enumerate(function_calls):
                                     tool_calls_list.append({
                                         "id": f"call_{generate_random_string(24)}",
                                         "index": func_idx,
@@ -400,6 +415,17 @@ async def _handle_auxiliary_stream_response(req_id: str, request: ChatCompletion
                                 "choices": [choice_item]
                             }
                             yield f"data: {json.dumps(output, ensure_ascii=False, separators=(',', ':'))}\n\n"
+                    
+                    if stream_completed:
+                        await store_response_in_cache(req_id, request, build_cache_entry(
+                            model_name_for_stream, "".join(body_parts), "".join(reason_parts), function_calls,
+                            calculate_usage_stats(
+                                request.messages,
+                                None,
+                                prompt_tokens=estimate_prompt_tokens(request),
+                                completion_tokens=completion_estimator.tokens
+                            )
+                        ))
                 
                 except ClientDisconnectedError:
                     logger.info(f"[{req_id}] 流式生成器中检测到客户端断开连接")
@@ -426,9 +452,10 @@ async def _handle_auxiliary_stream_response(req_id: str, request: ChatCompletion
                     # 计算usage统计
                     try:
                         usage_stats = calculate_usage_stats(
-                            [msg.model_dump() for msg in request.messages],
-                            full_body_content,
-                            full_reasoning_content
+                            request.messages,
+                            None,
+                            prompt_tokens=estimate_prompt_tokens(request),
+                            completion_tokens=completion_estimator.tokens
                         )
                         logger.info(f"[{req_id}] 计算的token使用统计: {usage_stats}")
                         
@@ -466,7 +493,11 @@ async def _handle_auxiliary_stream_response(req_id: str, request: ChatCompletion
 
             stream_gen_func = create_stream_generator_from_helper(completion_event)
             if not result_future.done():
-                result_future.set_result(StreamingResponse(stream_gen_func, media_type="text/event-stream"))
+                flush_bytes, flush_interval_ms = resolve_sse_flush_policy(request)
+                result_future.set_result(StreamingResponse(
+                    coalesce_sse_stream(stream_gen_func, flush_bytes, flush_interval_ms),
+                    media_type="text/event-stream"
+                ))
             else:
                 if not completion_event.is_set():
                     completion_event.set()
@@ -484,6 +515,8 @@ async def _handle_auxiliary_stream_response(req_id: str, request: ChatCompletion
         reasoning_content = None
         functions = None
         final_data_from_aux_stream = None
+        # 代理只发送增量：按片段累计，收到完成标志后再拼接一次
+        reason_parts, body_parts, function_calls = [], [], []
 
         async for raw_data in use_stream_response(req_id):
             check_client_disconnected(f"非流式辅助流 - 循环中 ({req_id}): ")
@@ -507,10 +540,24 @@ async def _handle_auxiliary_stream_response(req_id: str, request: ChatCompletion
                 continue
                 
             final_data_from_aux_stream = data
+            if data.get("done") and data.get("reason") == "internal_timeout":
+                break
+            if data.get("reason"):
+                reason_parts.append(data["reason"])
+            if data.get("body"):
+                body_parts.append(data["body"])
+            if data.get("function"):
+                function_calls.extend(data["function"])
             if data.get("done"):
-                content = data.get("body")
-                reasoning_content = data.get("reason")
-                functions = data.get("function")
+                content = "".join(body_parts)
+                reasoning_content = "".join(reason_parts)
+                functions = function_calls
+                summary = data.get("summary")
+                if summary and (summary.get("body_length") != len(content) or summary.get("reason_length") != len(reasoning_content)):
+                    logger.warning(
+                        f"[{req_id}] 非流式累计内容长度与代理汇总不一致: "
+                        f"body {len(content)}/{summary.get('body_length')}, reason {len(reasoning_content)}/{summary.get('reason_length')}"
+                    )
                 break
         
         if final_data_from_aux_stream and final_data_from_aux_stream.get("reason") == "internal_timeout":
@@ -546,9 +593,10 @@ async def _handle_auxiliary_stream_response(req_id: str, request: ChatCompletion
 
         # 计算token使用统计
         usage_stats = calculate_usage_stats(
-            [msg.model_dump() for msg in request.messages],
+            request.messages,
             content or "",
-            reasoning_content
+            reasoning_content,
+            prompt_tokens=estimate_prompt_tokens(request)
         )
 
         response_payload = {
@@ -567,6 +615,9 @@ async def _handle_auxiliary_stream_response(req_id: str, request: ChatCompletion
 
         if not result_future.done():
             result_future.set_result(JSONResponse(content=response_payload))
+        await store_response_in_cache(req_id, request, build_cache_entry(
+            model_name_for_json, content, reasoning_content, functions, usage_stats
+        ))
         return None
 
 
@@ -609,6 +660,10 @@ async def _handle_playwright_response(req_id: str, request: ChatCompletionReques
                 # 使用PageController获取响应
                 page_controller = PageController(page, logger, req_id)
                 final_content = await page_controller.get_response(check_client_disconnected)
+                if not final_content:
+                    rate_limit_err = await _page_rate_limit_error(req_id, page)
+                    if rate_limit_err:
+                        raise rate_limit_err
                 
                 # 生成流式响应 - 保持Markdown格式
                 # 按行分割以保持换行符和Markdown结构
@@ -636,14 +691,18 @@ async def _handle_playwright_response(req_id: str, request: ChatCompletionReques
                 
                 # 计算并发送带usage的完成块
                 usage_stats = calculate_usage_stats(
-                    [msg.model_dump() for msg in request.messages],
+                    request.messages,
                     final_content,
-                    ""  # Playwright模式没有reasoning content
+                    "",  # Playwright模式没有reasoning content
+                    prompt_tokens=estimate_prompt_tokens(request)
                 )
                 logger.info(f"[{req_id}] Playwright非流式计算的token使用统计: {usage_stats}")
                 
                 # 发送带usage的完成块
                 yield generate_sse_stop_chunk(req_id, current_ai_studio_model_id or MODEL_NAME, "stop", usage_stats)
+                await store_response_in_cache(req_id, request, build_cache_entry(
+                    current_ai_studio_model_id or MODEL_NAME, final_content, usage=usage_stats
+                ))
                 
             except ClientDisconnectedError:
                 logger.info(f"[{req_id}] Playwright流式生成器中检测到客户端断开连接")
@@ -663,19 +722,28 @@ async def _handle_playwright_response(req_id: str, request: ChatCompletionReques
 
         stream_gen_func = create_response_stream_generator()
         if not result_future.done():
-            result_future.set_result(StreamingResponse(stream_gen_func, media_type="text/event-stream"))
+            flush_bytes, flush_interval_ms = resolve_sse_flush_policy(request)
+            result_future.set_result(StreamingResponse(
+                coalesce_sse_stream(stream_gen_func, flush_bytes, flush_interval_ms),
+                media_type="text/event-stream"
+            ))
         
         return completion_event, submit_button_locator, check_client_disconnected
     else:
         # 使用PageController获取响应
         page_controller = PageController(page, logger, req_id)
         final_content = await page_controller.get_response(check_client_disconnected)
+        if not final_content:
+            rate_limit_err = await _page_rate_limit_error(req_id, page)
+            if rate_limit_err:
+                raise rate_limit_err
         
         # 计算token使用统计
         usage_stats = calculate_usage_stats(
-            [msg.model_dump() for msg in request.messages],
+            request.messages,
             final_content,
-            ""  # Playwright模式没有reasoning content
+            "",  # Playwright模式没有reasoning content
+            prompt_tokens=estimate_prompt_tokens(request)
         )
         logger.info(f"[{req_id}] Playwright非流式计算的token使用统计: {usage_stats}")
         
@@ -694,6 +762,9 @@ async def _handle_playwright_response(req_id: str, request: ChatCompletionReques
         
         if not result_future.done():
             result_future.set_result(JSONResponse(content=response_payload))
+        await store_response_in_cache(req_id, request, build_cache_entry(
+            current_ai_studio_model_id or MODEL_NAME, final_content, usage=usage_stats
+        ))
         
         return None
 
@@ -720,6 +791,28 @@ async def _cleanup_request_resources(req_id: str, disconnect_check_task: Optiona
          completion_event.set()
 
 
+async def _page_rate_limit_error(req_id: str, page: Optional[AsyncPage]) -> Optional[HTTPException]:
+    """检查页面错误提示，配额/限流提示计入当前模型的令牌桶并返回 429 异常"""
+    from server import rate_limiter
+    if page is None or page.is_closed():
+        return None
+    message = await detect_and_extract_page_error(page, req_id)
+    if not is_rate_limit_message(message):
+        return None
+    headers = None
+    if rate_limiter is not None:
+        cooldown = rate_limiter.record_rate_limit(resolve_request_model_id(None), message)
+        headers = {"Retry-After": str(int(cooldown))}
+    return HTTPException(status_code=429, detail=f"[{req_id}] AI Studio 配额/限流: {message}", headers=headers)
+
+
+def _raise_if_page_lost(req_id: str, page, result_future: Future, error: Exception) -> None:
+    """响应尚未返回且请求使用的页面已失效时，交由 Worker 在故障切换后重新排队"""
+    from server import page_supervisor
+    if page_supervisor is not None and not result_future.done() and page_supervisor.is_page_lost(page):
+        raise PageFailoverError(f"[{req_id}] 页面在处理请求时失效: {error}") from error
+
+
 async def _process_request_refactored(
     req_id: str,
     request: ChatCompletionRequest,
@@ -778,18 +871,25 @@ async def _process_request_refactored(
         if not result_future.done():
              result_future.set_exception(HTTPException(status_code=499, detail=f"[{req_id}] Client disconnected during processing."))
     except HTTPException as http_err:
+        _raise_if_page_lost(req_id, page, result_future, http_err)
+        if http_err.status_code >= 500:
+            http_err = await _page_rate_limit_error(req_id, page) or http_err
         context['logger'].warning(f"[{req_id}] 捕获到 HTTP 异常: {http_err.status_code} - {http_err.detail}")
         if not result_future.done():
             result_future.set_exception(http_err)
     except PlaywrightAsyncError as pw_err:
+        _raise_if_page_lost(req_id, page, result_future, pw_err)
         context['logger'].error(f"[{req_id}] 捕获到 Playwright 错误: {pw_err}")
         await save_error_snapshot(f"process_playwright_error_{req_id}")
+        rate_limit_err = await _page_rate_limit_error(req_id, page)
         if not result_future.done():
-            result_future.set_exception(HTTPException(status_code=502, detail=f"[{req_id}] Playwright interaction failed: {pw_err}"))
+            result_future.set_exception(rate_limit_err or HTTPException(status_code=502, detail=f"[{req_id}] Playwright interaction failed: {pw_err}"))
     except Exception as e:
+        _raise_if_page_lost(req_id, page, result_future, e)
         context['logger'].exception(f"[{req_id}] 捕获到意外错误")
         await save_error_snapshot(f"process_unexpected_error_{req_id}")
+        rate_limit_err = await _page_rate_limit_error(req_id, page)
         if not result_future.done():
-            result_future.set_exception(HTTPException(status_code=500, detail=f"[{req_id}] Unexpected server error: {e}"))
+            result_future.set_exception(rate_limit_err or HTTPException(status_code=500, detail=f"[{req_id}] Unexpected server error: {e}"))
     finally:
         await _cleanup_request_resources(req_id, disconnect_check_task, completion_event, result_future, request.stream)
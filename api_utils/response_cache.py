@@ -0,0 +1,324 @@
+"""
+响应缓存模块
+对相同模型、消息和采样参数的请求做精确匹配缓存，命中时按流式 SSE 或非流式 JSON 的格式回放，
+不再经过请求队列和浏览器。内存 LRU 为第一级，可选 SQLite 文件为第二级（带 TTL 和容量上限）。
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, AsyncGenerator, Dict, List, Optional, Tuple
+
+from config import (
+    CHAT_COMPLETION_ID_PREFIX,
+    RESPONSE_CACHE_MAX_ENTRIES,
+    RESPONSE_CACHE_TTL_SECONDS,
+    RESPONSE_CACHE_DB_PATH,
+    RESPONSE_CACHE_DB_MAX_MB,
+    RESPONSE_CACHE_DETERMINISTIC_ONLY
+)
+
+
+# --- 缓存键 ---
+def compute_request_cache_key(request: Any) -> str:
+    """
+    计算请求的规范化缓存键（model、messages、temperature、top_p、max_output_tokens、stop 的 SHA-256）
+    结果缓存在请求对象上，每个请求只计算一次
+    """
+    cached = getattr(request, '_cache_key', None)
+    if cached is not None:
+        return cached
+
+    stop = request.stop
+    if isinstance(stop, str):
+        stop = [stop]
+    payload = {
+        "model": request.model,
+        "messages": [
+            message.model_dump(exclude_none=True) if hasattr(message, 'model_dump') else message
+            for message in request.messages
+        ],
+        "temperature": request.temperature,
+        "top_p": request.top_p,
+        "max_output_tokens": request.max_output_tokens,
+        "stop": stop,
+    }
+    canonical = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    cache_key = hashlib.sha256(canonical.encode('utf-8', 'surrogatepass')).hexdigest()
+    try:
+        request._cache_key = cache_key
+    except (AttributeError, ValueError):
+        pass
+    return cache_key
+
+
+def is_request_cacheable(request: Any) -> bool:
+    """默认只缓存 temperature=0 的确定性请求"""
+    if RESPONSE_CACHE_DETERMINISTIC_ONLY:
+        return request.temperature is not None and request.temperature == 0
+    return True
+
+
+def build_cache_entry(model: str, content: Optional[str], reasoning_content: Optional[str] = None,
+                      functions: Optional[List[Dict[str, Any]]] = None, usage: Optional[dict] = None) -> Dict[str, Any]:
+    """构造缓存条目。functions 为辅助流返回的原始函数调用列表（name/params）"""
+    return {
+        "model": model,
+        "content": content,
+        "reasoning_content": reasoning_content or None,
+        "functions": functions or None,
+        "usage": usage or {},
+        "created": time.time(),
+    }
+
+
+class ResponseCache:
+    """两级响应缓存：内存 LRU + 可选 SQLite"""
+
+    def __init__(self, max_entries: int, ttl_seconds: float, db_path: str = '', db_max_bytes: int = 0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.db_path = db_path
+        self.db_max_bytes = db_max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._memory: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        if db_path:
+            self._open_db()
+
+    @classmethod
+    def from_config(cls) -> "ResponseCache":
+        return cls(
+            max_entries=RESPONSE_CACHE_MAX_ENTRIES,
+            ttl_seconds=RESPONSE_CACHE_TTL_SECONDS,
+            db_path=RESPONSE_CACHE_DB_PATH,
+            db_max_bytes=RESPONSE_CACHE_DB_MAX_MB * 1024 * 1024,
+        )
+
+    def _open_db(self) -> None:
+        db_dir = os.path.dirname(os.path.abspath(self.db_path))
+        os.makedirs(db_dir, exist_ok=True)
+        self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS response_cache ("
+            "key TEXT PRIMARY KEY, payload TEXT NOT NULL, size INTEGER NOT NULL, "
+            "expires_at REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_response_cache_access ON response_cache(last_access)")
+        self._db.commit()
+
+    def close(self) -> None:
+        with self._db_lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    # --- 内存层 ---
+    def _memory_get(self, key: str, now: float) -> Optional[Dict[str, Any]]:
+        item = self._memory.get(key)
+        if item is None:
+            return None
+        expires_at, entry = item
+        if expires_at <= now:
+            del self._memory[key]
+            return None
+        self._memory.move_to_end(key)
+        return entry
+
+    def _memory_put(self, key: str, entry: Dict[str, Any], expires_at: float) -> None:
+        if self.max_entries <= 0:
+            return
+        self._memory[key] = (expires_at, entry)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    # --- SQLite 层（在线程池中执行） ---
+    def _db_get(self, key: str, now: float) -> Optional[Tuple[float, Dict[str, Any]]]:
+        with self._db_lock:
+            if self._db is None:
+                return None
+            row = self._db.execute(
+                "SELECT payload, expires_at FROM response_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            payload, expires_at = row
+            if expires_at <= now:
+                self._db.execute("DELETE FROM response_cache WHERE key = ?", (key,))
+                self._db.commit()
+                return None
+            self._db.execute("UPDATE response_cache SET last_access = ? WHERE key = ?", (now, key))
+            self._db.commit()
+        return expires_at, json.loads(payload)
+
+    def _db_put(self, key: str, entry: Dict[str, Any], expires_at: float, now: float) -> None:
+        payload = json.dumps(entry, ensure_ascii=False, separators=(',', ':'))
+        size = len(payload.encode('utf-8', 'surrogatepass'))
+        with self._db_lock:
+            if self._db is None:
+                return
+            self._db.execute(
+                "INSERT OR REPLACE INTO response_cache (key, payload, size, expires_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, payload, size, expires_at, now)
+            )
+            self._db.execute("DELETE FROM response_cache WHERE expires_at <= ?", (now,))
+            if self.db_max_bytes > 0:
+                # 超出容量时按最近访问时间从旧到新淘汰
+                total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM response_cache").fetchone()[0]
+                if total > self.db_max_bytes:
+                    evict_keys = []
+                    for row_key, row_size in self._db.execute(
+                        "SELECT key, size FROM response_cache ORDER BY last_access ASC"
+                    ):
+                        if total <= self.db_max_bytes:
+                            break
+                        evict_keys.append((row_key,))
+                        total -= row_size
+                    self._db.executemany("DELETE FROM response_cache WHERE key = ?", evict_keys)
+            self._db.commit()
+
+    # --- 对外接口 ---
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        entry = self._memory_get(key, now)
+        if entry is None and self._db is not None:
+            found = await asyncio.to_thread(self._db_get, key, now)
+            if found is not None:
+                expires_at, entry = found
+                self._memory_put(key, entry, expires_at)
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return entry
+
+    async def put(self, key: str, entry: Dict[str, Any]) -> None:
+        now = time.time()
+        expires_at = now + self.ttl_seconds if self.ttl_seconds > 0 else float('inf')
+        self._memory_put(key, entry, expires_at)
+        if self._db is not None:
+            await asyncio.to_thread(self._db_put, key, entry, expires_at, now)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "memory_entries": len(self._memory),
+            "hits": self.hits,
+            "misses": self.misses,
+            "disk_enabled": self._db is not None,
+        }
+
+
+async def store_response_in_cache(req_id: str, request: Any, entry: Dict[str, Any]) -> None:
+    """请求成功完成后写入缓存（缓存未启用或请求不可缓存时忽略）"""
+    from server import response_cache, logger
+
+    if response_cache is None or not is_request_cacheable(request):
+        return
+    if entry.get("content") is None and not entry.get("functions"):
+        return
+    try:
+        await response_cache.put(compute_request_cache_key(request), entry)
+        logger.info(f"[{req_id}] 响应已写入缓存。")
+    except Exception as e:
+        logger.warning(f"[{req_id}] 写入响应缓存失败: {e}")
+
+
+# --- 缓存回放 ---
+def _build_tool_calls(functions: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    charset = "abcdefghijklmnopqrstuvwxyz0123456789"
+    return [{
+        "id": f"call_{''.join(random.choice(charset) for _ in range(24))}",
+        "index": func_idx,
+        "type": "function",
+        "function": {
+            "name": function_call_data["name"],
+            "arguments": json.dumps(function_call_data["params"]),
+        },
+    } for func_idx, function_call_data in enumerate(functions)]
+
+
+def build_cached_json_response(entry: Dict[str, Any], req_id: str) -> Dict[str, Any]:
+    """按非流式响应格式回放缓存条目"""
+    message_payload = {"role": "assistant", "content": entry.get("content")}
+    finish_reason_val = "stop"
+    if entry.get("functions"):
+        message_payload["tool_calls"] = _build_tool_calls(entry["functions"])
+        message_payload["content"] = None
+        finish_reason_val = "tool_calls"
+    if entry.get("reasoning_content"):
+        message_payload["reasoning_content"] = entry["reasoning_content"]
+
+    return {
+        "id": f"{CHAT_COMPLETION_ID_PREFIX}{req_id}-{int(time.time())}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": entry.get("model"),
+        "choices": [{
+            "index": 0,
+            "message": message_payload,
+            "finish_reason": finish_reason_val,
+            "native_finish_reason": finish_reason_val,
+        }],
+        "usage": entry.get("usage", {})
+    }
+
+
+async def replay_cached_stream(entry: Dict[str, Any], req_id: str) -> AsyncGenerator[str, None]:
+    """按流式 SSE 格式回放缓存条目（推理内容、正文/工具调用、usage 块、[DONE]）"""
+    chat_completion_id = f"{CHAT_COMPLETION_ID_PREFIX}{req_id}-{int(time.time())}-{random.randint(100, 999)}"
+    created_timestamp = int(time.time())
+    model_name = entry.get("model")
+
+    def _chunk(choice_item: Dict[str, Any], usage: Optional[dict] = None) -> str:
+        output = {
+            "id": chat_completion_id,
+            "object": "chat.completion.chunk",
+            "model": model_name,
+            "created": created_timestamp,
+            "choices": [choice_item]
+        }
+        if usage is not None:
+            output["usage"] = usage
+        return f"data: {json.dumps(output, ensure_ascii=False, separators=(',', ':'))}\n\n"
+
+    if entry.get("reasoning_content"):
+        yield _chunk({
+            "index": 0,
+            "delta": {"role": "assistant", "content": None, "reasoning_content": entry["reasoning_content"]},
+            "finish_reason": None,
+            "native_finish_reason": None,
+        })
+
+    delta_content: Dict[str, Any] = {"role": "assistant"}
+    finish_reason_val = "stop"
+    if entry.get("functions"):
+        delta_content["content"] = None
+        delta_content["tool_calls"] = _build_tool_calls(entry["functions"])
+        finish_reason_val = "tool_calls"
+    elif entry.get("content"):
+        delta_content["content"] = entry["content"]
+    yield _chunk({
+        "index": 0,
+        "delta": delta_content,
+        "finish_reason": finish_reason_val,
+        "native_finish_reason": finish_reason_val,
+    })
+
+    yield _chunk({
+        "index": 0,
+        "delta": {},
+        "finish_reason": "stop",
+        "native_finish_reason": "stop"
+    }, usage=entry.get("usage", {}))
+    yield "data: [DONE]\n\n"
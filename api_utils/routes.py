@@ -4,16 +4,17 @@ FastAPI路由处理器模块
 """
 
 import asyncio
+import math
 import os
 import random
 import time
 import uuid
-from typing import Dict, List, Any, Set
+from typing import Dict, List, Any, Optional, Set
 from asyncio import Queue, Future, Lock, Event
 import logging
 
 from fastapi import HTTPException, Request, WebSocket, WebSocketDisconnect, Depends
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi.responses import JSONResponse, FileResponse, StreamingResponse
 from pydantic import BaseModel
 from playwright.async_api import Page as AsyncPage
 
@@ -24,10 +25,20 @@ from config import *
 from models import ChatCompletionRequest, WebSocketConnectionManager
 
 # --- browser_utils模块导入 ---
-from browser_utils import _handle_model_list_response
+from browser_utils import _handle_model_list_response, request_model_list_refresh, get_error_snapshot_stats
+
+# --- logging_utils模块导入 ---
+from logging_utils import get_logging_stats
 
 # --- 依赖项导入 ---
 from .dependencies import *
+from .response_cache import compute_request_cache_key, is_request_cacheable, build_cached_json_response, replay_cached_stream
+from .request_coalescing import RequestCoalescer
+from .rate_limiter import RateLimiter, resolve_request_model_id
+from .admission import AdmissionController, AdmissionRejected
+from .jobs import JobRunner
+from .batches import BatchManager, BatchError
+from .utils import coalesce_sse_stream, resolve_sse_flush_policy
 
 
 # --- 静态文件端点 ---
@@ -63,15 +74,15 @@ async def get_api_info(request: Request, current_ai_studio_model_id: str = Depen
     """返回API信息"""
     from api_utils import auth_utils
 
-    server_port = request.url.port or os.environ.get('SERVER_PORT_INFO', '8000')
+    server_port = request.url.port or get_runtime_settings().server_port_info
     host = request.headers.get('host') or f"127.0.0.1:{server_port}"
     scheme = request.headers.get('x-forwarded-proto', 'http')
     base_url = f"{scheme}://{host}"
     api_base = f"{base_url}/v1"
     effective_model_name = current_ai_studio_model_id or MODEL_NAME
 
-    api_key_required = bool(auth_utils.API_KEYS)
-    api_key_count = len(auth_utils.API_KEYS)
+    api_key_required = auth_utils.keys_required()
+    api_key_count = len(auth_utils.api_keys())
 
     if api_key_required:
         message = f"API Key is required. {api_key_count} valid key(s) configured."
@@ -94,39 +105,56 @@ async def get_api_info(request: Request, current_ai_studio_model_id: str = Depen
 # --- 健康检查端点 ---
 async def health_check(
     server_state: Dict[str, Any] = Depends(get_server_state),
+    startup_status: Dict[str, Any] = Depends(get_startup_status),
     worker_task = Depends(get_worker_task),
-    request_queue: Queue = Depends(get_request_queue)
+    request_queue: Queue = Depends(get_request_queue),
+    page_supervisor = Depends(get_page_supervisor),
+    rate_limiter: RateLimiter = Depends(get_rate_limiter),
+    log_ws_manager: WebSocketConnectionManager = Depends(get_log_ws_manager)
 ):
     """健康检查"""
     is_worker_running = bool(worker_task and not worker_task.done())
-    launch_mode = os.environ.get('LAUNCH_MODE', 'unknown')
-    browser_page_critical = launch_mode != "direct_debug_no_browser"
+    runtime_settings = get_runtime_settings()
+    launch_mode = runtime_settings.launch_mode or 'unknown'
+    browser_page_critical = runtime_settings.browser_required
     
     core_ready_conditions = [not server_state["is_initializing"], server_state["is_playwright_ready"]]
     if browser_page_critical:
         core_ready_conditions.extend([server_state["is_browser_connected"], server_state["is_page_ready"]])
     
     is_core_ready = all(core_ready_conditions)
-    status_val = "OK" if is_core_ready and is_worker_running else "Error"
+    if is_core_ready and is_worker_running:
+        status_val = "OK"
+    elif startup_status["state"] == "warming":
+        status_val = "Warming"
+    else:
+        status_val = "Error"
     q_size = request_queue.qsize() if request_queue else -1
     
     status_message_parts = []
     if server_state["is_initializing"]: status_message_parts.append("初始化进行中")
+    if startup_status["error"]: status_message_parts.append(f"启动失败: {startup_status['error']}")
     if not server_state["is_playwright_ready"]: status_message_parts.append("Playwright 未就绪")
     if browser_page_critical:
         if not server_state["is_browser_connected"]: status_message_parts.append("浏览器未连接")
         if not server_state["is_page_ready"]: status_message_parts.append("页面未就绪")
     if not is_worker_running: status_message_parts.append("Worker 未运行")
+    failover_stats = page_supervisor.stats() if page_supervisor else None
+    if failover_stats and failover_stats["failed"]: status_message_parts.append("页面故障切换多次失败，后台重试中")
+    elif failover_stats and not failover_stats["ready"]: status_message_parts.append("页面故障切换中")
     
     status = {
         "status": status_val,
         "message": "",
-        "details": {**server_state, "workerRunning": is_worker_running, "queueLength": q_size, "launchMode": launch_mode, "browserAndPageCritical": browser_page_critical}
+        "details": {**server_state, "workerRunning": is_worker_running, "queueLength": q_size, "launchMode": launch_mode, "browserAndPageCritical": browser_page_critical, "startup": startup_status, "failover": failover_stats, "rateLimits": rate_limiter.stats() if rate_limiter else None, "logging": {**get_logging_stats(), "websocket": log_ws_manager.stats() if log_ws_manager else None}, "errorSnapshots": get_error_snapshot_stats()}
     }
     
     if status_val == "OK":
         status["message"] = f"服务运行中;队列长度: {q_size}。"
         return JSONResponse(content=status, status_code=200)
+    elif status_val == "Warming":
+        status["message"] = f"服务预热中，请求将排队等待启动完成;队列长度: {q_size}。"
+        return JSONResponse(content=status, status_code=503, headers={"Retry-After": "5"})
     else:
         status["message"] = f"服务不可用;问题: {(', '.join(status_message_parts) or '未知原因')}. 队列长度: {q_size}."
         return JSONResponse(content=status, status_code=503)
@@ -135,30 +163,18 @@ async def health_check(
 # --- 模型列表端点 ---
 async def list_models(
     logger: logging.Logger = Depends(get_logger),
-    model_list_fetch_event: Event = Depends(get_model_list_fetch_event),
-    page_instance: AsyncPage = Depends(get_page_instance),
     parsed_model_list: List[Dict[str, Any]] = Depends(get_parsed_model_list),
     excluded_model_ids: Set[str] = Depends(get_excluded_model_ids)
 ):
-    """获取模型列表"""
+    """获取模型列表（始终从缓存返回，不会重新加载服务页面）"""
     logger.info("[API] 收到 /v1/models 请求。")
     
-    if not model_list_fetch_event.is_set() and page_instance and not page_instance.is_closed():
-        logger.info("/v1/models: 模型列表事件未设置，尝试刷新页面...")
-        try:
-            await page_instance.reload(wait_until="domcontentloaded", timeout=20000)
-            await asyncio.wait_for(model_list_fetch_event.wait(), timeout=10.0)
-        except Exception as e:
-            logger.error(f"/v1/models: 刷新或等待模型列表时出错: {e}")
-        finally:
-            if not model_list_fetch_event.is_set():
-                model_list_fetch_event.set()
-    
     if parsed_model_list:
         final_model_list = [m for m in parsed_model_list if m.get("id") not in excluded_model_ids]
         return {"object": "list", "data": final_model_list}
     else:
-        logger.warning("模型列表为空，返回默认后备模型。")
+        logger.warning("模型列表为空，已请求后台刷新，先返回默认后备模型。")
+        request_model_list_refresh()
         return {"object": "list", "data": [{
             "id": DEFAULT_FALLBACK_MODEL_ID, "object": "model", "created": int(time.time()),
             "owned_by": "camoufox-proxy-fallback"
@@ -166,45 +182,147 @@ async def list_models(
 
 
 # --- 聊天完成端点 ---
+def _check_model_allowed(req_id: str, request: ChatCompletionRequest, http_request: Request):
+    """API 密钥元数据限制了可用模型时，拒绝其他模型的请求"""
+    key_info = getattr(http_request.state, "api_key_info", None)
+    if key_info is not None and key_info.allowed_models is not None:
+        requested_model_id = resolve_request_model_id(request.model)
+        if not key_info.allows_model(requested_model_id):
+            raise HTTPException(status_code=403, detail=f"[{req_id}] 该 API 密钥无权使用模型 '{requested_model_id}'。")
+
+
 async def chat_completions(
     request: ChatCompletionRequest,
     http_request: Request,
     logger: logging.Logger = Depends(get_logger),
     request_queue: Queue = Depends(get_request_queue),
     server_state: Dict[str, Any] = Depends(get_server_state),
-    worker_task = Depends(get_worker_task)
+    startup_status: Dict[str, Any] = Depends(get_startup_status),
+    worker_task = Depends(get_worker_task),
+    response_cache = Depends(get_response_cache),
+    request_coalescer: RequestCoalescer = Depends(get_request_coalescer),
+    rate_limiter: RateLimiter = Depends(get_rate_limiter),
+    admission_controller: AdmissionController = Depends(get_admission_controller)
 ):
     """处理聊天完成请求"""
     req_id = ''.join(random.choices('abcdefghijklmnopqrstuvwxyz0123456789', k=7))
     logger.info(f"[{req_id}] 收到 /v1/chat/completions 请求 (Stream={request.stream})")
     
-    launch_mode = os.environ.get('LAUNCH_MODE', 'unknown')
-    browser_page_critical = launch_mode != "direct_debug_no_browser"
+    _check_model_allowed(req_id, request, http_request)
+    
+    # 响应缓存命中时直接回放，不进入请求队列
+    if response_cache is not None and is_request_cacheable(request):
+        cached_entry = await response_cache.get(compute_request_cache_key(request))
+        if cached_entry is not None:
+            logger.info(f"[{req_id}] 响应缓存命中，直接回放 (Stream={request.stream})。")
+            if request.stream:
+                flush_bytes, flush_interval_ms = resolve_sse_flush_policy(request)
+                return StreamingResponse(
+                    coalesce_sse_stream(replay_cached_stream(cached_entry, req_id), flush_bytes, flush_interval_ms),
+                    media_type="text/event-stream"
+                )
+            return JSONResponse(content=build_cached_json_response(cached_entry, req_id))
+    
+    browser_page_critical = get_runtime_settings().browser_required
+    
+    if startup_status["state"] == "warming":
+        # 预热期间请求正常入队，Worker 在启动完成后开始处理
+        logger.info(f"[{req_id}] 服务预热中，请求将排队等待启动完成。")
+    else:
+        service_unavailable = server_state["is_initializing"] or \
+                              not server_state["is_playwright_ready"] or \
+                              (browser_page_critical and (not server_state["is_page_ready"] or not server_state["is_browser_connected"])) or \
+                              not worker_task or worker_task.done()
+        
+        if service_unavailable:
+            raise HTTPException(status_code=503, detail=f"[{req_id}] 服务当前不可用。请稍后重试。", headers={"Retry-After": "30"})
     
-    service_unavailable = server_state["is_initializing"] or \
-                          not server_state["is_playwright_ready"] or \
-                          (browser_page_critical and (not server_state["is_page_ready"] or not server_state["is_browser_connected"])) or \
-                          not worker_task or worker_task.done()
+    # 目标模型冷却时间较长时直接返回 429，便于客户端或分片网关改投其他账号
+    if rate_limiter is not None:
+        model_id = resolve_request_model_id(request.model)
+        retry_after = rate_limiter.retry_after(model_id)
+        if retry_after > RATE_LIMIT_MAX_WAIT_SECONDS:
+            raise HTTPException(
+                status_code=429,
+                detail=f"[{req_id}] 模型 {model_id} 触发配额/限流，冷却中，请 {math.ceil(retry_after)} 秒后重试。",
+                headers={"Retry-After": str(math.ceil(retry_after))}
+            )
     
-    if service_unavailable:
-        raise HTTPException(status_code=503, detail=f"[{req_id}] 服务当前不可用。请稍后重试。", headers={"Retry-After": "30"})
+    timeout_seconds = RESPONSE_COMPLETION_TIMEOUT / 1000 + 120
+    
+    # 相同请求正在排队或执行时，共享其结果而不是重复入队
+    flight = None
+    coalescing_key = None
+    # 与响应缓存相同，默认只合并确定性请求：temperature>0 的请求各自独立采样
+    if request_coalescer is not None and is_request_cacheable(request):
+        coalescing_key = f"{compute_request_cache_key(request)}:{'stream' if request.stream else 'json'}"
+        existing_flight = request_coalescer.join(coalescing_key)
+        if existing_flight is not None:
+            logger.info(f"[{req_id}] 与进行中的相同请求 [{existing_flight.req_id}] 合并，共享其结果。")
+            try:
+                return await asyncio.wait_for(request_coalescer.subscribe(existing_flight), timeout=timeout_seconds)
+            except asyncio.TimeoutError:
+                raise HTTPException(status_code=504, detail=f"[{req_id}] 请求处理超时。")
+            except HTTPException as e:
+                # 被合并的请求被取消或其客户端断开时，改为单独处理
+                if e.status_code != 499:
+                    raise
+                logger.info(f"[{req_id}] 被合并的请求 [{existing_flight.req_id}] 已取消，改为单独处理。")
+            coalescing_key = None
+    
+    # 预计排队时间超过截止时间 (或队列已满) 时立即拒绝，而不是让客户端等到超时
+    queue_deadline = None
+    if admission_controller is not None:
+        try:
+            max_wait = admission_controller.check(request_queue.qsize(), request.max_queue_wait_seconds)
+        except AdmissionRejected as e:
+            logger.warning(f"[{req_id}] 准入控制拒绝请求: {e.reason}，Retry-After {e.retry_after_header} 秒。")
+            raise HTTPException(
+                status_code=503,
+                detail=f"[{req_id}] 服务繁忙: {e.reason}，请 {e.retry_after_header} 秒后重试。",
+                headers={"Retry-After": e.retry_after_header}
+            )
+        if max_wait is not None:
+            queue_deadline = time.time() + max_wait
+    
+    queued_http_request = http_request
+    if coalescing_key is not None:
+        flight = request_coalescer.lead(coalescing_key, req_id)
+        # 发起者断开时，只要还有订阅者就继续执行，不截断其他客户端的响应
+        queued_http_request = request_coalescer.detach(http_request, flight)
     
     result_future = Future()
     await request_queue.put({
-        "req_id": req_id, "request_data": request, "http_request": http_request,
-        "result_future": result_future, "enqueue_time": time.time(), "cancelled": False
+        "req_id": req_id, "request_data": request, "http_request": queued_http_request,
+        "result_future": result_future, "enqueue_time": time.time(), "cancelled": False,
+        "queue_deadline": queue_deadline
     })
     
     try:
-        timeout_seconds = RESPONSE_COMPLETION_TIMEOUT / 1000 + 120
-        return await asyncio.wait_for(result_future, timeout=timeout_seconds)
+        response = await asyncio.wait_for(result_future, timeout=timeout_seconds)
     except asyncio.TimeoutError:
-        raise HTTPException(status_code=504, detail=f"[{req_id}] 请求处理超时。")
+        error = HTTPException(status_code=504, detail=f"[{req_id}] 请求处理超时。")
+        if flight is not None:
+            request_coalescer.fail(flight, error)
+        raise error
     except asyncio.CancelledError:
-        raise HTTPException(status_code=499, detail=f"[{req_id}] 请求被客户端取消。")
+        error = HTTPException(status_code=499, detail=f"[{req_id}] 请求被客户端取消。")
+        if flight is not None:
+            request_coalescer.fail(flight, error)
+        raise error
+    except HTTPException as e:
+        if flight is not None:
+            request_coalescer.fail(flight, e)
+        raise
     except Exception as e:
         logger.exception(f"[{req_id}] 等待Worker响应时出错")
+        if flight is not None:
+            request_coalescer.fail(flight, e if isinstance(e, HTTPException) else HTTPException(status_code=500, detail=f"[{req_id}] 服务器内部错误: {e}"))
         raise HTTPException(status_code=500, detail=f"[{req_id}] 服务器内部错误: {e}")
+    
+    if flight is not None:
+        return request_coalescer.publish(flight, response)
+    return response
 
 
 # --- 取消请求相关 ---
@@ -244,25 +362,211 @@ async def cancel_request(
 # --- 队列状态端点 ---
 async def get_queue_status(
     request_queue: Queue = Depends(get_request_queue),
-    processing_lock: Lock = Depends(get_processing_lock)
+    processing_lock: Lock = Depends(get_processing_lock),
+    request_coalescer: RequestCoalescer = Depends(get_request_coalescer),
+    rate_limiter: RateLimiter = Depends(get_rate_limiter),
+    admission_controller: AdmissionController = Depends(get_admission_controller),
+    job_runner: Optional[JobRunner] = Depends(get_job_runner)
 ):
     """获取队列状态"""
     queue_items = list(request_queue._queue)
     return JSONResponse(content={
         "queue_length": len(queue_items),
         "is_processing_locked": processing_lock.locked(),
+        "coalescing": request_coalescer.stats() if request_coalescer is not None else None,
+        "rate_limits": rate_limiter.stats() if rate_limiter is not None else None,
+        "admission": admission_controller.stats(len(queue_items)) if admission_controller is not None else None,
+        "jobs": await job_runner.stats() if job_runner is not None else None,
         "items": sorted([
             {
                 "req_id": item.get("req_id", "unknown"),
                 "enqueue_time": item.get("enqueue_time", 0),
                 "wait_time_seconds": round(time.time() - item.get("enqueue_time", 0), 2),
+                "estimated_start_seconds": round(admission_controller.estimate_wait(position), 1) if admission_controller is not None else None,
                 "is_streaming": item.get("request_data").stream,
                 "cancelled": item.get("cancelled", False)
-            } for item in queue_items
+            } for position, item in enumerate(queue_items)
         ], key=lambda x: x.get("enqueue_time", 0))
     })
 
 
+# --- 异步任务端点 ---
+def _require_job_runner(job_runner: Optional[JobRunner]) -> JobRunner:
+    if job_runner is None:
+        raise HTTPException(status_code=404, detail="异步任务未启用 (需要配置 JOBS_DB_PATH)。")
+    return job_runner
+
+
+async def submit_job(
+    request: ChatCompletionRequest,
+    http_request: Request,
+    logger: logging.Logger = Depends(get_logger),
+    job_runner: Optional[JobRunner] = Depends(get_job_runner)
+):
+    """提交异步聊天任务，立即返回任务 ID；任务以非流式方式执行"""
+    job_runner = _require_job_runner(job_runner)
+    _check_model_allowed("job", request, http_request)
+    payload = request.model_dump(exclude_none=True)
+    for field_name in ("stream", "stream_flush_bytes", "stream_flush_interval_ms", "max_queue_wait_seconds"):
+        payload.pop(field_name, None)
+    job = await job_runner.submit(payload)
+    logger.info(f"[{job['id']}] 已提交异步任务。")
+    return {"object": "chat.completion.job", **job}
+
+
+async def get_job(job_id: str, job_runner: Optional[JobRunner] = Depends(get_job_runner)):
+    """查询异步任务状态，完成后 response 为与 /v1/chat/completions 相同的非流式响应"""
+    job = await _require_job_runner(job_runner).get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"任务 {job_id} 不存在。")
+    return {
+        "object": "chat.completion.job",
+        "id": job["id"],
+        "status": job["status"],
+        "attempts": job["attempts"],
+        "req_id": job["req_id"],
+        "created_at": job["created_at"],
+        "started_at": job["started_at"],
+        "finished_at": job["finished_at"],
+        "response": job["response"],
+        "error": {"status_code": job["status_code"], "message": job["error"]} if job["error"] else None,
+    }
+
+
+async def cancel_job(
+    job_id: str,
+    logger: logging.Logger = Depends(get_logger),
+    job_runner: Optional[JobRunner] = Depends(get_job_runner)
+):
+    """取消排队或执行中的异步任务"""
+    if await _require_job_runner(job_runner).cancel(job_id):
+        logger.info(f"[{job_id}] 已请求取消异步任务。")
+        return JSONResponse(content={"success": True, "message": f"Job {job_id} marked as cancelled."})
+    return JSONResponse(status_code=404, content={"success": False, "message": f"Job {job_id} not found or already finished."})
+
+
+# --- 批处理端点 (兼容 OpenAI Files / Batch API) ---
+class BatchCreateRequest(BaseModel):
+    input_file_id: str
+    endpoint: str
+    completion_window: str = "24h"
+    metadata: Optional[Dict[str, Any]] = None
+
+
+def _require_batch_manager(batch_manager: Optional[BatchManager]) -> BatchManager:
+    if batch_manager is None:
+        raise HTTPException(status_code=404, detail="批处理未启用 (需要配置 JOBS_DB_PATH)。")
+    return batch_manager
+
+
+async def _iter_upload_file(upload, chunk_size: int = 1024 * 1024):
+    while True:
+        chunk = await upload.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+
+async def upload_file(
+    http_request: Request,
+    purpose: str = "batch",
+    filename: str = "batch_input.jsonl",
+    batch_manager: Optional[BatchManager] = Depends(get_batch_manager)
+):
+    """
+    上传批处理输入文件。支持 OpenAI SDK 使用的 multipart/form-data (file、purpose 字段，需要安装 python-multipart)，
+    也可以直接以 JSONL 作为请求体上传 (purpose、filename 通过查询参数指定)，内容逐块写入磁盘
+    """
+    batch_manager = _require_batch_manager(batch_manager)
+    try:
+        if http_request.headers.get("content-type", "").startswith("multipart/form-data"):
+            try:
+                form = await http_request.form()
+            except AssertionError:
+                # Starlette 在未安装 python-multipart 时以断言失败提示
+                raise HTTPException(status_code=415, detail="multipart 上传需要安装 python-multipart，或直接以 JSONL 作为请求体上传。")
+            upload = form.get("file")
+            if upload is None or isinstance(upload, str):
+                raise HTTPException(status_code=400, detail="缺少 file 字段。")
+            file_object = await batch_manager.save_upload(
+                upload.filename or filename, str(form.get("purpose", purpose)), _iter_upload_file(upload)
+            )
+        else:
+            file_object = await batch_manager.save_upload(filename, purpose, http_request.stream())
+    except BatchError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.message)
+    return file_object
+
+
+async def get_file(file_id: str, batch_manager: Optional[BatchManager] = Depends(get_batch_manager)):
+    file_object = await _require_batch_manager(batch_manager).get_file(file_id)
+    if file_object is None:
+        raise HTTPException(status_code=404, detail=f"文件 {file_id} 不存在。")
+    return file_object
+
+
+async def get_file_content(file_id: str, batch_manager: Optional[BatchManager] = Depends(get_batch_manager)):
+    """下载文件内容；批处理进行中也可以下载已输出的部分结果"""
+    batch_manager = _require_batch_manager(batch_manager)
+    file_object = await batch_manager.get_file(file_id)
+    if file_object is None:
+        raise HTTPException(status_code=404, detail=f"文件 {file_id} 不存在。")
+    return FileResponse(batch_manager.file_path(file_id), media_type="application/jsonl", filename=file_object["filename"])
+
+
+async def create_batch(
+    request: BatchCreateRequest,
+    http_request: Request,
+    logger: logging.Logger = Depends(get_logger),
+    batch_manager: Optional[BatchManager] = Depends(get_batch_manager)
+):
+    """按输入文件创建批处理，每行作为一个低优先级任务调度"""
+    batch_manager = _require_batch_manager(batch_manager)
+
+    def check_model(chat_request: ChatCompletionRequest):
+        try:
+            _check_model_allowed("batch", chat_request, http_request)
+        except HTTPException as e:
+            raise BatchError(str(e.detail), status_code=e.status_code)
+
+    try:
+        batch = await batch_manager.create_batch(
+            request.input_file_id, request.endpoint, request.completion_window, request.metadata, check_model
+        )
+    except BatchError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.message)
+    logger.info(f"[{batch['id']}] 已创建批处理，共 {batch['request_counts']['total']} 个请求。")
+    return batch
+
+
+async def get_batch(batch_id: str, batch_manager: Optional[BatchManager] = Depends(get_batch_manager)):
+    batch = await _require_batch_manager(batch_manager).get_batch(batch_id)
+    if batch is None:
+        raise HTTPException(status_code=404, detail=f"批处理 {batch_id} 不存在。")
+    return batch
+
+
+async def list_batches(
+    limit: int = 20,
+    after: Optional[str] = None,
+    batch_manager: Optional[BatchManager] = Depends(get_batch_manager)
+):
+    return await _require_batch_manager(batch_manager).list_batches(limit, after)
+
+
+async def cancel_batch(
+    batch_id: str,
+    logger: logging.Logger = Depends(get_logger),
+    batch_manager: Optional[BatchManager] = Depends(get_batch_manager)
+):
+    """取消批处理：排队中的请求直接取消，执行中的请求中止后批处理变为 cancelled"""
+    batch = await _require_batch_manager(batch_manager).cancel_batch(batch_id)
+    if batch is None:
+        raise HTTPException(status_code=404, detail=f"批处理 {batch_id} 不存在。")
+    logger.info(f"[{batch_id}] 已请求取消批处理 (状态: {batch['status']})。")
+    return batch
+
+
 # --- WebSocket日志端点 ---
 async def websocket_log_endpoint(
     websocket: WebSocket,
@@ -290,6 +594,8 @@ async def websocket_log_endpoint(
 # --- API密钥管理数据模型 ---
 class ApiKeyRequest(BaseModel):
     key: str
+    # 可选的密钥元数据，如 {"name": "team-a", "rpm": 30, "models": ["gemini-2.5-pro"]}
+    metadata: Optional[Dict[str, Any]] = None
 
 class ApiKeyTestRequest(BaseModel):
     key: str
@@ -300,8 +606,8 @@ async def get_api_keys(logger: logging.Logger = Depends(get_logger)):
     """获取API密钥列表"""
     from api_utils import auth_utils
     try:
-        auth_utils.initialize_keys()
-        keys_info = [{"value": key, "status": "有效"} for key in auth_utils.API_KEYS]
+        auth_utils.refresh_keys_if_changed(force=True)
+        keys_info = [{"value": key, "status": "有效", "metadata": info.metadata} for key, info in auth_utils.api_keys().items()]
         return JSONResponse(content={"success": True, "keys": keys_info, "total_count": len(keys_info)})
     except Exception as e:
         logger.error(f"获取API密钥列表失败: {e}")
@@ -315,23 +621,19 @@ async def add_api_key(request: ApiKeyRequest, logger: logging.Logger = Depends(g
     if not key_value or len(key_value) < 8:
         raise HTTPException(status_code=400, detail="无效的API密钥格式。")
     
-    auth_utils.initialize_keys()
-    if key_value in auth_utils.API_KEYS:
-        raise HTTPException(status_code=400, detail="该API密钥已存在。")
-
+    if any(ch.isspace() for ch in key_value):
+        raise HTTPException(status_code=400, detail="API密钥不能包含空白字符。")
+    
+    # 是否已存在在写文件的同一把锁内判断，并发添加同一密钥时只有一个成功
     try:
-        key_file_path = os.path.join(os.path.dirname(__file__), "..", "key.txt")
-        with open(key_file_path, 'a+', encoding='utf-8') as f:
-            f.seek(0)
-            if f.read(): f.write("\n")
-            f.write(key_value)
-        
-        auth_utils.initialize_keys()
-        logger.info(f"API密钥已添加: {key_value[:4]}...{key_value[-4:]}")
-        return JSONResponse(content={"success": True, "message": "API密钥添加成功", "key_count": len(auth_utils.API_KEYS)})
+        added = await asyncio.to_thread(auth_utils.add_api_key, key_value, request.metadata)
     except Exception as e:
         logger.error(f"添加API密钥失败: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+    if not added:
+        raise HTTPException(status_code=400, detail="该API密钥已存在。")
+    logger.info(f"API密钥已添加: {key_value[:4]}...{key_value[-4:]}")
+    return JSONResponse(content={"success": True, "message": "API密钥添加成功", "key_count": len(auth_utils.api_keys())})
 
 
 async def test_api_key(request: ApiKeyTestRequest, logger: logging.Logger = Depends(get_logger)):
@@ -341,7 +643,6 @@ async def test_api_key(request: ApiKeyTestRequest, logger: logging.Logger = Depe
     if not key_value:
         raise HTTPException(status_code=400, detail="API密钥不能为空。")
     
-    auth_utils.initialize_keys()
     is_valid = auth_utils.verify_api_key(key_value)
     logger.info(f"API密钥测试: {key_value[:4]}...{key_value[-4:]} - {'有效' if is_valid else '无效'}")
     return JSONResponse(content={"success": True, "valid": is_valid, "message": "密钥有效" if is_valid else "密钥无效或不存在"})
@@ -354,21 +655,12 @@ async def delete_api_key(request: ApiKeyRequest, logger: logging.Logger = Depend
     if not key_value:
         raise HTTPException(status_code=400, detail="API密钥不能为空。")
 
-    auth_utils.initialize_keys()
-    if key_value not in auth_utils.API_KEYS:
-        raise HTTPException(status_code=404, detail="API密钥不存在。")
-
     try:
-        key_file_path = os.path.join(os.path.dirname(__file__), "..", "key.txt")
-        with open(key_file_path, 'r', encoding='utf-8') as f:
-            lines = f.readlines()
-        
-        with open(key_file_path, 'w', encoding='utf-8') as f:
-            f.writelines(line for line in lines if line.strip() != key_value)
-            
-        auth_utils.initialize_keys()
-        logger.info(f"API密钥已删除: {key_value[:4]}...{key_value[-4:]}")
-        return JSONResponse(content={"success": True, "message": "API密钥删除成功", "key_count": len(auth_utils.API_KEYS)})
+        deleted = await asyncio.to_thread(auth_utils.delete_api_key, key_value)
     except Exception as e:
         logger.error(f"删除API密钥失败: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+    if not deleted:
+        raise HTTPException(status_code=404, detail="API密钥不存在。")
+    logger.info(f"API密钥已删除: {key_value[:4]}...{key_value[-4:]}")
+    return JSONResponse(content={"success": True, "message": "API密钥删除成功", "key_count": len(auth_utils.api_keys())})
\ No newline at end of file
@@ -3,14 +3,26 @@ API工具函数模块
 包含SSE生成、流处理、token统计和请求验证等工具函数
 """
 
+import abc
 import asyncio
+import hashlib
 import json
+import logging
+import os
+import re
 import time
 import datetime
-from typing import Any, Dict, List, Optional, AsyncGenerator
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, AsyncGenerator, AsyncIterator, Tuple
 from asyncio import Queue
 from models import Message
+from config import (
+    SSE_COALESCE_ENABLED, SSE_FLUSH_BYTES, SSE_FLUSH_INTERVAL_MS,
+    TOKENIZER_VOCAB_PATH, TOKEN_COUNT_CACHE_SIZE, PROMPT_PREFIX_CACHE_SIZE
+)
+from .rate_limiter import is_rate_limit_message, resolve_request_model_id
 
+logger = logging.getLogger("AIStudioProxyServer")
 
 
 # --- SSE生成函数 ---
@@ -49,7 +61,123 @@ def generate_sse_error_chunk(message: str, req_id: str, error_type: str = "serve
     return f"data: {json.dumps(error_chunk)}\n\n"
 
 
+# --- SSE输出合并 ---
+def resolve_sse_flush_policy(request: Any = None) -> Tuple[int, float]:
+    """
+    解析SSE刷新策略，请求级配置优先于全局配置
+
+    Returns:
+        (flush_bytes, flush_interval_ms)，flush_bytes <= 0 表示逐事件输出
+    """
+    if not SSE_COALESCE_ENABLED:
+        flush_bytes, flush_interval_ms = 0, 0.0
+    else:
+        flush_bytes, flush_interval_ms = SSE_FLUSH_BYTES, float(SSE_FLUSH_INTERVAL_MS)
+
+    request_bytes = getattr(request, 'stream_flush_bytes', None)
+    request_interval = getattr(request, 'stream_flush_interval_ms', None)
+    if request_bytes is not None:
+        flush_bytes = max(0, int(request_bytes))
+        if request_interval is None and flush_interval_ms <= 0:
+            flush_interval_ms = float(SSE_FLUSH_INTERVAL_MS)
+    if request_interval is not None:
+        flush_interval_ms = max(0.0, float(request_interval))
+    return flush_bytes, flush_interval_ms
+
+
+async def coalesce_sse_stream(
+    source: AsyncIterator[str],
+    flush_bytes: int = SSE_FLUSH_BYTES,
+    flush_interval_ms: float = SSE_FLUSH_INTERVAL_MS
+) -> AsyncGenerator[str, None]:
+    """
+    合并SSE事件后再写出，减少小块写入和系统调用
+
+    事件本身保持完整 (每个 "data: ...\\n\\n" 原样拼接)，客户端解析结果不变。
+    缓冲达到 flush_bytes 或最早的缓冲事件等待超过 flush_interval_ms 时刷新；
+    flush_bytes <= 0 时直接透传，保持每个增量一次写出。
+    """
+    if flush_bytes <= 0:
+        async for event in source:
+            yield event
+        return
+
+    loop = asyncio.get_running_loop()
+    interval_s = max(0.0, flush_interval_ms) / 1000
+    source_iter = source.__aiter__()
+    buffer: List[str] = []
+    buffered_bytes = 0
+    deadline: Optional[float] = None
+    pending: Optional[asyncio.Task] = None
+
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(source_iter.__anext__())
+
+            timeout = None if deadline is None else max(0.0, deadline - loop.time())
+            done, _ = await asyncio.wait({pending}, timeout=timeout)
+
+            if not done:
+                # 超过刷新间隔，下一个事件仍未到达
+                yield "".join(buffer)
+                buffer.clear()
+                buffered_bytes = 0
+                deadline = None
+                continue
+
+            task, pending = pending, None
+            try:
+                event = task.result()
+            except StopAsyncIteration:
+                break
+
+            buffer.append(event)
+            buffered_bytes += len(event)
+            if deadline is None:
+                deadline = loop.time() + interval_s
+            if buffered_bytes >= flush_bytes or loop.time() >= deadline:
+                yield "".join(buffer)
+                buffer.clear()
+                buffered_bytes = 0
+                deadline = None
+
+        if buffer:
+            yield "".join(buffer)
+    finally:
+        if pending is not None and not pending.done():
+            pending.cancel()
+            try:
+                await pending
+            except (asyncio.CancelledError, StopAsyncIteration):
+                pass
+            except Exception:
+                pass
+        aclose = getattr(source_iter, 'aclose', None)
+        if aclose is not None:
+            try:
+                await aclose()
+            except RuntimeError:
+                pass
+
+
 # --- 流处理工具函数 ---
+def raise_upstream_stream_error(req_id: str, error: Dict[str, Any]) -> None:
+    """流式代理拦截到 GenerateContent 错误状态时抛出对应的 HTTP 异常，配额/限流信号计入当前模型的令牌桶"""
+    from fastapi import HTTPException
+    from server import rate_limiter
+
+    status = error.get("status") or 502
+    message = str(error.get("message") or f"HTTP {status}")
+    if status == 429 or is_rate_limit_message(message):
+        cooldown = None
+        if rate_limiter is not None:
+            cooldown = rate_limiter.record_rate_limit(resolve_request_model_id(None), message)
+        headers = {"Retry-After": str(int(cooldown))} if cooldown else None
+        raise HTTPException(status_code=429, detail=f"[{req_id}] AI Studio 配额/限流: {message}", headers=headers)
+    raise HTTPException(status_code=502, detail=f"[{req_id}] AI Studio 返回错误: {message}")
+
+
 async def use_stream_response(req_id: str) -> AsyncGenerator[Any, None]:
     """使用流响应（从服务器的全局队列获取数据）"""
     from server import STREAM_QUEUE, logger
@@ -59,6 +187,9 @@ async def use_stream_response(req_id: str) -> AsyncGenerator[Any, None]:
         logger.warning(f"[{req_id}] STREAM_QUEUE is None, 无法使用流响应")
         return
     
+    # 流式代理以紧凑帧发送消息（见 stream.framing）；STREAM_QUEUE 存在时 stream 包已在启动时导入
+    from stream.framing import decode_message
+
     logger.info(f"[{req_id}] 开始使用流响应")
     
     empty_count = 0
@@ -77,12 +208,16 @@ async def use_stream_response(req_id: str) -> AsyncGenerator[Any, None]:
                 # 重置空计数器
                 empty_count = 0
                 data_received = True
+                if isinstance(data, (bytes, bytearray)):
+                    data = decode_message(data)
                 logger.debug(f"[{req_id}] 接收到流数据: {type(data)} - {str(data)[:200]}...")
                 
                 # 检查是否是JSON字符串形式的结束标志
                 if isinstance(data, str):
                     try:
                         parsed_data = json.loads(data)
+                        if parsed_data.get("error"):
+                            raise_upstream_stream_error(req_id, parsed_data["error"])
                         if parsed_data.get("done") is True:
                             logger.info(f"[{req_id}] 接收到JSON格式的完成标志")
                             yield parsed_data
@@ -94,6 +229,8 @@ async def use_stream_response(req_id: str) -> AsyncGenerator[Any, None]:
                         logger.debug(f"[{req_id}] 返回非JSON字符串数据")
                         yield data
                 else:
+                    if isinstance(data, dict) and data.get("error"):
+                        raise_upstream_stream_error(req_id, data["error"])
                     # 直接返回数据
                     yield data
                     
@@ -195,36 +332,171 @@ def validate_chat_request(messages: List[Message], req_id: str) -> Dict[str, Opt
 
 
 # --- 提示准备函数 ---
+class _PromptPrefixCache:
+    """
+    组合提示前缀缓存（LRU）
+    键为消息列表的滚动哈希，值为已格式化的提示前缀及其是否已包含系统消息。
+    客户端每轮都会重发完整历史，命中后只需格式化新增的消息。
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries: "OrderedDict[bytes, Tuple[str, bool]]" = OrderedDict()
+
+    def get(self, key: bytes) -> Optional[Tuple[str, bool]]:
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key: bytes, prefix: str, has_system: bool) -> None:
+        if self.max_size <= 0:
+            return
+        self._entries[key] = (prefix, has_system)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+_prompt_prefix_cache = _PromptPrefixCache(PROMPT_PREFIX_CACHE_SIZE)
+
+
+def _message_prefix_hashes(messages: List[Message]) -> List[bytes]:
+    """计算消息列表每个前缀的滚动哈希：h[i] = H(h[i-1] + H(messages[i]))"""
+    hashes = []
+    previous = b''
+    for msg in messages:
+        if hasattr(msg, 'model_dump_json'):
+            serialized = msg.model_dump_json()
+        else:
+            serialized = json.dumps(msg, sort_keys=True, ensure_ascii=False, default=str)
+        message_digest = hashlib.blake2b(serialized.encode('utf-8', 'surrogatepass'), digest_size=16).digest()
+        previous = hashlib.blake2b(previous + message_digest, digest_size=16).digest()
+        hashes.append(previous)
+    return hashes
+
+
+def _format_prompt_turn(msg: Message, i: int, req_id: str, logger) -> Optional[str]:
+    """格式化单条非系统消息，内容为空且无工具调用时返回 None"""
+    role_map_ui = {"user": "用户", "assistant": "助手", "system": "系统", "tool": "工具"}
+    
+    role = msg.role or 'unknown'
+    role_prefix_ui = f"{role_map_ui.get(role, role.capitalize())}:\n"
+    current_turn_parts = [role_prefix_ui]
+    
+    content = msg.content or ''
+    content_str = ""
+    
+    if isinstance(content, str):
+        content_str = content.strip()
+    elif isinstance(content, list):
+        # 处理多模态内容
+        text_parts = []
+        for item in content:
+            if hasattr(item, 'type') and item.type == 'text':
+                text_parts.append(item.text or '')
+            elif isinstance(item, dict) and item.get('type') == 'text':
+                text_parts.append(item.get('text', ''))
+            else:
+                logger.warning(f"[{req_id}] (准备提示) 警告: 在索引 {i} 的消息中忽略非文本或未知类型的 content item")
+        content_str = "\n".join(text_parts).strip()
+    else:
+        logger.warning(f"[{req_id}] (准备提示) 警告: 角色 {role} 在索引 {i} 的内容类型意外 ({type(content)}) 或为 None。")
+        content_str = str(content or "").strip()
+    
+    if content_str:
+        current_turn_parts.append(content_str)
+    
+    # 处理工具调用
+    tool_calls = msg.tool_calls
+    if role == 'assistant' and tool_calls:
+        if content_str:
+            current_turn_parts.append("\n")
+        
+        tool_call_visualizations = []
+        for tool_call in tool_calls:
+            if hasattr(tool_call, 'type') and tool_call.type == 'function':
+                function_call = tool_call.function
+                func_name = function_call.name if function_call else None
+                func_args_str = function_call.arguments if function_call else None
+                
+                try:
+                    parsed_args = json.loads(func_args_str if func_args_str else '{}')
+                    formatted_args = json.dumps(parsed_args, indent=2, ensure_ascii=False)
+                except (json.JSONDecodeError, TypeError):
+                    formatted_args = func_args_str if func_args_str is not None else "{}"
+                
+                tool_call_visualizations.append(
+                    f"请求调用函数: {func_name}\n参数:\n{formatted_args}"
+                )
+        
+        if tool_call_visualizations:
+            current_turn_parts.append("\n".join(tool_call_visualizations))
+    
+    if len(current_turn_parts) > 1 or (role == 'assistant' and tool_calls):
+        return "".join(current_turn_parts)
+    logger.info(f"[{req_id}] (准备提示) 跳过角色 {role} 在索引 {i} 的空消息 (只有前缀)。")
+    return None
+
+
 def prepare_combined_prompt(messages: List[Message], req_id: str) -> str:
-    """准备组合提示"""
+    """
+    准备组合提示
+    若消息列表的某个前缀此前已组合过（多轮对话重发历史），复用缓存的前缀，只格式化新增消息。
+    """
     from server import logger
     
     logger.info(f"[{req_id}] (准备提示) 正在从 {len(messages)} 条消息准备组合提示 (包括历史)。")
     
     combined_parts = []
-    system_prompt_content: Optional[str] = None
+    has_system = False
+    start_index = 0
     processed_system_message_indices = set()
+    turn_separator = "\n---\n"
     
-    # 处理系统消息
-    for i, msg in enumerate(messages):
-        if msg.role == 'system':
-            content = msg.content
-            if isinstance(content, str) and content.strip():
-                system_prompt_content = content.strip()
-                processed_system_message_indices.add(i)
-                logger.info(f"[{req_id}] (准备提示) 在索引 {i} 找到并使用系统提示: '{system_prompt_content[:80]}...'")
-                system_instr_prefix = "系统指令:\n"
-                combined_parts.append(f"{system_instr_prefix}{system_prompt_content}")
-            else:
-                logger.info(f"[{req_id}] (准备提示) 在索引 {i} 忽略非字符串或空的系统消息。")
-                processed_system_message_indices.add(i)
-            break
+    prefix_hashes = _message_prefix_hashes(messages) if _prompt_prefix_cache.max_size > 0 else []
     
-    role_map_ui = {"user": "用户", "assistant": "助手", "system": "系统", "tool": "工具"}
-    turn_separator = "\n---\n"
+    # 查找最长的已缓存前缀。系统消息总是放在最前面，
+    # 因此前缀中没有系统消息而新增部分有时不能复用，需要完整重建
+    for end in range(len(prefix_hashes), 0, -1):
+        cached = _prompt_prefix_cache.get(prefix_hashes[end - 1])
+        if cached is None:
+            continue
+        cached_prefix, cached_has_system = cached
+        if cached_has_system or not any(msg.role == 'system' for msg in messages[end:]):
+            start_index = end
+            has_system = cached_has_system
+            if cached_prefix:
+                combined_parts.append(cached_prefix)
+            logger.info(f"[{req_id}] (准备提示) 复用已缓存的前 {end} 条消息的提示前缀，仅格式化新增的 {len(messages) - end} 条消息。")
+        break
+    
+    # 处理系统消息
+    if start_index == 0:
+        for i, msg in enumerate(messages):
+            if msg.role == 'system':
+                has_system = True
+                content = msg.content
+                if isinstance(content, str) and content.strip():
+                    system_prompt_content = content.strip()
+                    processed_system_message_indices.add(i)
+                    logger.info(f"[{req_id}] (准备提示) 在索引 {i} 找到并使用系统提示: '{system_prompt_content[:80]}...'")
+                    system_instr_prefix = "系统指令:\n"
+                    combined_parts.append(f"{system_instr_prefix}{system_prompt_content}")
+                else:
+                    logger.info(f"[{req_id}] (准备提示) 在索引 {i} 忽略非字符串或空的系统消息。")
+                    processed_system_message_indices.add(i)
+                break
     
     # 处理其他消息
-    for i, msg in enumerate(messages):
+    for i in range(start_index, len(messages)):
+        msg = messages[i]
         if i in processed_system_message_indices:
             continue
         
@@ -235,67 +507,15 @@ def prepare_combined_prompt(messages: List[Message], req_id: str) -> str:
         if combined_parts:
             combined_parts.append(turn_separator)
         
-        role = msg.role or 'unknown'
-        role_prefix_ui = f"{role_map_ui.get(role, role.capitalize())}:\n"
-        current_turn_parts = [role_prefix_ui]
-        
-        content = msg.content or ''
-        content_str = ""
-        
-        if isinstance(content, str):
-            content_str = content.strip()
-        elif isinstance(content, list):
-            # 处理多模态内容
-            text_parts = []
-            for item in content:
-                if hasattr(item, 'type') and item.type == 'text':
-                    text_parts.append(item.text or '')
-                elif isinstance(item, dict) and item.get('type') == 'text':
-                    text_parts.append(item.get('text', ''))
-                else:
-                    logger.warning(f"[{req_id}] (准备提示) 警告: 在索引 {i} 的消息中忽略非文本或未知类型的 content item")
-            content_str = "\n".join(text_parts).strip()
-        else:
-            logger.warning(f"[{req_id}] (准备提示) 警告: 角色 {role} 在索引 {i} 的内容类型意外 ({type(content)}) 或为 None。")
-            content_str = str(content or "").strip()
-        
-        if content_str:
-            current_turn_parts.append(content_str)
-        
-        # 处理工具调用
-        tool_calls = msg.tool_calls
-        if role == 'assistant' and tool_calls:
-            if content_str:
-                current_turn_parts.append("\n")
-            
-            tool_call_visualizations = []
-            for tool_call in tool_calls:
-                if hasattr(tool_call, 'type') and tool_call.type == 'function':
-                    function_call = tool_call.function
-                    func_name = function_call.name if function_call else None
-                    func_args_str = function_call.arguments if function_call else None
-                    
-                    try:
-                        parsed_args = json.loads(func_args_str if func_args_str else '{}')
-                        formatted_args = json.dumps(parsed_args, indent=2, ensure_ascii=False)
-                    except (json.JSONDecodeError, TypeError):
-                        formatted_args = func_args_str if func_args_str is not None else "{}"
-                    
-                    tool_call_visualizations.append(
-                        f"请求调用函数: {func_name}\n参数:\n{formatted_args}"
-                    )
-            
-            if tool_call_visualizations:
-                current_turn_parts.append("\n".join(tool_call_visualizations))
-        
-        if len(current_turn_parts) > 1 or (role == 'assistant' and tool_calls):
-            combined_parts.append("".join(current_turn_parts))
-        elif not combined_parts and not current_turn_parts:
-            logger.info(f"[{req_id}] (准备提示) 跳过角色 {role} 在索引 {i} 的空消息 (且无工具调用)。")
-        elif len(current_turn_parts) == 1 and not combined_parts:
-            logger.info(f"[{req_id}] (准备提示) 跳过角色 {role} 在索引 {i} 的空消息 (只有前缀)。")
+        turn_text = _format_prompt_turn(msg, i, req_id, logger)
+        if turn_text is not None:
+            combined_parts.append(turn_text)
+    
+    combined_prompt = "".join(combined_parts)
+    if prefix_hashes:
+        _prompt_prefix_cache.put(prefix_hashes[-1], combined_prompt, has_system)
     
-    final_prompt = "".join(combined_parts)
+    final_prompt = combined_prompt
     if final_prompt:
         final_prompt += "\n"
     
@@ -305,6 +525,26 @@ def prepare_combined_prompt(messages: List[Message], req_id: str) -> str:
     return final_prompt 
 
 
+# 连续的中文字符（包括中文标点和全角字符），按整段匹配以减少替换次数
+_CHINESE_CHAR_PATTERN = re.compile('[\u4e00-\u9fff\u3000-\u303f\uff00-\uffef]+')
+
+
+def count_chinese_chars(text: str) -> int:
+    """统计中文字符数量（正则在C层完成扫描，纯ASCII文本直接返回0）"""
+    if not text or text.isascii():
+        return 0
+    return len(text) - len(_CHINESE_CHAR_PATTERN.sub('', text))
+
+
+def _tokens_from_counts(chinese_chars: int, total_chars: int) -> int:
+    """根据字符计数估算token数量"""
+    if total_chars <= 0:
+        return 0
+    chinese_tokens = chinese_chars / 1.5  # 中文大约1.5字符/token
+    english_tokens = (total_chars - chinese_chars) / 4.0  # 英文大约4字符/token
+    return max(1, int(chinese_tokens + english_tokens))
+
+
 def estimate_tokens(text: str) -> int:
     """
     估算文本的token数量
@@ -315,21 +555,207 @@ def estimate_tokens(text: str) -> int:
     """
     if not text:
         return 0
-    
-    # 统计中文字符数量（包括中文标点）
-    chinese_chars = sum(1 for char in text if '\u4e00' <= char <= '\u9fff' or '\u3000' <= char <= '\u303f' or '\uff00' <= char <= '\uffef')
-    
-    # 统计非中文字符数量
-    non_chinese_chars = len(text) - chinese_chars
-    
-    # 计算token估算
-    chinese_tokens = chinese_chars / 1.5  # 中文大约1.5字符/token
-    english_tokens = non_chinese_chars / 4.0  # 英文大约4字符/token
-    
-    return max(1, int(chinese_tokens + english_tokens))
+    return _tokens_from_counts(count_chinese_chars(text), len(text))
+
+
+# --- 分词器接口 ---
+class Tokenizer(abc.ABC):
+    """
+    token计数器接口
+    实现 count() 即可通过 set_tokenizer() 接入，用于替代字符估算
+    """
+    name = "base"
+
+    @abc.abstractmethod
+    def count(self, text: str) -> int:
+        """返回文本的token数"""
+
+
+class SentencePieceTokenizer(Tokenizer):
+    """基于本地 SentencePiece 模型文件（.model）的分词器，需要安装 sentencepiece"""
+
+    def __init__(self, model_path: str):
+        import sentencepiece as spm
+        self._processor = spm.SentencePieceProcessor(model_file=model_path)
+        self.name = f"sentencepiece:{os.path.basename(model_path)}"
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        return len(self._processor.encode(text))
+
+
+class BPETokenizer(Tokenizer):
+    """基于本地 tokenizers 词表文件（tokenizer.json）的BPE分词器，需要安装 tokenizers"""
+
+    def __init__(self, vocab_path: str):
+        from tokenizers import Tokenizer as _HFTokenizer
+        self._tokenizer = _HFTokenizer.from_file(vocab_path)
+        self.name = f"bpe:{os.path.basename(vocab_path)}"
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        return len(self._tokenizer.encode(text, add_special_tokens=False).ids)
+
+
+def load_tokenizer(vocab_path: str) -> Optional[Tokenizer]:
+    """
+    根据词表文件扩展名加载分词器
+    文件不存在、格式不支持或缺少依赖时返回 None（调用方回退到字符估算）
+    """
+    if not vocab_path:
+        return None
+    if not os.path.isfile(vocab_path):
+        logger.warning(f"分词器词表文件不存在: {vocab_path}，使用字符估算token")
+        return None
+
+    extension = os.path.splitext(vocab_path)[1].lower()
+    try:
+        if extension == '.model':
+            tokenizer = SentencePieceTokenizer(vocab_path)
+        elif extension == '.json':
+            tokenizer = BPETokenizer(vocab_path)
+        else:
+            logger.warning(f"不支持的分词器词表格式: {vocab_path}（支持 .model / .json），使用字符估算token")
+            return None
+    except ImportError as e:
+        logger.warning(f"加载分词器 {vocab_path} 缺少依赖: {e}，使用字符估算token")
+        return None
+    except Exception as e:
+        logger.error(f"加载分词器 {vocab_path} 失败: {e}，使用字符估算token")
+        return None
+
+    logger.info(f"已加载分词器: {tokenizer.name}")
+    return tokenizer
+
+
+_tokenizer: Optional[Tokenizer] = None
+_tokenizer_loaded = False
+
+
+def get_tokenizer() -> Optional[Tokenizer]:
+    """获取当前分词器（首次调用时按 TOKENIZER_VOCAB_PATH 加载），未配置时返回 None"""
+    global _tokenizer, _tokenizer_loaded
+    if not _tokenizer_loaded:
+        _tokenizer = load_tokenizer(TOKENIZER_VOCAB_PATH)
+        _tokenizer_loaded = True
+    return _tokenizer
+
+
+def set_tokenizer(tokenizer: Optional[Tokenizer]) -> None:
+    """替换当前分词器（None 表示使用字符估算），同时清空token计数缓存"""
+    global _tokenizer, _tokenizer_loaded
+    _tokenizer = tokenizer
+    _tokenizer_loaded = True
+    _message_token_cache.clear()
+
+
+class _TokenCountCache:
+    """按内容哈希缓存token计数的LRU，多轮对话中重复的历史消息只分词一次"""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries: "OrderedDict[Tuple[str, bytes], int]" = OrderedDict()
+
+    def get_or_count(self, tokenizer: Tokenizer, text: str) -> int:
+        if self.max_size <= 0:
+            return tokenizer.count(text)
+        key = (tokenizer.name, hashlib.blake2b(text.encode('utf-8', 'surrogatepass'), digest_size=16).digest())
+        count = self._entries.get(key)
+        if count is not None:
+            self._entries.move_to_end(key)
+            return count
+        count = tokenizer.count(text)
+        self._entries[key] = count
+        if len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        return count
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+_message_token_cache = _TokenCountCache(TOKEN_COUNT_CACHE_SIZE)
+
+
+class IncrementalTokenEstimator:
+    """
+    增量token估算器
+    流式增量到达时累计中文/非中文字符数，结束时无需再遍历完整文本，
+    结果与对拼接后的完整文本调用 estimate_tokens 一致。
+    配置了分词器时对每个增量分别分词并累计，结束时不再对完整文本分词；
+    片段边界处的切分与完整文本可能略有差异，对用量统计可以接受。
+    """
+    __slots__ = ('chinese_chars', 'total_chars', '_tokenizer', '_tokenizer_tokens')
+
+    def __init__(self, tokenizer: Optional[Tokenizer] = None):
+        self.chinese_chars = 0
+        self.total_chars = 0
+        self._tokenizer = tokenizer if tokenizer is not None else get_tokenizer()
+        self._tokenizer_tokens = 0
+
+    def feed(self, delta: Optional[str]) -> None:
+        if delta:
+            self.total_chars += len(delta)
+            if self._tokenizer is not None:
+                self._tokenizer_tokens += self._tokenizer.count(delta)
+                return
+            self.chinese_chars += count_chinese_chars(delta)
+
+    @property
+    def tokens(self) -> int:
+        if self._tokenizer is not None:
+            return self._tokenizer_tokens
+        return _tokens_from_counts(self.chinese_chars, self.total_chars)
+
+
+def _message_token_text(message: Any) -> str:
+    if hasattr(message, 'model_dump'):
+        message = message.model_dump()
+    role = message.get("role", "")
+    content = message.get("content", "")
+    return f"{role}: {content}\n"
+
+
+def estimate_messages_tokens(messages: List[Any]) -> int:
+    """
+    估算消息列表的prompt token数量（逐条累计，不拼接整段prompt）
+    配置了分词器时按消息分词并通过内容哈希缓存每条消息的计数
+    """
+    tokenizer = get_tokenizer()
+    if tokenizer is not None:
+        return sum(_message_token_cache.get_or_count(tokenizer, _message_token_text(message)) for message in messages)
+
+    estimator = IncrementalTokenEstimator()
+    for message in messages:
+        estimator.feed(_message_token_text(message))
+    return estimator.tokens
+
+
+def estimate_prompt_tokens(request: Any) -> int:
+    """估算请求的prompt token数量，结果缓存在请求对象上，每个请求只计算一次"""
+    cached = getattr(request, '_prompt_tokens', None)
+    if cached is not None:
+        return cached
+    prompt_tokens = estimate_messages_tokens(request.messages)
+    try:
+        request._prompt_tokens = prompt_tokens
+    except (AttributeError, ValueError):
+        pass
+    return prompt_tokens
 
 
-def calculate_usage_stats(messages: List[dict], response_content: str, reasoning_content: str = None) -> dict:
+def calculate_usage_stats(
+    messages: List[Any],
+    response_content: str,
+    reasoning_content: str = None,
+    prompt_tokens: Optional[int] = None,
+    completion_tokens: Optional[int] = None
+) -> dict:
     """
     计算token使用统计
     
@@ -337,25 +763,22 @@ def calculate_usage_stats(messages: List[dict], response_content: str, reasoning
         messages: 请求中的消息列表
         response_content: 响应内容
         reasoning_content: 推理内容（可选）
+        prompt_tokens: 已知的prompt token数（可选，提供时不再遍历messages）
+        completion_tokens: 已知的completion token数（可选，如增量估算结果）
     
     Returns:
         包含token使用统计的字典
     """
     # 计算输入token（prompt tokens）
-    prompt_text = ""
-    for message in messages:
-        role = message.get("role", "")
-        content = message.get("content", "")
-        prompt_text += f"{role}: {content}\n"
-    
-    prompt_tokens = estimate_tokens(prompt_text)
+    if prompt_tokens is None:
+        prompt_tokens = estimate_messages_tokens(messages)
     
     # 计算输出token（completion tokens）
-    completion_text = response_content or ""
-    if reasoning_content:
-        completion_text += reasoning_content
-    
-    completion_tokens = estimate_tokens(completion_text)
+    if completion_tokens is None:
+        estimator = IncrementalTokenEstimator()
+        estimator.feed(response_content)
+        estimator.feed(reasoning_content)
+        completion_tokens = estimator.tokens
     
     # 总token数
     total_tokens = prompt_tokens + completion_tokens
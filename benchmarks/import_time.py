@@ -0,0 +1,72 @@
+"""
+启动导入耗时检查
+在子进程中以 python -X importtime 导入 server 模块，汇总总耗时和最慢的顶层依赖，
+超过预算时以非零状态退出，便于在修改导入结构后确认冷启动没有退化。
+
+用法:
+    python benchmarks/import_time.py
+    python benchmarks/import_time.py --budget-ms 500 --repeat 5 --top 15
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+
+def run_importtime(module: str):
+    """返回 (模块总耗时 us, {顶层包: 自身耗时合计 us})"""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=ROOT_DIR, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"导入 {module} 失败:\n{result.stderr[-2000:]}")
+
+    total_us = 0
+    self_by_package = defaultdict(int)
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        name = name.strip()
+        self_by_package[name.split('.')[0]] += int(self_us)
+        if name == module:
+            total_us = int(cumulative_us)
+    return total_us, self_by_package
+
+
+def main():
+    parser = argparse.ArgumentParser(description='server 模块导入耗时检查')
+    parser.add_argument('--module', default='server', help='要导入的模块')
+    parser.add_argument('--budget-ms', type=float, default=500, help='导入耗时预算（毫秒，取中位数比较）')
+    parser.add_argument('--repeat', type=int, default=5, help='重复次数')
+    parser.add_argument('--top', type=int, default=10, help='列出自身耗时最多的顶层包数量')
+    args = parser.parse_args()
+
+    totals = []
+    packages = defaultdict(list)
+    for _ in range(args.repeat):
+        total_us, self_by_package = run_importtime(args.module)
+        totals.append(total_us / 1000)
+        for package, self_us in self_by_package.items():
+            packages[package].append(self_us / 1000)
+
+    median_ms = statistics.median(totals)
+    print(f"import {args.module}: 中位数 {median_ms:.1f} ms (最小 {min(totals):.1f} / 最大 {max(totals):.1f}, 预算 {args.budget_ms:.0f} ms)")
+    print(f"{'package':<28} {'self ms':>8}")
+    ranked = sorted(packages.items(), key=lambda item: statistics.median(item[1]), reverse=True)
+    for package, samples in ranked[:args.top]:
+        print(f"{package:<28} {statistics.median(samples):>8.1f}")
+
+    if median_ms > args.budget_ms:
+        print("超出导入耗时预算。")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
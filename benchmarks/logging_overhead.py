@@ -0,0 +1,98 @@
+"""
+日志调用开销对比
+分别测量处理器直接挂在 logger 上（同步写文件和控制台）与经由 logging_utils 的有界队列、
+在后台线程中写出时，调用方线程上每条 INFO 日志的平均耗时，即请求处理路径在事件循环上付出的成本。
+
+用法:
+    python benchmarks/logging_overhead.py
+    python benchmarks/logging_overhead.py --records 50000 --repeat 5
+"""
+
+import argparse
+import io
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT_DIR)
+
+from logging_utils.setup import build_queue_logging  # noqa: E402
+
+
+def make_handlers(log_path: str):
+    file_handler = logging.FileHandler(log_path, mode='w', encoding='utf-8')
+    file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s [%(name)s:%(funcName)s:%(lineno)d] - %(message)s'))
+    console_handler = logging.StreamHandler(io.StringIO())
+    console_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s [SERVER] - %(message)s'))
+    return [file_handler, console_handler]
+
+
+def emit_records(logger: logging.Logger, count: int) -> float:
+    """返回调用方每条日志的平均耗时（微秒）"""
+    started = time.perf_counter()
+    for i in range(count):
+        logger.info(f"[req{i:06d}] 请求处理完成，响应长度 {i * 7} 字符")
+    return (time.perf_counter() - started) / count * 1e6
+
+
+def run_direct(log_path: str, count: int) -> float:
+    logger = logging.getLogger('bench.direct')
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    handlers = make_handlers(log_path)
+    for handler in handlers:
+        logger.addHandler(handler)
+    try:
+        return emit_records(logger, count)
+    finally:
+        for handler in handlers:
+            logger.removeHandler(handler)
+            handler.close()
+
+
+def run_queued(log_path: str, count: int, max_size: int):
+    logger = logging.getLogger('bench.queued')
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    queue_handler, listener = build_queue_logging(make_handlers(log_path), max_size=max_size)
+    logger.addHandler(queue_handler)
+    listener.start()
+    try:
+        per_record_us = emit_records(logger, count)
+    finally:
+        logger.removeHandler(queue_handler)
+        listener.stop()
+        for handler in listener.handlers:
+            handler.close()
+    return per_record_us, sum(queue_handler.dropped.values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description='日志调用开销对比')
+    parser.add_argument('--records', type=int, default=20000, help='每轮写入的日志条数')
+    parser.add_argument('--repeat', type=int, default=5, help='重复次数')
+    parser.add_argument('--queue-size', type=int, default=10000, help='队列容量（同 LOG_QUEUE_MAX_SIZE）')
+    args = parser.parse_args()
+
+    direct, queued, dropped = [], [], []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        log_path = os.path.join(tmp_dir, 'bench.log')
+        for _ in range(args.repeat):
+            direct.append(run_direct(log_path, args.records))
+            per_record_us, dropped_count = run_queued(log_path, args.records, args.queue_size)
+            queued.append(per_record_us)
+            dropped.append(dropped_count)
+
+    direct_us, queued_us = statistics.median(direct), statistics.median(queued)
+    print(f"{'mode':<10} {'us/record':>10}")
+    print(f"{'direct':<10} {direct_us:>10.2f}")
+    print(f"{'queued':<10} {queued_us:>10.2f}")
+    print(f"调用方耗时降低 {(1 - queued_us / direct_us) * 100:.0f}%，队列丢弃 {statistics.median(dropped):.0f} 条/轮")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""
+提示填充基准测试
+对比 PageController.submit_prompt 的几种填充方式在不同提示长度下的耗时，
+用于确定 LARGE_PROMPT_THRESHOLD_CHARS / LARGE_PROMPT_CHUNK_CHARS 的取值。
+
+页面为本地模拟的 AI Studio 输入框结构（ms-autosize-textarea 通过 data-value 撑开高度），
+不访问 AI Studio。默认启动 Playwright 自带的 Firefox，也可以用 --ws 连接已启动的 Camoufox。
+
+用法:
+    python benchmarks/prompt_fill.py
+    python benchmarks/prompt_fill.py --ws ws://127.0.0.1:9222/xxxx --sizes 65536,1048576
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from playwright.async_api import async_playwright
+
+from browser_utils.page_controller import _FILL_PROMPT_JS, PROMPT_AUTOSIZE_WRAPPER_SELECTOR
+
+PAGE_HTML = '''
+<style>
+  ms-autosize-textarea { display: grid; }
+  ms-autosize-textarea::after { content: attr(data-value) " "; white-space: pre-wrap; visibility: hidden; grid-area: 1 / 1 / 2 / 2; }
+  ms-autosize-textarea > textarea { grid-area: 1 / 1 / 2 / 2; overflow: hidden; resize: none; }
+</style>
+<ms-prompt-input-wrapper>
+  <ms-autosize-textarea data-value=""><textarea id="prompt"></textarea></ms-autosize-textarea>
+</ms-prompt-input-wrapper>
+'''
+
+LEGACY_FILL_JS = '''
+(element, text) => {
+    element.value = text;
+    element.dispatchEvent(new Event('input', { bubbles: true, cancelable: true }));
+    element.dispatchEvent(new Event('change', { bubbles: true, cancelable: true }));
+}
+'''
+
+
+async def fill_legacy(page, textarea, prompt, chunk_size):
+    """旧实现：输入框和 autosize 包装器各传输一次完整提示"""
+    await textarea.evaluate(LEGACY_FILL_JS, prompt)
+    await page.locator(PROMPT_AUTOSIZE_WRAPPER_SELECTOR).evaluate(
+        '(element, text) => { element.setAttribute("data-value", text); }', prompt)
+
+
+async def fill_single(page, textarea, prompt, chunk_size):
+    """单次传输：一次 evaluate 同时设置两个目标"""
+    await textarea.evaluate(_FILL_PROMPT_JS, [prompt, None, PROMPT_AUTOSIZE_WRAPPER_SELECTOR])
+
+
+async def fill_chunked(page, textarea, prompt, chunk_size):
+    """大提示模式：分块写入页面缓冲区后一次性填充"""
+    key = 'bench'
+    await page.evaluate("(key) => { window.__aiStudioProxyPromptBuffers = window.__aiStudioProxyPromptBuffers || {}; window.__aiStudioProxyPromptBuffers[key] = []; }", key)
+    for start in range(0, len(prompt), chunk_size):
+        await page.evaluate("([key, chunk]) => { window.__aiStudioProxyPromptBuffers[key].push(chunk); }",
+                            [key, prompt[start:start + chunk_size]])
+    await textarea.evaluate(_FILL_PROMPT_JS, ['', key, PROMPT_AUTOSIZE_WRAPPER_SELECTOR])
+
+
+async def measure(page, fill, prompt, chunk_size, repeat):
+    textarea = page.locator('#prompt')
+    samples = []
+    for _ in range(repeat):
+        await textarea.evaluate("(element) => { element.value = ''; }")
+        start = time.perf_counter()
+        await fill(page, textarea, prompt, chunk_size)
+        # 等待一帧，计入 autosize 的布局开销
+        await page.evaluate("() => new Promise(resolve => requestAnimationFrame(() => resolve()))")
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description='提示填充方式基准测试')
+    parser.add_argument('--ws', default=None, help='已启动浏览器的 WebSocket 端点（如 Camoufox），不指定则启动 Firefox')
+    parser.add_argument('--sizes', default='16384,65536,262144,1048576,4194304', help='提示长度列表（字符），逗号分隔')
+    parser.add_argument('--chunk', type=int, default=131072, help='分块大小（字符）')
+    parser.add_argument('--repeat', type=int, default=5, help='每项重复次数，取中位数')
+    args = parser.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(',') if s.strip()]
+    async with async_playwright() as p:
+        browser = await (p.firefox.connect(args.ws) if args.ws else p.firefox.launch())
+        page = await browser.new_page()
+        await page.set_content(PAGE_HTML)
+
+        print(f"{'chars':>10} {'legacy ms':>10} {'single ms':>10} {'chunked ms':>11}")
+        for size in sizes:
+            prompt = ('用户输入 lorem ipsum dolor sit amet\n' * (size // 30 + 1))[:size]
+            results = [await measure(page, fill, prompt, args.chunk, args.repeat)
+                       for fill in (fill_legacy, fill_single, fill_chunked)]
+            print(f"{size:>10} {results[0]:>10.1f} {results[1]:>10.1f} {results[2]:>11.1f}")
+
+        await browser.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
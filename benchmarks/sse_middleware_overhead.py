@@ -0,0 +1,130 @@
+"""
+认证中间件的 SSE 逐块开销对比
+在同一个返回 StreamingResponse 的应用外分别套上旧的 BaseHTTPMiddleware 实现和现在的纯 ASGI 实现
+（api_utils.app.APIKeyAuthMiddleware），直接以 ASGI 调用驱动并读完整个响应体，
+比较每个 SSE 块的平均耗时。不经过网络，结果只反映中间件本身的转发开销。
+
+用法:
+    python benchmarks/sse_middleware_overhead.py
+    python benchmarks/sse_middleware_overhead.py --chunks 20000 --repeat 7
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT_DIR)
+
+from starlette.applications import Starlette  # noqa: E402
+from starlette.middleware.base import BaseHTTPMiddleware  # noqa: E402
+from starlette.responses import JSONResponse, StreamingResponse  # noqa: E402
+from starlette.routing import Route  # noqa: E402
+
+from api_utils import auth_utils  # noqa: E402
+from api_utils.app import APIKeyAuthMiddleware  # noqa: E402
+
+API_KEY = 'bench-key-0001'
+SSE_CHUNK = b'data: {"choices":[{"delta":{"content":"token "}}]}\n\n'
+
+
+class LegacyAPIKeyAuthMiddleware(BaseHTTPMiddleware):
+    """改为纯 ASGI 之前的实现（只保留认证判断）"""
+
+    async def dispatch(self, request, call_next):
+        auth_header = request.headers.get("Authorization")
+        api_key = auth_header[7:] if auth_header and auth_header.startswith("Bearer ") else request.headers.get("X-API-Key")
+        if not api_key or not auth_utils.verify_api_key(api_key):
+            return JSONResponse(status_code=401, content={"error": "invalid_api_key"})
+        return await call_next(request)
+
+
+def build_app(chunks: int, middleware_cls=None):
+    async def stream_endpoint(request):
+        async def body():
+            for _ in range(chunks):
+                yield SSE_CHUNK
+        return StreamingResponse(body(), media_type="text/event-stream")
+
+    app = Starlette(routes=[Route("/v1/chat/completions", stream_endpoint, methods=["POST"])])
+    if middleware_cls is not None:
+        app.add_middleware(middleware_cls)
+    return app
+
+
+async def drive(app) -> int:
+    """以 ASGI 调用驱动一次请求，返回收到的响应体块数"""
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+        "scheme": "http", "path": "/v1/chat/completions", "raw_path": b"/v1/chat/completions",
+        "root_path": "", "query_string": b"", "server": ("127.0.0.1", 2048), "client": ("127.0.0.1", 50000),
+        "headers": [(b"authorization", f"Bearer {API_KEY}".encode()), (b"content-type", b"application/json")],
+    }
+    request_sent = False
+    body_chunks = 0
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": b"{}", "more_body": False}
+        await asyncio.Event().wait()
+
+    async def send(message):
+        nonlocal body_chunks
+        if message["type"] == "http.response.start" and message["status"] != 200:
+            raise RuntimeError(f"unexpected status {message['status']}")
+        if message["type"] == "http.response.body" and message.get("body"):
+            body_chunks += 1
+
+    await app(scope, receive, send)
+    return body_chunks
+
+
+async def measure(app, chunks: int, repeat: int) -> float:
+    """返回每个 SSE 块的平均耗时（微秒，取中位数）"""
+    await drive(app)  # 预热
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        received = await drive(app)
+        samples.append((time.perf_counter() - started) / received * 1e6)
+    return statistics.median(samples)
+
+
+async def run(chunks: int, repeat: int):
+    results = {}
+    for label, middleware_cls in (
+        ("none", None),
+        ("BaseHTTPMiddleware", LegacyAPIKeyAuthMiddleware),
+        ("pure ASGI", APIKeyAuthMiddleware),
+    ):
+        results[label] = await measure(build_app(chunks, middleware_cls), chunks, repeat)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='认证中间件的 SSE 逐块开销对比')
+    parser.add_argument('--chunks', type=int, default=10000, help='每个响应的 SSE 块数')
+    parser.add_argument('--repeat', type=int, default=5, help='重复次数')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        auth_utils.KEY_FILE_PATH = os.path.join(tmp_dir, 'key.txt')
+        with open(auth_utils.KEY_FILE_PATH, 'w', encoding='utf-8') as f:
+            f.write(API_KEY + '\n')
+        auth_utils.initialize_keys()
+        results = asyncio.run(run(args.chunks, args.repeat))
+
+    baseline = results["none"]
+    print(f"{'middleware':<20} {'us/chunk':>9} {'overhead':>9}")
+    for label, per_chunk_us in results.items():
+        print(f"{label:<20} {per_chunk_us:>9.2f} {per_chunk_us - baseline:>9.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""
+流式代理到服务器的消息序列化开销对比
+在子进程中按流式代理的方式向 multiprocessing.Queue 写入增量消息，主进程按 use_stream_response 的方式读出并还原为字典，
+分别测量旧的 JSON 字符串（json.dumps → 队列 pickle → json.loads）与 stream.framing 帧格式的
+吞吐（消息/秒）以及两侧每条消息的 CPU 时间（生产方包含队列后台线程的 pickle 开销）。
+
+用法:
+    python benchmarks/stream_framing.py
+    python benchmarks/stream_framing.py --messages 50000 --delta-chars 400 --repeat 5
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import statistics
+import sys
+import time
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT_DIR)
+
+from stream.framing import decode_message, encode_message  # noqa: E402
+
+DELTA_TEXT = "The quick brown fox 跳过了懒狗, "
+
+
+def build_messages(count: int, delta_chars: int):
+    """与 ResponseStreamParser 的输出相同形状的增量消息，最后一条带完成标志和汇总"""
+    text = (DELTA_TEXT * (delta_chars // len(DELTA_TEXT) + 1))[:delta_chars]
+    messages = []
+    for i in range(count):
+        if i % 5 == 0:
+            messages.append({"reason": text, "body": "", "function": [], "done": False})
+        else:
+            messages.append({"reason": "", "body": text, "function": [], "done": False})
+    messages.append({
+        "reason": "", "body": "", "function": [{"name": "get_weather", "params": {"city": "Paris"}}], "done": True,
+        "summary": {"reason_length": 0, "body_length": 0, "function_count": 1},
+    })
+    return messages
+
+
+def encode_json(message):
+    return json.dumps(message)
+
+
+def decode_json(data):
+    return json.loads(data)
+
+
+CODECS = {
+    "json": (encode_json, decode_json),
+    "framed": (encode_message, decode_message),
+}
+
+
+def produce(codec: str, count: int, delta_chars: int, queue, result_queue):
+    encode = CODECS[codec][0]
+    messages = build_messages(count, delta_chars)
+    started = time.process_time()
+    for message in messages:
+        queue.put(encode(message))
+    queue.put(None)
+    # 等待后台线程把所有消息写入管道，使 pickle 开销计入本进程的 CPU 时间
+    queue.close()
+    queue.join_thread()
+    result_queue.put(time.process_time() - started)
+
+
+def run_once(codec: str, count: int, delta_chars: int):
+    """返回 (消息/秒, 生产方每条 CPU 微秒, 消费方每条 CPU 微秒)"""
+    decode = CODECS[codec][1]
+    queue = multiprocessing.Queue()
+    result_queue = multiprocessing.Queue()
+    producer = multiprocessing.Process(target=produce, args=(codec, count, delta_chars, queue, result_queue))
+
+    received = 0
+    producer.start()
+    first = queue.get()  # 不计入进程启动时间
+    wall_started, cpu_started = time.perf_counter(), time.process_time()
+    data = first
+    while data is not None:
+        message = decode(data)
+        if not isinstance(message, dict):
+            raise RuntimeError(f"unexpected message: {message!r}")
+        received += 1
+        data = queue.get()
+    wall, consumer_cpu = time.perf_counter() - wall_started, time.process_time() - cpu_started
+    producer_cpu = result_queue.get()
+    producer.join()
+
+    if received != count + 1:
+        raise RuntimeError(f"expected {count + 1} messages, got {received}")
+    return received / wall, producer_cpu / received * 1e6, consumer_cpu / received * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description='流式代理到服务器的消息序列化开销对比')
+    parser.add_argument('--messages', type=int, default=20000, help='每轮的增量消息数')
+    parser.add_argument('--delta-chars', type=int, default=120, help='每条增量的字符数')
+    parser.add_argument('--repeat', type=int, default=5, help='重复次数')
+    args = parser.parse_args()
+
+    print(f"{'codec':<8} {'msg/s':>10} {'producer us/msg':>16} {'consumer us/msg':>16}")
+    for codec in CODECS:
+        samples = [run_once(codec, args.messages, args.delta_chars) for _ in range(args.repeat)]
+        rate, producer_us, consumer_us = (statistics.median(column) for column in zip(*samples))
+        print(f"{codec:<8} {rate:>10.0f} {producer_us:>16.2f} {consumer_us:>16.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -11,6 +11,12 @@ from .operations import (
     _get_final_response_content,
     get_raw_text_content
 )
+from .error_snapshots import drain_error_snapshots, get_error_snapshot_stats
+from .model_list_cache import (
+    restore_model_list_from_cache,
+    request_model_list_refresh,
+    model_list_refresh_loop
+)
 from .model_management import (
     switch_ai_studio_model,
     load_excluded_models,
@@ -34,6 +40,15 @@ __all__ = [
     '_get_final_response_content',
     'get_raw_text_content',
     
+    # 错误快照相关
+    'drain_error_snapshots',
+    'get_error_snapshot_stats',
+    
+    # 模型列表缓存相关
+    'restore_model_list_from_cache',
+    'request_model_list_refresh',
+    'model_list_refresh_loop',
+    
     # 模型管理相关
     'switch_ai_studio_model',
     'load_excluded_models',
@@ -0,0 +1,182 @@
+"""
+错误快照模块
+save_error_snapshot 做去重和限速判断，并立即获取页面 HTML，使其反映出错时的页面状态；
+截图、压缩和写盘在后台任务中进行，不会阻塞正在处理的请求或持有 processing_lock 的 Worker。
+- 同一类错误 (去掉 req_id 后的名称) 在 ERROR_SNAPSHOT_DEDUP_SECONDS 内只保存一次
+- 每分钟最多保存 ERROR_SNAPSHOT_MAX_PER_MINUTE 个快照，同一时间只有一个快照在获取
+- errors_py/ 总大小超过 ERROR_SNAPSHOT_MAX_DIR_MB 时删除最旧的文件
+- ERROR_SNAPSHOT_COMPRESS_HTML 为 true 时 HTML 以 gzip 保存 (.html.gz)
+"""
+
+import asyncio
+import gzip
+import logging
+import os
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Set
+
+from config import (
+    ERROR_SNAPSHOT_DEDUP_SECONDS, ERROR_SNAPSHOT_MAX_PER_MINUTE,
+    ERROR_SNAPSHOT_MAX_DIR_MB, ERROR_SNAPSHOT_COMPRESS_HTML
+)
+
+logger = logging.getLogger("AIStudioProxyServer")
+
+ERROR_SNAPSHOT_DIR = os.path.join(os.path.dirname(__file__), '..', 'errors_py')
+_SCREENSHOT_TIMEOUT_MS = 15000
+
+_last_saved_by_error: Dict[str, float] = {}
+_recent_saves: Deque[float] = deque()
+_pending_tasks: Set[asyncio.Task] = set()
+_capture_lock: Optional[asyncio.Lock] = None
+_stats: Dict[str, int] = {"scheduled": 0, "saved": 0, "skipped_duplicate": 0, "skipped_rate_limited": 0}
+
+
+def _split_error_name(error_name: str):
+    """拆分出末尾的 7 位 req_id，返回 (错误类别, req_id)"""
+    name_parts = error_name.split('_')
+    req_id = name_parts[-1] if len(name_parts) > 1 and len(name_parts[-1]) == 7 else None
+    base_error_name = error_name if not req_id else '_'.join(name_parts[:-1])
+    return base_error_name, req_id
+
+
+def _admit(base_error_name: str, now: float) -> Optional[str]:
+    """通过去重和限速检查时登记本次快照并返回 None，否则返回跳过的原因"""
+    last_saved = _last_saved_by_error.get(base_error_name)
+    if last_saved is not None and now - last_saved < ERROR_SNAPSHOT_DEDUP_SECONDS:
+        _stats["skipped_duplicate"] += 1
+        return f"{ERROR_SNAPSHOT_DEDUP_SECONDS:g} 秒内已保存过同类快照"
+    while _recent_saves and now - _recent_saves[0] >= 60:
+        _recent_saves.popleft()
+    if ERROR_SNAPSHOT_MAX_PER_MINUTE > 0 and len(_recent_saves) >= ERROR_SNAPSHOT_MAX_PER_MINUTE:
+        _stats["skipped_rate_limited"] += 1
+        return f"超过每分钟 {ERROR_SNAPSHOT_MAX_PER_MINUTE} 个的限制"
+    _last_saved_by_error[base_error_name] = now
+    _recent_saves.append(now)
+    return None
+
+
+def _write_snapshot_files(filename_base: str, screenshot: Optional[bytes], content: Optional[str]) -> list:
+    os.makedirs(ERROR_SNAPSHOT_DIR, exist_ok=True)
+    written = []
+    if screenshot is not None:
+        screenshot_path = os.path.join(ERROR_SNAPSHOT_DIR, f"{filename_base}.png")
+        with open(screenshot_path, 'wb') as f:
+            f.write(screenshot)
+        written.append(screenshot_path)
+    if content is not None:
+        if ERROR_SNAPSHOT_COMPRESS_HTML:
+            html_path = os.path.join(ERROR_SNAPSHOT_DIR, f"{filename_base}.html.gz")
+            with gzip.open(html_path, 'wt', encoding='utf-8') as f:
+                f.write(content)
+        else:
+            html_path = os.path.join(ERROR_SNAPSHOT_DIR, f"{filename_base}.html")
+            with open(html_path, 'w', encoding='utf-8') as f:
+                f.write(content)
+        written.append(html_path)
+    _enforce_dir_quota()
+    return written
+
+
+def _enforce_dir_quota() -> None:
+    """errors_py/ 超过配额时从最旧的文件开始删除"""
+    if ERROR_SNAPSHOT_MAX_DIR_MB <= 0:
+        return
+    entries = []
+    with os.scandir(ERROR_SNAPSHOT_DIR) as it:
+        for entry in it:
+            if entry.is_file():
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in entries)
+    quota = ERROR_SNAPSHOT_MAX_DIR_MB * 1024 * 1024
+    removed = 0
+    for _, size, path in sorted(entries):
+        if total <= quota:
+            break
+        try:
+            os.remove(path)
+            total -= size
+            removed += 1
+        except OSError:
+            pass
+    if removed:
+        logger.info(f"错误快照目录超过 {ERROR_SNAPSHOT_MAX_DIR_MB:g} MB，已删除 {removed} 个最旧的文件。")
+
+
+async def _capture_snapshot(page, base_error_name: str, req_id: Optional[str], log_prefix: str, timestamp: int,
+                            content: Optional[str]) -> None:
+    global _capture_lock
+    if _capture_lock is None:
+        _capture_lock = asyncio.Lock()
+    screenshot = None
+    async with _capture_lock:
+        if page.is_closed():
+            logger.warning(f"{log_prefix} 页面已关闭，只保存页面内容 ({base_error_name})。")
+        else:
+            try:
+                screenshot = await page.screenshot(full_page=True, timeout=_SCREENSHOT_TIMEOUT_MS)
+            except Exception as ss_err:
+                logger.error(f"{log_prefix}   保存屏幕截图失败 ({base_error_name}): {ss_err}")
+
+    if screenshot is None and content is None:
+        return
+    filename_suffix = f"{req_id}_{timestamp}" if req_id else f"{timestamp}"
+    try:
+        written = await asyncio.to_thread(_write_snapshot_files, f"{base_error_name}_{filename_suffix}", screenshot, content)
+    except Exception as write_err:
+        logger.error(f"{log_prefix}   写入错误快照失败 ({base_error_name}): {write_err}")
+        return
+    _stats["saved"] += 1
+    for path in written:
+        logger.info(f"{log_prefix}   快照已保存到: {path}")
+
+
+async def save_error_snapshot(error_name: str = 'error'):
+    """登记一次错误快照，通过去重和限速检查后立即获取页面 HTML，截图和写盘在后台进行"""
+    import server
+    base_error_name, req_id = _split_error_name(error_name)
+    log_prefix = f"[{req_id}]" if req_id else "[无请求ID]"
+    page_to_snapshot = server.page_instance
+
+    if not server.browser_instance or not server.browser_instance.is_connected() or not page_to_snapshot or page_to_snapshot.is_closed():
+        logger.warning(f"{log_prefix} 无法保存快照 ({base_error_name})，浏览器/页面不可用。")
+        return
+
+    skip_reason = _admit(base_error_name, time.monotonic())
+    if skip_reason:
+        logger.info(f"{log_prefix} 跳过错误快照 ({base_error_name})：{skip_reason}。")
+        return
+
+    timestamp = int(time.time() * 1000)
+    # HTML 在返回前获取 (开销较小)，此时 Worker 尚未继续清空对话或处理下一个请求
+    content = None
+    try:
+        content = await page_to_snapshot.content()
+    except Exception as html_err:
+        logger.error(f"{log_prefix}   获取页面内容失败 ({base_error_name}): {html_err}")
+
+    logger.info(f"{log_prefix} 已安排在后台保存错误快照 ({base_error_name})...")
+    _stats["scheduled"] += 1
+    task = asyncio.create_task(
+        _capture_snapshot(page_to_snapshot, base_error_name, req_id, log_prefix, timestamp, content)
+    )
+    _pending_tasks.add(task)
+    task.add_done_callback(_pending_tasks.discard)
+
+
+async def drain_error_snapshots(timeout: float = 10.0) -> None:
+    """关闭页面前等待仍在进行的快照完成，超时后取消"""
+    if not _pending_tasks:
+        return
+    tasks = list(_pending_tasks)
+    _, pending = await asyncio.wait(tasks, timeout=timeout)
+    for task in pending:
+        task.cancel()
+    if pending:
+        await asyncio.gather(*pending, return_exceptions=True)
+
+
+def get_error_snapshot_stats() -> Dict[str, Any]:
+    return {**_stats, "pending": len(_pending_tasks)}
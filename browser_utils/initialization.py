@@ -16,17 +16,39 @@ from models import ClientDisconnectedError
 
 logger = logging.getLogger("AIStudioProxyServer")
 
+def _build_context_options(storage_state: Optional[Any] = None, log: bool = True) -> Dict[str, Any]:
+    """构造 AI Studio 浏览器上下文参数 (storage_state 可以是文件路径或 storage_state 字典)"""
+    # 代理设置需要从server模块中获取
+    import server
+    context_options: Dict[str, Any] = {'viewport': {'width': 460, 'height': 800}}
+    if storage_state:
+        context_options['storage_state'] = storage_state
+    
+    if server.PLAYWRIGHT_PROXY_SETTINGS:
+        context_options['proxy'] = server.PLAYWRIGHT_PROXY_SETTINGS
+        if log:
+            logger.info(f"   (浏览器上下文将使用代理: {server.PLAYWRIGHT_PROXY_SETTINGS['server']})")
+    elif log:
+        logger.info("   (浏览器上下文不使用显式代理配置)")
+    
+    context_options['ignore_https_errors'] = True
+    if log:
+        logger.info("   (浏览器上下文将忽略 HTTPS 错误)")
+    return context_options
+
+
 async def _initialize_page_logic(browser: AsyncBrowser):
     """初始化页面逻辑，连接到现有浏览器"""
     logger.info("--- 初始化页面逻辑 (连接到现有浏览器) ---")
     temp_context: Optional[AsyncBrowserContext] = None
     storage_state_path_to_use: Optional[str] = None
-    launch_mode = os.environ.get('LAUNCH_MODE', 'debug')
+    runtime_settings = get_runtime_settings()
+    launch_mode = runtime_settings.launch_mode or 'debug'
     logger.info(f"   检测到启动模式: {launch_mode}")
     loop = asyncio.get_running_loop()
     
     if launch_mode == 'headless' or launch_mode == 'virtual_headless':
-        auth_filename = os.environ.get('ACTIVE_AUTH_JSON_PATH')
+        auth_filename = runtime_settings.active_auth_json_path
         if auth_filename:
             constructed_path = auth_filename
             if os.path.exists(constructed_path):
@@ -40,7 +62,7 @@ async def _initialize_page_logic(browser: AsyncBrowser):
             raise RuntimeError(f"{launch_mode} 模式需要 ACTIVE_AUTH_JSON_PATH。")
     elif launch_mode == 'debug':
         logger.info(f"   调试模式: 尝试从环境变量 ACTIVE_AUTH_JSON_PATH 加载认证文件...")
-        auth_filepath_from_env = os.environ.get('ACTIVE_AUTH_JSON_PATH')
+        auth_filepath_from_env = runtime_settings.active_auth_json_path
         if auth_filepath_from_env and os.path.exists(auth_filepath_from_env):
             storage_state_path_to_use = auth_filepath_from_env
             logger.info(f"   调试模式将使用的认证文件 (来自环境变量): {storage_state_path_to_use}")
@@ -55,23 +77,11 @@ async def _initialize_page_logic(browser: AsyncBrowser):
     
     try:
         logger.info("创建新的浏览器上下文...")
-        context_options: Dict[str, Any] = {'viewport': {'width': 460, 'height': 800}}
         if storage_state_path_to_use:
-            context_options['storage_state'] = storage_state_path_to_use
             logger.info(f"   (使用 storage_state='{os.path.basename(storage_state_path_to_use)}')")
         else:
             logger.info("   (不使用 storage_state)")
-        
-        # 代理设置需要从server模块中获取
-        import server
-        if server.PLAYWRIGHT_PROXY_SETTINGS:
-            context_options['proxy'] = server.PLAYWRIGHT_PROXY_SETTINGS
-            logger.info(f"   (浏览器上下文将使用代理: {server.PLAYWRIGHT_PROXY_SETTINGS['server']})")
-        else:
-            logger.info("   (浏览器上下文不使用显式代理配置)")
-        
-        context_options['ignore_https_errors'] = True
-        logger.info("   (浏览器上下文将忽略 HTTPS 错误)")
+        context_options = _build_context_options(storage_state_path_to_use)
         
         temp_context = await browser.new_context(**context_options)
         found_page: Optional[AsyncPage] = None
@@ -226,7 +236,7 @@ async def _close_page_logic():
 async def signal_camoufox_shutdown():
     """发送关闭信号到Camoufox服务器"""
     logger.info("   尝试发送关闭信号到 Camoufox 服务器 (此功能可能已由父进程处理)...")
-    ws_endpoint = os.environ.get('CAMOUFOX_WS_ENDPOINT')
+    ws_endpoint = get_runtime_settings().camoufox_ws_endpoint
     if not ws_endpoint:
         logger.warning("   ⚠️ 无法发送关闭信号：未找到 CAMOUFOX_WS_ENDPOINT 环境变量。")
         return
@@ -0,0 +1,138 @@
+"""
+模型列表缓存模块
+将解析后的模型列表连同时间戳保存到磁盘，启动时直接加载，/v1/models 始终从缓存返回。
+后台任务按计划在同一浏览器中用服务页面当前的认证状态新建一个临时上下文，打开页面捕获
+ListModels 响应来刷新列表。临时上下文与服务页面不共享 Cookie、存储和 Service Worker，
+不会重新加载正在处理请求的页面，也不会影响其会话状态。
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import (
+    AI_STUDIO_URL_PATTERN, MODELS_ENDPOINT_URL_CONTAINS,
+    MODEL_LIST_CACHE_FILE, MODEL_LIST_REFRESH_INTERVAL_SECONDS
+)
+
+logger = logging.getLogger("AIStudioProxyServer")
+
+# 最近一次成功获取模型列表的时间（来自缓存文件或实时捕获）
+model_list_updated_at: float = 0.0
+_refresh_requested: Optional[asyncio.Event] = None
+
+
+def _write_cache_file(models: List[Dict[str, Any]], timestamp: float) -> None:
+    os.makedirs(os.path.dirname(os.path.abspath(MODEL_LIST_CACHE_FILE)), exist_ok=True)
+    tmp_path = f"{MODEL_LIST_CACHE_FILE}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({"timestamp": timestamp, "data": models}, f, ensure_ascii=False)
+    os.replace(tmp_path, MODEL_LIST_CACHE_FILE)
+
+
+def load_model_list_cache() -> Tuple[List[Dict[str, Any]], float]:
+    """读取磁盘上的模型列表缓存，返回 (模型列表, 时间戳)，不存在或损坏时返回 ([], 0)"""
+    if not MODEL_LIST_CACHE_FILE or not os.path.exists(MODEL_LIST_CACHE_FILE):
+        return [], 0.0
+    try:
+        with open(MODEL_LIST_CACHE_FILE, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        models = data.get("data")
+        if isinstance(models, list):
+            return models, float(data.get("timestamp", 0))
+    except (OSError, ValueError, AttributeError) as e:
+        logger.warning(f"读取模型列表缓存失败: {e}")
+    return [], 0.0
+
+
+async def save_model_list_cache(models: List[Dict[str, Any]]) -> None:
+    """保存最新解析的模型列表并记录时间戳"""
+    global model_list_updated_at
+    model_list_updated_at = time.time()
+    if not MODEL_LIST_CACHE_FILE:
+        return
+    try:
+        await asyncio.to_thread(_write_cache_file, list(models), model_list_updated_at)
+    except OSError as e:
+        logger.warning(f"写入模型列表缓存失败: {e}")
+
+
+def restore_model_list_from_cache() -> None:
+    """启动时用磁盘缓存填充 server.parsed_model_list（不设置 model_list_fetch_event，登录确认仍以实时响应为准）"""
+    import server
+    global model_list_updated_at
+
+    models, timestamp = load_model_list_cache()
+    if not models:
+        return
+    excluded_model_ids = getattr(server, 'excluded_model_ids', set())
+    server.parsed_model_list = [m for m in models if m.get("id") not in excluded_model_ids]
+    server.global_model_list_raw_json = json.dumps({"data": server.parsed_model_list, "object": "list"})
+    model_list_updated_at = timestamp
+    age_minutes = (time.time() - timestamp) / 60
+    logger.info(f"已从缓存加载 {len(server.parsed_model_list)} 个模型 (缓存时间: {age_minutes:.0f} 分钟前)。")
+
+
+def request_model_list_refresh() -> None:
+    """请求后台任务尽快刷新模型列表"""
+    if _refresh_requested is not None:
+        _refresh_requested.set()
+
+
+async def refresh_model_list_via_side_page() -> bool:
+    """在使用服务页面认证状态的独立临时上下文中打开页面，捕获 ListModels 响应后关闭"""
+    import server
+    from .initialization import _build_context_options
+    from .operations import _handle_model_list_response
+
+    page = getattr(server, 'page_instance', None)
+    browser = getattr(server, 'browser_instance', None)
+    if page is None or page.is_closed() or browser is None or not browser.is_connected():
+        return False
+
+    side_context = None
+    try:
+        storage_state = await page.context.storage_state()
+        side_context = await browser.new_context(**_build_context_options(storage_state, log=False))
+        side_page = await side_context.new_page()
+        target_url = f"https://{AI_STUDIO_URL_PATTERN}prompts/new_chat"
+        async with side_page.expect_response(
+            lambda response: MODELS_ENDPOINT_URL_CONTAINS in response.url and response.ok,
+            timeout=60000
+        ) as response_info:
+            await side_page.goto(target_url, wait_until="domcontentloaded", timeout=60000)
+        await _handle_model_list_response(await response_info.value)
+        logger.info("后台刷新模型列表完成。")
+        return True
+    except Exception as e:
+        logger.warning(f"后台刷新模型列表失败: {e}")
+        return False
+    finally:
+        if side_context is not None:
+            try:
+                await side_context.close()
+            except Exception:
+                pass
+
+
+async def model_list_refresh_loop() -> None:
+    """后台定时刷新模型列表：缓存超过刷新间隔或收到刷新请求时刷新"""
+    global _refresh_requested
+    _refresh_requested = asyncio.Event()
+    interval = MODEL_LIST_REFRESH_INTERVAL_SECONDS
+    logger.info(f"模型列表后台刷新任务已启动 (间隔: {interval} 秒)。")
+
+    while True:
+        wait_seconds = max(0.0, model_list_updated_at + interval - time.time())
+        try:
+            await asyncio.wait_for(_refresh_requested.wait(), timeout=wait_seconds if wait_seconds > 0 else 0.01)
+        except asyncio.TimeoutError:
+            pass
+        _refresh_requested.clear()
+
+        if not await refresh_model_list_via_side_page():
+            # 失败后稍后重试，避免频繁打开页面
+            await asyncio.sleep(min(interval, 300))
@@ -13,8 +13,12 @@ from playwright.async_api import Page as AsyncPage, Locator, Error as Playwright
 # 导入配置和模型
 from config import *
 from models import ClientDisconnectedError
+from logging_utils import get_module_logger, trace
+from .model_list_cache import save_model_list_cache
+from .error_snapshots import save_error_snapshot
 
-logger = logging.getLogger("AIStudioProxyServer")
+# 独立的子日志器，可通过 LOG_MODULE_LEVELS=browser_utils.operations=DEBUG 单独开启轮询追踪日志
+logger = get_module_logger("browser_utils.operations")
 
 async def get_raw_text_content(response_element: Locator, previous_text: str, req_id: str) -> str:
     """从响应元素获取原始文本内容"""
@@ -33,24 +37,19 @@ async def get_raw_text_content(response_element: Locator, previous_text: str, re
             try:
                 raw_text = await pre_element.inner_text(timeout=500)
             except PlaywrightAsyncError as pre_err:
-                if DEBUG_LOGS_ENABLED:
-                    logger.debug(f"[{req_id}] (获取原始文本) 获取 pre 元素内部文本失败: {pre_err}")
+                trace(logger, req_id, "raw_text", "(获取原始文本) 获取 pre 元素内部文本失败: %s", pre_err)
         else:
             try:
                 raw_text = await response_element.inner_text(timeout=500)
             except PlaywrightAsyncError as e_parent:
-                if DEBUG_LOGS_ENABLED:
-                    logger.debug(f"[{req_id}] (获取原始文本) 获取响应元素内部文本失败: {e_parent}")
+                trace(logger, req_id, "raw_text", "(获取原始文本) 获取响应元素内部文本失败: %s", e_parent)
     except PlaywrightAsyncError as e_parent:
-        if DEBUG_LOGS_ENABLED:
-            logger.debug(f"[{req_id}] (获取原始文本) 响应元素未准备好: {e_parent}")
+        trace(logger, req_id, "raw_text", "(获取原始文本) 响应元素未准备好: %s", e_parent)
     except Exception as e_unexpected:
         logger.warning(f"[{req_id}] (获取原始文本) 意外错误: {e_unexpected}")
     
     if raw_text != previous_text:
-        if DEBUG_LOGS_ENABLED:
-            preview = raw_text[:100].replace('\n', '\\n')
-            logger.debug(f"[{req_id}] (获取原始文本) 文本已更新，长度: {len(raw_text)}，预览: '{preview}...'")
+        trace(logger, req_id, "raw_text", "(获取原始文本) 文本已更新，长度: %d，预览: %r...", len(raw_text), raw_text[:100])
     return raw_text
 
 async def _handle_model_list_response(response: Any):
@@ -64,7 +63,7 @@ async def _handle_model_list_response(response: Any):
     
     if MODELS_ENDPOINT_URL_CONTAINS in response.url and response.ok:
         # 检查是否在登录流程中
-        launch_mode = os.environ.get('LAUNCH_MODE', 'debug')
+        launch_mode = get_runtime_settings().launch_mode or 'debug'
         is_in_login_flow = launch_mode in ['debug'] and not getattr(server, 'is_page_ready', False)
 
         if is_in_login_flow:
@@ -238,6 +237,7 @@ async def _handle_model_list_response(response: Any):
                 if new_parsed_list:
                     server.parsed_model_list = sorted(new_parsed_list, key=lambda m: m.get('display_name', '').lower())
                     server.global_model_list_raw_json = json.dumps({"data": server.parsed_model_list, "object": "list"})
+                    await save_model_list_cache(server.parsed_model_list)
                     if DEBUG_LOGS_ENABLED:
                         log_output = f"成功解析和更新模型列表。总共解析模型数: {len(server.parsed_model_list)}.\n"
                         for i, item in enumerate(server.parsed_model_list[:min(3, len(server.parsed_model_list))]):
@@ -281,57 +281,6 @@ async def detect_and_extract_page_error(page: AsyncPage, req_id: str) -> Optiona
         logger.warning(f"[{req_id}]    检查页面错误时出错: {e}")
         return None
 
-async def save_error_snapshot(error_name: str = 'error'):
-    """保存错误快照"""
-    import server
-    name_parts = error_name.split('_')
-    req_id = name_parts[-1] if len(name_parts) > 1 and len(name_parts[-1]) == 7 else None
-    base_error_name = error_name if not req_id else '_'.join(name_parts[:-1])
-    log_prefix = f"[{req_id}]" if req_id else "[无请求ID]"
-    page_to_snapshot = server.page_instance
-    
-    if not server.browser_instance or not server.browser_instance.is_connected() or not page_to_snapshot or page_to_snapshot.is_closed():
-        logger.warning(f"{log_prefix} 无法保存快照 ({base_error_name})，浏览器/页面不可用。")
-        return
-    
-    logger.info(f"{log_prefix} 尝试保存错误快照 ({base_error_name})...")
-    timestamp = int(time.time() * 1000)
-    error_dir = os.path.join(os.path.dirname(__file__), '..', 'errors_py')
-    
-    try:
-        os.makedirs(error_dir, exist_ok=True)
-        filename_suffix = f"{req_id}_{timestamp}" if req_id else f"{timestamp}"
-        filename_base = f"{base_error_name}_{filename_suffix}"
-        screenshot_path = os.path.join(error_dir, f"{filename_base}.png")
-        html_path = os.path.join(error_dir, f"{filename_base}.html")
-        
-        try:
-            await page_to_snapshot.screenshot(path=screenshot_path, full_page=True, timeout=15000)
-            logger.info(f"{log_prefix}   快照已保存到: {screenshot_path}")
-        except Exception as ss_err:
-            logger.error(f"{log_prefix}   保存屏幕截图失败 ({base_error_name}): {ss_err}")
-        
-        try:
-            content = await page_to_snapshot.content()
-            f = None
-            try:
-                f = open(html_path, 'w', encoding='utf-8')
-                f.write(content)
-                logger.info(f"{log_prefix}   HTML 已保存到: {html_path}")
-            except Exception as write_err:
-                logger.error(f"{log_prefix}   保存 HTML 失败 ({base_error_name}): {write_err}")
-            finally:
-                if f:
-                    try:
-                        f.close()
-                        logger.debug(f"{log_prefix}   HTML 文件已正确关闭")
-                    except Exception as close_err:
-                        logger.error(f"{log_prefix}   关闭 HTML 文件时出错: {close_err}")
-        except Exception as html_err:
-            logger.error(f"{log_prefix}   获取页面内容失败 ({base_error_name}): {html_err}")
-    except Exception as dir_err:
-        logger.error(f"{log_prefix}   创建错误目录或保存快照时发生其他错误 ({base_error_name}): {dir_err}")
-
 async def get_response_via_edit_button(
     page: AsyncPage,
     req_id: str,
@@ -581,8 +530,8 @@ async def _wait_for_response_completion(
 
         if is_input_empty and is_submit_disabled:
             consecutive_empty_input_submit_disabled_count += 1
-            if DEBUG_LOGS_ENABLED:
-                logger.debug(f"[{req_id}] (WaitV3) 主要条件满足: 输入框空，提交按钮禁用 (计数: {consecutive_empty_input_submit_disabled_count})。")
+            trace(logger, req_id, "wait_completion", "(WaitV3) 主要条件满足: 输入框空，提交按钮禁用 (计数: %d)。",
+                  consecutive_empty_input_submit_disabled_count, elapsed_ms=current_time_elapsed_ms)
 
             # --- 最终确认: 编辑按钮可见 ---
             try:
@@ -590,8 +539,8 @@ async def _wait_for_response_completion(
                     logger.info(f"[{req_id}] (WaitV3) ✅ 响应完成: 输入框空，提交按钮禁用，编辑按钮可见。")
                     return True # 明确完成
             except TimeoutError:
-                if DEBUG_LOGS_ENABLED:
-                    logger.debug(f"[{req_id}] (WaitV3) 主要条件满足后，检查编辑按钮可见性超时。")
+                trace(logger, req_id, "wait_completion", "(WaitV3) 主要条件满足后，检查编辑按钮可见性超时。",
+                      elapsed_ms=current_time_elapsed_ms)
             
             try:
                 check_client_disconnected_func("等待响应完成 - 编辑按钮检查后")
@@ -604,13 +553,9 @@ async def _wait_for_response_completion(
                 return True # 启发式完成
         else: # 主要条件 (输入框空 & 提交按钮禁用) 未满足
             consecutive_empty_input_submit_disabled_count = 0 # 重置计数器
-            if DEBUG_LOGS_ENABLED:
-                reasons = []
-                if not is_input_empty: 
-                    reasons.append("输入框非空")
-                if not is_submit_disabled: 
-                    reasons.append("提交按钮非禁用")
-                logger.debug(f"[{req_id}] (WaitV3) 主要条件未满足 ({', '.join(reasons)}). 继续轮询...")
+            trace(logger, req_id, "wait_completion", "(WaitV3) 主要条件未满足 (输入框%s，提交按钮%s). 继续轮询...",
+                  "空" if is_input_empty else "非空", "禁用" if is_submit_disabled else "非禁用",
+                  elapsed_ms=current_time_elapsed_ms)
 
         await asyncio.sleep(0.5) # 轮询间隔
 
@@ -18,9 +18,34 @@ from config import (
     CLICK_TIMEOUT_MS, WAIT_FOR_ELEMENT_TIMEOUT_MS, CLEAR_CHAT_VERIFY_TIMEOUT_MS,
     DEFAULT_TEMPERATURE, DEFAULT_MAX_OUTPUT_TOKENS, DEFAULT_STOP_SEQUENCES, DEFAULT_TOP_P
 )
+from config import LARGE_PROMPT_THRESHOLD_CHARS, LARGE_PROMPT_CHUNK_CHARS, get_runtime_settings
 from models import ClientDisconnectedError
 from .operations import save_error_snapshot, _wait_for_response_completion, _get_final_response_content
 
+PROMPT_AUTOSIZE_WRAPPER_SELECTOR = 'ms-prompt-input-wrapper ms-autosize-textarea'
+
+# 填充输入框并同步 autosize 包装器的 data-value。两者使用页面内同一份文本，
+# 在同一个任务中完成赋值和事件派发，autosize 只会在下一帧测量一次。
+# bufferKey 不为 null 时从分块上传的页面缓冲区取文本（大提示模式）。
+_FILL_PROMPT_JS = '''
+(element, [text, bufferKey, wrapperSelector]) => {
+    let value = text;
+    if (bufferKey !== null) {
+        const buffers = window.__aiStudioProxyPromptBuffers || {};
+        value = (buffers[bufferKey] || []).join('');
+        delete buffers[bufferKey];
+    }
+    element.value = value;
+    element.dispatchEvent(new Event('input', { bubbles: true, cancelable: true }));
+    element.dispatchEvent(new Event('change', { bubbles: true, cancelable: true }));
+    const wrapper = document.querySelector(wrapperSelector);
+    if (wrapper) {
+        wrapper.setAttribute('data-value', value);
+    }
+    return value.length;
+}
+'''
+
 class PageController:
     """封装了与AI Studio页面交互的所有操作。"""
 
@@ -56,7 +81,7 @@ class PageController:
 
         # 调整Top P
         top_p_to_set = request_params.get('top_p', DEFAULT_TOP_P)
-        await self._adjust_top_p(top_p_to_set, check_client_disconnected)
+        await self._adjust_top_p(top_p_to_set, page_params_cache, params_cache_lock, check_client_disconnected)
         await self._check_disconnect(check_client_disconnected, "End Parameter Adjustment")
 
 
@@ -245,48 +270,59 @@ class PageController:
                 if isinstance(e, ClientDisconnectedError):
                     raise
 
-    async def _adjust_top_p(self, top_p: float, check_client_disconnected: Callable):
+    async def _adjust_top_p(self, top_p: float, page_params_cache: dict, params_cache_lock: asyncio.Lock, check_client_disconnected: Callable):
         """调整Top P参数。"""
-        self.logger.info(f"[{self.req_id}] 检查并调整 Top P 设置...")
-        clamped_top_p = max(0.0, min(1.0, top_p))
+        async with params_cache_lock:
+            self.logger.info(f"[{self.req_id}] 检查并调整 Top P 设置...")
+            clamped_top_p = max(0.0, min(1.0, top_p))
 
-        if abs(clamped_top_p - top_p) > 1e-9:
-            self.logger.warning(f"[{self.req_id}] 请求的 Top P {top_p} 超出范围 [0, 1]，已调整为 {clamped_top_p}")
+            if abs(clamped_top_p - top_p) > 1e-9:
+                self.logger.warning(f"[{self.req_id}] 请求的 Top P {top_p} 超出范围 [0, 1]，已调整为 {clamped_top_p}")
 
-        top_p_input_locator = self.page.locator(TOP_P_INPUT_SELECTOR)
-        try:
-            await expect_async(top_p_input_locator).to_be_visible(timeout=5000)
-            await self._check_disconnect(check_client_disconnected, "Top P 调整 - 输入框可见后")
+            cached_top_p = page_params_cache.get("top_p")
+            if cached_top_p is not None and abs(cached_top_p - clamped_top_p) <= 1e-9:
+                self.logger.info(f"[{self.req_id}] Top P ({clamped_top_p}) 与缓存值一致。跳过页面交互。")
+                return
 
-            current_top_p_str = await top_p_input_locator.input_value(timeout=3000)
-            current_top_p_float = float(current_top_p_str)
+            top_p_input_locator = self.page.locator(TOP_P_INPUT_SELECTOR)
+            try:
+                await expect_async(top_p_input_locator).to_be_visible(timeout=5000)
+                await self._check_disconnect(check_client_disconnected, "Top P 调整 - 输入框可见后")
+
+                current_top_p_str = await top_p_input_locator.input_value(timeout=3000)
+                current_top_p_float = float(current_top_p_str)
 
-            if abs(current_top_p_float - clamped_top_p) > 1e-9:
-                self.logger.info(f"[{self.req_id}] 页面 Top P ({current_top_p_float}) 与请求值 ({clamped_top_p}) 不同，正在更新...")
-                await top_p_input_locator.fill(str(clamped_top_p), timeout=5000)
-                await self._check_disconnect(check_client_disconnected, "Top P 调整 - 填充输入框后")
+                if abs(current_top_p_float - clamped_top_p) > 1e-9:
+                    self.logger.info(f"[{self.req_id}] 页面 Top P ({current_top_p_float}) 与请求值 ({clamped_top_p}) 不同，正在更新...")
+                    await top_p_input_locator.fill(str(clamped_top_p), timeout=5000)
+                    await self._check_disconnect(check_client_disconnected, "Top P 调整 - 填充输入框后")
 
-                # 验证设置是否成功
-                await asyncio.sleep(0.1)
-                new_top_p_str = await top_p_input_locator.input_value(timeout=3000)
-                new_top_p_float = float(new_top_p_str)
+                    # 验证设置是否成功
+                    await asyncio.sleep(0.1)
+                    new_top_p_str = await top_p_input_locator.input_value(timeout=3000)
+                    new_top_p_float = float(new_top_p_str)
 
-                if abs(new_top_p_float - clamped_top_p) <= 1e-9:
-                    self.logger.info(f"[{self.req_id}] ✅ Top P 已成功更新为: {new_top_p_float}")
+                    if abs(new_top_p_float - clamped_top_p) <= 1e-9:
+                        self.logger.info(f"[{self.req_id}] ✅ Top P 已成功更新为: {new_top_p_float}")
+                        page_params_cache["top_p"] = new_top_p_float
+                    else:
+                        self.logger.warning(f"[{self.req_id}] ⚠️ Top P 更新后验证失败。页面显示: {new_top_p_float}, 期望: {clamped_top_p}")
+                        page_params_cache.pop("top_p", None)
+                        await save_error_snapshot(f"top_p_verify_fail_{self.req_id}")
                 else:
-                    self.logger.warning(f"[{self.req_id}] ⚠️ Top P 更新后验证失败。页面显示: {new_top_p_float}, 期望: {clamped_top_p}")
-                    await save_error_snapshot(f"top_p_verify_fail_{self.req_id}")
-            else:
-                self.logger.info(f"[{self.req_id}] 页面 Top P ({current_top_p_float}) 与请求值 ({clamped_top_p}) 一致，无需更改")
+                    self.logger.info(f"[{self.req_id}] 页面 Top P ({current_top_p_float}) 与请求值 ({clamped_top_p}) 一致，无需更改")
+                    page_params_cache["top_p"] = current_top_p_float
 
-        except (ValueError, TypeError) as ve:
-            self.logger.error(f"[{self.req_id}] 转换 Top P 值时出错: {ve}")
-            await save_error_snapshot(f"top_p_value_error_{self.req_id}")
-        except Exception as e:
-            self.logger.error(f"[{self.req_id}] ❌ 调整 Top P 时出错: {e}")
-            await save_error_snapshot(f"top_p_error_{self.req_id}")
-            if isinstance(e, ClientDisconnectedError):
-                raise
+            except (ValueError, TypeError) as ve:
+                self.logger.error(f"[{self.req_id}] 转换 Top P 值时出错: {ve}")
+                page_params_cache.pop("top_p", None)
+                await save_error_snapshot(f"top_p_value_error_{self.req_id}")
+            except Exception as e:
+                self.logger.error(f"[{self.req_id}] ❌ 调整 Top P 时出错: {e}")
+                page_params_cache.pop("top_p", None)
+                await save_error_snapshot(f"top_p_error_{self.req_id}")
+                if isinstance(e, ClientDisconnectedError):
+                    raise
 
     async def clear_chat_history(self, check_client_disconnected: Callable):
         """清空聊天记录。"""
@@ -425,25 +461,27 @@ class PageController:
         """提交提示到页面。"""
         self.logger.info(f"[{self.req_id}] 填充并提交提示 ({len(prompt)} chars)...")
         prompt_textarea_locator = self.page.locator(PROMPT_TEXTAREA_SELECTOR)
-        autosize_wrapper_locator = self.page.locator('ms-prompt-input-wrapper ms-autosize-textarea')
         submit_button_locator = self.page.locator(SUBMIT_BUTTON_SELECTOR)
 
         try:
             await expect_async(prompt_textarea_locator).to_be_visible(timeout=5000)
             await self._check_disconnect(check_client_disconnected, "After Input Visible")
 
-            # 使用 JavaScript 填充文本
-            await prompt_textarea_locator.evaluate(
-                '''
-                (element, text) => {
-                    element.value = text;
-                    element.dispatchEvent(new Event('input', { bubbles: true, cancelable: true }));
-                    element.dispatchEvent(new Event('change', { bubbles: true, cancelable: true }));
-                }
-                ''',
-                prompt
-            )
-            await autosize_wrapper_locator.evaluate('(element, text) => { element.setAttribute("data-value", text); }', prompt)
+            # 使用 JavaScript 填充文本（提示只传输一次，输入框和 autosize 包装器共用页面内的同一份文本）
+            buffer_key = None
+            if 0 < LARGE_PROMPT_THRESHOLD_CHARS <= len(prompt):
+                buffer_key = await self._upload_prompt_chunks(prompt, check_client_disconnected)
+            try:
+                filled_length = await prompt_textarea_locator.evaluate(
+                    _FILL_PROMPT_JS,
+                    [prompt if buffer_key is None else '', buffer_key, PROMPT_AUTOSIZE_WRAPPER_SELECTOR]
+                )
+            except Exception:
+                if buffer_key is not None:
+                    await self._discard_prompt_buffer(buffer_key)
+                raise
+            if filled_length != len(prompt):
+                self.logger.warning(f"[{self.req_id}] 填充后的提示长度 ({filled_length}) 与预期 ({len(prompt)}) 不一致。")
             await self._check_disconnect(check_client_disconnected, "After Input Fill")
 
             # 等待发送按钮启用
@@ -482,12 +520,44 @@ class PageController:
                 await save_error_snapshot(f"input_submit_error_{self.req_id}")
             raise
 
+    async def _upload_prompt_chunks(self, prompt: str, check_client_disconnected: Callable) -> str:
+        """大提示模式：将提示分块写入页面缓冲区，返回缓冲区键。每块之间检查客户端是否断开。"""
+        buffer_key = f"{self.req_id}-{id(prompt)}"
+        chunk_size = max(1, LARGE_PROMPT_CHUNK_CHARS)
+        chunk_count = (len(prompt) + chunk_size - 1) // chunk_size
+        self.logger.info(f"[{self.req_id}] 提示较大 ({len(prompt)} chars)，分 {chunk_count} 块写入页面缓冲区...")
+
+        await self.page.evaluate(
+            "(key) => { window.__aiStudioProxyPromptBuffers = window.__aiStudioProxyPromptBuffers || {}; window.__aiStudioProxyPromptBuffers[key] = []; }",
+            buffer_key
+        )
+        try:
+            for start in range(0, len(prompt), chunk_size):
+                await self.page.evaluate(
+                    "([key, chunk]) => { window.__aiStudioProxyPromptBuffers[key].push(chunk); }",
+                    [buffer_key, prompt[start:start + chunk_size]]
+                )
+                await self._check_disconnect(check_client_disconnected, f"Prompt Chunk Upload ({start // chunk_size + 1}/{chunk_count})")
+        except Exception:
+            await self._discard_prompt_buffer(buffer_key)
+            raise
+        return buffer_key
+
+    async def _discard_prompt_buffer(self, buffer_key: str):
+        """清理页面中未使用的提示缓冲区"""
+        try:
+            await self.page.evaluate(
+                "(key) => { if (window.__aiStudioProxyPromptBuffers) { delete window.__aiStudioProxyPromptBuffers[key]; } }",
+                buffer_key
+            )
+        except Exception as e:
+            self.logger.warning(f"[{self.req_id}] 清理页面提示缓冲区失败: {e}")
+
     async def _try_shortcut_submit(self, prompt_textarea_locator, check_client_disconnected: Callable) -> bool:
         """尝试使用快捷键提交"""
-        import os
         try:
             # 检测操作系统
-            host_os_from_launcher = os.environ.get('HOST_OS_FOR_SHORTCUT')
+            host_os_from_launcher = get_runtime_settings().host_os_for_shortcut
             is_mac_determined = False
 
             if host_os_from_launcher == "Darwin":
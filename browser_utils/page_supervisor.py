@@ -0,0 +1,300 @@
+"""
+页面故障切换模块
+监听服务页面的 crash/close 事件、跳转到登录页（认证失效）以及浏览器 disconnected 事件。
+在同一浏览器中预热一个使用当前认证状态的备用上下文/页面，页面故障时直接切换到备用页面，
+浏览器断开时按 CAMOUFOX_WS_ENDPOINT 重连后重新打开页面。
+"""
+
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from playwright.async_api import (
+    Page as AsyncPage, Browser as AsyncBrowser, BrowserContext as AsyncBrowserContext,
+    expect as expect_async
+)
+
+from config import (
+    AI_STUDIO_URL_PATTERN, INPUT_SELECTOR,
+    PAGE_STANDBY_ENABLED, get_runtime_settings
+)
+
+logger = logging.getLogger("AIStudioProxyServer")
+
+LOGIN_URL_PATTERN = 'accounts.google.com'
+# 浏览器断开后的重连间隔 (秒)
+_RECONNECT_BACKOFF_SECONDS = (0.5, 1, 2, 5, 10, 30, 30, 30, 30, 30)
+# 故障切换失败后的重试次数和间隔 (秒)
+_RECOVERY_ATTEMPTS = 3
+_RECOVERY_RETRY_DELAY_SECONDS = 5
+# 上述重试均失败后标记为失败状态，继续在后台按以下间隔 (秒) 重试，最后一个间隔重复使用
+_FAILED_RETRY_BACKOFF_SECONDS = (30, 60, 120, 300)
+
+
+class PageSupervisor:
+    """服务页面的故障检测与切换"""
+
+    def __init__(self):
+        self.standby_context: Optional[AsyncBrowserContext] = None
+        self.standby_page: Optional[AsyncPage] = None
+        self.failover_count = 0
+        self.last_failure_reason: Optional[str] = None
+        self.last_recovery_ms: Optional[float] = None
+        # 多次故障切换失败：请求直接返回 503 而不是等待切换，后台继续重试
+        self.failed = False
+        self._storage_state: Optional[Dict[str, Any]] = None
+        self._ready = asyncio.Event()
+        self._ready.set()
+        self._recovery_lock = asyncio.Lock()
+        self._recovery_task: Optional[asyncio.Task] = None
+        self._standby_task: Optional[asyncio.Task] = None
+        self._supervised_browser: Optional[AsyncBrowser] = None
+        self._stopped = False
+
+    # --- 事件监听 ---
+    def attach(self, page: AsyncPage, browser: Optional[AsyncBrowser]) -> None:
+        """为当前服务页面和浏览器注册故障监听，并开始预热备用页面"""
+        page.on("crash", lambda _page: self._on_page_failure(page, "page crashed"))
+        page.on("close", lambda _page: self._on_page_failure(page, "page closed"))
+        page.on("framenavigated", lambda frame: self._on_frame_navigated(page, frame))
+        if browser is not None and browser is not self._supervised_browser:
+            browser.on("disconnected", lambda _browser: self._on_browser_disconnected(browser))
+            self._supervised_browser = browser
+        self.schedule_standby()
+
+    def _is_serving(self, page: AsyncPage) -> bool:
+        import server
+        return not self._stopped and page is server.page_instance
+
+    def _on_page_failure(self, page: AsyncPage, reason: str) -> None:
+        if self._is_serving(page):
+            self._start_recovery(reason)
+
+    def _on_frame_navigated(self, page: AsyncPage, frame) -> None:
+        if frame is page.main_frame and LOGIN_URL_PATTERN in frame.url and self._is_serving(page):
+            self._start_recovery("redirected to login page (auth expired)")
+
+    def _on_browser_disconnected(self, browser: AsyncBrowser) -> None:
+        import server
+        if not self._stopped and browser is server.browser_instance:
+            server.is_browser_connected = False
+            self._start_recovery("browser disconnected")
+
+    def _start_recovery(self, reason: str) -> None:
+        import server
+        if self._recovery_task is not None and not self._recovery_task.done():
+            return
+        logger.error(f"检测到服务页面故障: {reason}，开始故障切换...")
+        server.is_page_ready = False
+        self._ready.clear()
+        self.last_failure_reason = reason
+        self._recovery_task = asyncio.create_task(self._recover(reason))
+
+    # --- 状态查询 ---
+    def is_page_lost(self, page: Optional[AsyncPage]) -> bool:
+        """请求使用的页面是否已失效（正在切换或已被替换）"""
+        import server
+        if self._stopped:
+            return False
+        return not self._ready.is_set() or page is None or page.is_closed() or page is not server.page_instance
+
+    async def wait_until_ready(self, timeout: float) -> bool:
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout=timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "ready": self._ready.is_set(),
+            "standby_ready": self.standby_page is not None and not self.standby_page.is_closed(),
+            "failed": self.failed,
+            "failover_count": self.failover_count,
+            "last_failure_reason": self.last_failure_reason,
+            "last_recovery_ms": self.last_recovery_ms,
+        }
+
+    # --- 备用页面 ---
+    def schedule_standby(self) -> None:
+        if not PAGE_STANDBY_ENABLED or self._stopped:
+            return
+        if self._standby_task is not None and not self._standby_task.done():
+            return
+        self._standby_task = asyncio.create_task(self._prepare_standby())
+
+    async def _capture_storage_state(self) -> Optional[Any]:
+        """优先使用服务页面当前的认证状态，其次是上次保存的状态和 ACTIVE_AUTH_JSON_PATH"""
+        import server
+        page = server.page_instance
+        if page is not None and not page.is_closed():
+            try:
+                self._storage_state = await page.context.storage_state()
+            except Exception as e:
+                logger.warning(f"读取当前认证状态失败: {e}")
+        if self._storage_state is not None:
+            return self._storage_state
+        auth_path = get_runtime_settings().active_auth_json_path
+        if auth_path and os.path.exists(auth_path):
+            return auth_path
+        return None
+
+    async def _prepare_standby(self) -> None:
+        import server
+        await self._discard_standby()
+        browser = server.browser_instance
+        if browser is None or not browser.is_connected():
+            return
+        try:
+            storage_state = await self._capture_storage_state()
+            context, page = await _open_ai_studio_page(browser, storage_state)
+        except Exception as e:
+            logger.warning(f"预热备用页面失败: {e}")
+            return
+        if self._stopped:
+            await _close_context(context)
+            return
+        self.standby_context, self.standby_page = context, page
+        logger.info("备用页面已就绪。")
+
+    async def _discard_standby(self) -> None:
+        context = self.standby_context
+        self.standby_context, self.standby_page = None, None
+        if context is not None:
+            await _close_context(context)
+
+    def _take_standby(self) -> Optional[Tuple[AsyncBrowserContext, AsyncPage]]:
+        context, page = self.standby_context, self.standby_page
+        self.standby_context, self.standby_page = None, None
+        if page is None or page.is_closed():
+            return None
+        return context, page
+
+    # --- 恢复 ---
+    async def _recover(self, reason: str) -> None:
+        import server
+        started = time.perf_counter()
+        old_page = server.page_instance
+        async with self._recovery_lock:
+            attempt = 0
+            while True:
+                attempt += 1
+                try:
+                    await self._swap_in_new_page()
+                    break
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.error(f"故障切换失败 (第 {attempt} 次，原因: {reason}): {e}", exc_info=True)
+                    if attempt < _RECOVERY_ATTEMPTS:
+                        delay = _RECOVERY_RETRY_DELAY_SECONDS
+                    else:
+                        if not self.failed:
+                            self.failed = True
+                            logger.critical("故障切换多次失败，服务页面不可用，请求将直接返回 503，后台继续重试。")
+                        backoff_index = min(attempt - _RECOVERY_ATTEMPTS, len(_FAILED_RETRY_BACKOFF_SECONDS) - 1)
+                        delay = _FAILED_RETRY_BACKOFF_SECONDS[backoff_index]
+                        logger.warning(f"{delay} 秒后再次尝试故障切换。")
+                    await asyncio.sleep(delay)
+
+            self.failed = False
+            self.failover_count += 1
+            self.last_recovery_ms = round((time.perf_counter() - started) * 1000, 1)
+            logger.info(f"✅ 已切换到新的服务页面 (原因: {reason}，耗时 {self.last_recovery_ms:.0f} ms)。")
+
+        if old_page is not None and old_page is not server.page_instance:
+            await _close_context(old_page.context)
+        self.schedule_standby()
+
+    async def _swap_in_new_page(self) -> None:
+        import server
+        if server.browser_instance is None or not server.browser_instance.is_connected():
+            await self._discard_standby()
+            await self._reconnect_browser()
+
+        if self._standby_task is not None and not self._standby_task.done():
+            # 备用页面正在预热时等待其完成，通常比重新打开更快
+            await asyncio.shield(self._standby_task)
+        standby = self._take_standby()
+        if standby is None:
+            logger.warning("没有可用的备用页面，重新打开 AI Studio 页面...")
+            standby = await _open_ai_studio_page(server.browser_instance, await self._capture_storage_state())
+        context, new_page = standby
+        try:
+            await self._activate(new_page)
+        except BaseException:
+            await _close_context(context)
+            raise
+
+    async def _activate(self, page: AsyncPage) -> None:
+        """将页面设为服务页面：同步当前模型和参数缓存后标记就绪"""
+        import server
+        from .model_management import _set_model_from_page_display
+        from .operations import _handle_model_list_response
+        from .params_cache import revalidate_page_params_cache
+
+        server.page_instance = page
+        page.on("response", _handle_model_list_response)
+        await _set_model_from_page_display(page, set_storage=False)
+        async with server.params_cache_lock:
+            await revalidate_page_params_cache(page, server.current_ai_studio_model_id, server.page_params_cache)
+        self.attach(page, server.browser_instance)
+        server.is_page_ready = True
+        self._ready.set()
+
+    async def _reconnect_browser(self) -> None:
+        import server
+        ws_endpoint = get_runtime_settings().camoufox_ws_endpoint
+        if not ws_endpoint or server.playwright_manager is None:
+            raise RuntimeError("无法重连浏览器：缺少 CAMOUFOX_WS_ENDPOINT 或 Playwright 未启动。")
+        for attempt, delay in enumerate(_RECONNECT_BACKOFF_SECONDS, start=1):
+            try:
+                logger.info(f"正在重连浏览器 (第 {attempt} 次): {ws_endpoint}")
+                server.browser_instance = await server.playwright_manager.firefox.connect(ws_endpoint, timeout=30000)
+                server.is_browser_connected = True
+                logger.info(f"浏览器已重新连接: {server.browser_instance.version}")
+                return
+            except Exception as e:
+                logger.warning(f"重连浏览器失败: {e}，{delay} 秒后重试。")
+                await asyncio.sleep(delay)
+        raise RuntimeError("多次重连浏览器失败。")
+
+    async def close(self) -> None:
+        self._stopped = True
+        for task in (self._recovery_task, self._standby_task):
+            if task is not None and not task.done():
+                task.cancel()
+                try:
+                    await task
+                except (asyncio.CancelledError, Exception):
+                    pass
+        await self._discard_standby()
+
+
+async def _open_ai_studio_page(browser: AsyncBrowser, storage_state: Optional[Any]) -> Tuple[AsyncBrowserContext, AsyncPage]:
+    """在新的浏览器上下文中打开 AI Studio 对话页面并等待输入区域可见"""
+    from .initialization import _build_context_options
+
+    context = await browser.new_context(**_build_context_options(storage_state, log=False))
+    try:
+        page = await context.new_page()
+        await page.goto(f"https://{AI_STUDIO_URL_PATTERN}prompts/new_chat", wait_until="domcontentloaded", timeout=90000)
+        if LOGIN_URL_PATTERN in page.url:
+            raise RuntimeError("页面重定向至登录页面，认证状态已失效。")
+        await expect_async(page.locator('ms-prompt-input-wrapper')).to_be_visible(timeout=35000)
+        await expect_async(page.locator(INPUT_SELECTOR)).to_be_visible(timeout=10000)
+        return context, page
+    except BaseException:
+        await _close_context(context)
+        raise
+
+
+async def _close_context(context: Optional[AsyncBrowserContext]) -> None:
+    if context is None:
+        return
+    try:
+        await context.close()
+    except Exception:
+        pass
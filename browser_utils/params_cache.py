@@ -0,0 +1,95 @@
+"""
+页面参数缓存校验模块
+启动、页面切换或切换模型后通过一次批量 DOM 读取重建 page_params_cache（AI Studio 按模型记忆参数设置），
+后续请求只需要修改与页面实际值不同的控件。
+"""
+
+import logging
+from typing import Any, Dict, Optional
+
+from playwright.async_api import Page as AsyncPage
+
+from config import TEMPERATURE_INPUT_SELECTOR, MAX_OUTPUT_TOKENS_SELECTOR
+
+logger = logging.getLogger("AIStudioProxyServer")
+
+# 缓存中与模型相关的参数键（不含 last_known_model_id_for_params）
+PARAM_KEYS = ("temperature", "max_output_tokens", "top_p", "stop_sequences")
+
+# 一次 evaluate 读取全部参数控件。Top P 选择器依赖 Playwright 的 :has()/:text-is()，此处按标题文本查找
+_READ_PAGE_PARAMS_JS = '''
+([temperatureSelector, maxTokensSelector]) => {
+    const readNumber = (input) => {
+        if (!input || input.value === '') return null;
+        const value = Number(input.value);
+        return Number.isFinite(value) ? value : null;
+    };
+    let topPInput = null;
+    for (const column of document.querySelectorAll('div.settings-item-column')) {
+        const title = column.querySelector('h3');
+        if (title && title.textContent.trim() === 'Top P') {
+            topPInput = column.querySelector('input[type="number"].slider-input');
+            break;
+        }
+    }
+    const chips = Array.from(document.querySelectorAll('mat-chip-set mat-chip-row'));
+    const stopSequences = chips.map((chip) => {
+        const label = chip.querySelector('.mdc-evolution-chip__text-label, .mat-mdc-chip-action-label');
+        return (label ? label.textContent : '').trim();
+    });
+    return {
+        temperature: readNumber(document.querySelector(temperatureSelector)),
+        max_output_tokens: readNumber(document.querySelector(maxTokensSelector)),
+        top_p: readNumber(topPInput),
+        stop_chip_count: chips.length,
+        stop_sequences: stopSequences,
+    };
+}
+'''
+
+def _serialize_params(page_params_cache: Dict[str, Any]) -> Dict[str, Any]:
+    params = {}
+    for key in PARAM_KEYS:
+        if key in page_params_cache:
+            value = page_params_cache[key]
+            params[key] = sorted(value) if isinstance(value, (set, frozenset)) else value
+    return params
+
+
+async def read_page_params(page: AsyncPage) -> Optional[Dict[str, Any]]:
+    """一次批量读取页面上的参数控件，失败时返回 None"""
+    try:
+        return await page.evaluate(_READ_PAGE_PARAMS_JS, [TEMPERATURE_INPUT_SELECTOR, MAX_OUTPUT_TOKENS_SELECTOR])
+    except Exception as e:
+        logger.warning(f"批量读取页面参数失败: {e}")
+        return None
+
+
+async def revalidate_page_params_cache(page: AsyncPage, model_id: Optional[str], page_params_cache: Dict[str, Any]) -> None:
+    """
+    重建指定模型的参数缓存：用一次批量 DOM 读取获取页面上的实际值。
+    读取不到的控件不进入缓存，由后续请求按原有方式读取和设置；停止序列只有在全部芯片文本都能读取时才缓存。
+    调用方需持有 params_cache_lock。
+    """
+    page_params_cache.clear()
+    page_params_cache["last_known_model_id_for_params"] = model_id
+    if page is None or page.is_closed():
+        return
+
+    page_values = await read_page_params(page)
+    if page_values is None:
+        return
+
+    for key in ("temperature", "max_output_tokens", "top_p"):
+        value = page_values.get(key)
+        if value is None:
+            continue
+        page_params_cache[key] = int(value) if key == "max_output_tokens" else value
+
+    page_stops = {s for s in page_values.get("stop_sequences", []) if s}
+    if page_values.get("stop_chip_count", 0) == 0:
+        page_params_cache["stop_sequences"] = set()
+    elif len(page_stops) == page_values.get("stop_chip_count"):
+        page_params_cache["stop_sequences"] = page_stops
+
+    logger.info(f"模型 {model_id} 的参数缓存已通过页面校验: {_serialize_params(page_params_cache)}")
@@ -3,6 +3,11 @@
 导出所有配置项，便于其他模块导入使用
 """
 
+from dotenv import load_dotenv
+
+# 只在这里加载一次 .env 文件，各配置子模块导入时直接读取环境变量
+load_dotenv()
+
 # 从各个配置文件导入所有配置项
 from .constants import *
 from .timeouts import *
@@ -69,6 +74,13 @@ __all__ = [
     # 设置配置
     'DEBUG_LOGS_ENABLED',
     'TRACE_LOGS_ENABLED',
+    'LOG_QUEUE_MAX_SIZE',
+    'LOG_QUEUE_BLOCK_TIMEOUT_MS',
+    'LOG_WS_FLUSH_INTERVAL_MS',
+    'LOG_WS_BUFFER_SIZE',
+    'LOG_FORMAT',
+    'LOG_MODULE_LEVELS',
+    'LOG_TRACE_SAMPLE_RATE',
     'AUTO_SAVE_AUTH',
     'AUTH_SAVE_TIMEOUT',
     'AUTO_CONFIRM_LOGIN',
@@ -77,7 +89,51 @@ __all__ = [
     'SAVED_AUTH_DIR',
     'LOG_DIR',
     'APP_LOG_FILE_PATH',
+    'CACHE_DIR',
+    'MODEL_LIST_CACHE_FILE',
+    'MODEL_LIST_REFRESH_INTERVAL_SECONDS',
     'NO_PROXY_ENV',
+    'SSE_COALESCE_ENABLED',
+    'SSE_FLUSH_BYTES',
+    'SSE_FLUSH_INTERVAL_MS',
+    'TOKENIZER_VOCAB_PATH',
+    'TOKEN_COUNT_CACHE_SIZE',
+    'PROMPT_PREFIX_CACHE_SIZE',
+    'LARGE_PROMPT_THRESHOLD_CHARS',
+    'LARGE_PROMPT_CHUNK_CHARS',
+    'RESPONSE_CACHE_ENABLED',
+    'RESPONSE_CACHE_DETERMINISTIC_ONLY',
+    'RESPONSE_CACHE_MAX_ENTRIES',
+    'RESPONSE_CACHE_TTL_SECONDS',
+    'RESPONSE_CACHE_DB_PATH',
+    'RESPONSE_CACHE_DB_MAX_MB',
+    'REQUEST_COALESCING_ENABLED',
+    'PAGE_FAILOVER_ENABLED',
+    'PAGE_STANDBY_ENABLED',
+    'PAGE_FAILOVER_WAIT_SECONDS',
+    'RATE_LIMIT_RPM',
+    'RATE_LIMIT_COOLDOWN_SECONDS',
+    'RATE_LIMIT_MAX_COOLDOWN_SECONDS',
+    'RATE_LIMIT_MAX_WAIT_SECONDS',
+    'ADMISSION_MAX_QUEUE_WAIT_SECONDS',
+    'ADMISSION_MAX_QUEUE_LENGTH',
+    'JOBS_DB_PATH',
+    'JOBS_MAX_INFLIGHT',
+    'JOBS_MAX_ATTEMPTS',
+    'JOBS_RETENTION_HOURS',
+    'BATCH_MAX_REQUESTS',
+    'BATCH_MAX_FILE_MB',
+    'SHARD_BACKENDS',
+    'SHARD_ROUTING',
+    'SHARD_HEALTH_INTERVAL_SECONDS',
+    'ERROR_SNAPSHOT_DEDUP_SECONDS',
+    'ERROR_SNAPSHOT_MAX_PER_MINUTE',
+    'ERROR_SNAPSHOT_MAX_DIR_MB',
+    'ERROR_SNAPSHOT_COMPRESS_HTML',
+    
+    # 运行时设置
+    'RuntimeSettings',
+    'get_runtime_settings',
     
     # 工具函数
     'get_environment_variable',
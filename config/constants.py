@@ -5,10 +5,6 @@
 
 import os
 import json
-from dotenv import load_dotenv
-
-# 加载 .env 文件
-load_dotenv()
 
 # --- 模型相关常量 ---
 MODEL_NAME = os.environ.get('MODEL_NAME', 'AI-Studio_Proxy_API')
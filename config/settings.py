@@ -4,14 +4,26 @@
 """
 
 import os
-from dotenv import load_dotenv
-
-# 加载 .env 文件
-load_dotenv()
+from dataclasses import dataclass
+from typing import Optional
 
 # --- 全局日志控制配置 ---
 DEBUG_LOGS_ENABLED = os.environ.get('DEBUG_LOGS_ENABLED', 'false').lower() in ('true', '1', 'yes')
 TRACE_LOGS_ENABLED = os.environ.get('TRACE_LOGS_ENABLED', 'false').lower() in ('true', '1', 'yes')
+# 日志处理器（文件、控制台、WebSocket）在后台线程中运行，调用方只负责入队；
+# 队列满时丢弃 INFO 及以下的记录，WARNING 及以上最多等待 LOG_QUEUE_BLOCK_TIMEOUT_MS 毫秒（0 表示队列无上限）
+LOG_QUEUE_MAX_SIZE = int(os.environ.get('LOG_QUEUE_MAX_SIZE', '10000'))
+LOG_QUEUE_BLOCK_TIMEOUT_MS = int(os.environ.get('LOG_QUEUE_BLOCK_TIMEOUT_MS', '50'))
+# /ws/logs 广播：每隔 LOG_WS_FLUSH_INTERVAL_MS 毫秒把新日志合并为一帧发送；
+# 广播缓冲区和每个客户端发送队列的容量 (条)，满时丢弃最旧的记录
+LOG_WS_FLUSH_INTERVAL_MS = int(os.environ.get('LOG_WS_FLUSH_INTERVAL_MS', '200'))
+LOG_WS_BUFFER_SIZE = int(os.environ.get('LOG_WS_BUFFER_SIZE', '2000'))
+# 文件日志格式: text 或 json (每条日志一行 JSON，包含 req_id、stage、elapsed_ms 等字段)
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text').strip().lower()
+# 按模块设置日志级别，如 "browser_utils.operations=DEBUG"，作用于 AIStudioProxyServer 下的同名子日志器
+LOG_MODULE_LEVELS = os.environ.get('LOG_MODULE_LEVELS', '')
+# 热路径追踪日志的请求采样率 (0-1，按 req_id 哈希采样)；DEBUG_LOGS_ENABLED 为 true 时追踪所有请求
+LOG_TRACE_SAMPLE_RATE = float(os.environ.get('LOG_TRACE_SAMPLE_RATE', '0'))
 
 # --- 认证相关配置 ---
 AUTO_SAVE_AUTH = os.environ.get('AUTO_SAVE_AUTH', '').lower() in ('1', 'true', 'yes')
@@ -24,11 +36,157 @@ ACTIVE_AUTH_DIR = os.path.join(AUTH_PROFILES_DIR, 'active')
 SAVED_AUTH_DIR = os.path.join(AUTH_PROFILES_DIR, 'saved')
 LOG_DIR = os.path.join(os.path.dirname(__file__), '..', 'logs')
 APP_LOG_FILE_PATH = os.path.join(LOG_DIR, 'app.log')
+CACHE_DIR = os.path.join(os.path.dirname(__file__), '..', 'cache')
+# 模型列表缓存文件，留空表示不持久化；后台刷新间隔为 0 时不启动刷新任务
+MODEL_LIST_CACHE_FILE = os.environ.get('MODEL_LIST_CACHE_FILE', os.path.join(CACHE_DIR, 'model_list.json'))
+MODEL_LIST_REFRESH_INTERVAL_SECONDS = int(os.environ.get('MODEL_LIST_REFRESH_INTERVAL_SECONDS', '3600'))
+
+# --- SSE 输出合并配置 ---
+# 将多个 SSE 事件合并为一次写出，满足任一条件即刷新；SSE_FLUSH_BYTES=0 或禁用时保持逐事件输出
+SSE_COALESCE_ENABLED = os.environ.get('SSE_COALESCE_ENABLED', 'true').lower() in ('true', '1', 'yes')
+SSE_FLUSH_BYTES = int(os.environ.get('SSE_FLUSH_BYTES', '1024'))
+SSE_FLUSH_INTERVAL_MS = int(os.environ.get('SSE_FLUSH_INTERVAL_MS', '20'))
+
+# --- Token 统计配置 ---
+# 指定本地词表文件时使用真实分词器统计 usage（.model 为 SentencePiece，.json 为 tokenizers 的 BPE 词表），
+# 未配置、文件不存在或缺少对应依赖时回退到字符估算
+TOKENIZER_VOCAB_PATH = os.environ.get('TOKENIZER_VOCAB_PATH', '')
+TOKEN_COUNT_CACHE_SIZE = int(os.environ.get('TOKEN_COUNT_CACHE_SIZE', '4096'))
+
+# --- 提示组合缓存配置 ---
+# 缓存最近组合过的对话前缀（按消息列表滚动哈希），多轮对话只格式化新增消息；0 表示禁用
+PROMPT_PREFIX_CACHE_SIZE = int(os.environ.get('PROMPT_PREFIX_CACHE_SIZE', '32'))
+
+# --- 大提示输入配置 ---
+# 提示长度（字符）达到阈值时先分块写入页面缓冲区，再由页面内同一份文本填充输入框和 autosize 包装器；0 表示禁用
+LARGE_PROMPT_THRESHOLD_CHARS = int(os.environ.get('LARGE_PROMPT_THRESHOLD_CHARS', '262144'))
+LARGE_PROMPT_CHUNK_CHARS = int(os.environ.get('LARGE_PROMPT_CHUNK_CHARS', '131072'))
+
+# --- 响应缓存配置 ---
+# 对相同模型、消息和采样参数的请求直接回放已缓存的响应；默认关闭
+RESPONSE_CACHE_ENABLED = os.environ.get('RESPONSE_CACHE_ENABLED', 'false').lower() in ('true', '1', 'yes')
+RESPONSE_CACHE_DETERMINISTIC_ONLY = os.environ.get('RESPONSE_CACHE_DETERMINISTIC_ONLY', 'true').lower() in ('true', '1', 'yes')
+RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get('RESPONSE_CACHE_MAX_ENTRIES', '256'))
+RESPONSE_CACHE_TTL_SECONDS = int(os.environ.get('RESPONSE_CACHE_TTL_SECONDS', '86400'))
+RESPONSE_CACHE_DB_PATH = os.environ.get('RESPONSE_CACHE_DB_PATH', '')
+RESPONSE_CACHE_DB_MAX_MB = int(os.environ.get('RESPONSE_CACHE_DB_MAX_MB', '256'))
+
+# --- 请求合并配置 ---
+# 相同请求在排队或执行期间到达时共享同一次执行的结果，而不是重复入队
+REQUEST_COALESCING_ENABLED = os.environ.get('REQUEST_COALESCING_ENABLED', 'true').lower() in ('true', '1', 'yes')
+
+# --- 页面故障切换配置 ---
+# 监听页面崩溃/关闭、认证失效和浏览器断开，出现故障时切换到预热的备用页面（同一浏览器中另一个使用当前认证状态的上下文），
+# 正在处理的请求重新排队；浏览器断开时按 CAMOUFOX_WS_ENDPOINT 重连
+PAGE_FAILOVER_ENABLED = os.environ.get('PAGE_FAILOVER_ENABLED', 'true').lower() in ('true', '1', 'yes')
+PAGE_STANDBY_ENABLED = os.environ.get('PAGE_STANDBY_ENABLED', 'true').lower() in ('true', '1', 'yes')
+PAGE_FAILOVER_WAIT_SECONDS = int(os.environ.get('PAGE_FAILOVER_WAIT_SECONDS', '120'))
+
+# --- 速率限制感知配置 ---
+# 按 (账号, 模型) 的令牌桶：每分钟请求数 (0 表示不主动限速，仅在收到配额/限流信号后冷却)
+RATE_LIMIT_RPM = float(os.environ.get('RATE_LIMIT_RPM', '0'))
+# 首次配额信号的冷却时间，连续信号时翻倍直至上限 (秒)
+RATE_LIMIT_COOLDOWN_SECONDS = float(os.environ.get('RATE_LIMIT_COOLDOWN_SECONDS', '30'))
+RATE_LIMIT_MAX_COOLDOWN_SECONDS = float(os.environ.get('RATE_LIMIT_MAX_COOLDOWN_SECONDS', '900'))
+# 冷却/令牌等待不超过该值时延迟处理请求，否则直接返回 429 (秒)
+RATE_LIMIT_MAX_WAIT_SECONDS = float(os.environ.get('RATE_LIMIT_MAX_WAIT_SECONDS', '15'))
+
+# --- 准入控制配置 ---
+# 按最近服务时间的移动平均 × 排队位置估算等待时间，预计排队超过该值 (秒) 的请求直接返回 503；0 表示不限
+# (请求体中的 max_queue_wait_seconds 可以指定更严格的截止时间)
+ADMISSION_MAX_QUEUE_WAIT_SECONDS = float(os.environ.get('ADMISSION_MAX_QUEUE_WAIT_SECONDS', '0'))
+# 队列长度上限，达到后新请求直接返回 503；0 表示不限
+ADMISSION_MAX_QUEUE_LENGTH = int(os.environ.get('ADMISSION_MAX_QUEUE_LENGTH', '0'))
+
+# --- 异步任务 (持久化请求队列) 配置 ---
+# 任务数据库 (SQLite) 路径，设置后启用 /v1/jobs；为空表示不启用
+JOBS_DB_PATH = os.environ.get('JOBS_DB_PATH', '')
+# 同时送入请求队列的任务数上限，其余任务留在数据库中，与实时请求交替处理
+JOBS_MAX_INFLIGHT = int(os.environ.get('JOBS_MAX_INFLIGHT', '1'))
+# 任务因配额冷却或服务繁忙 (429/503) 被推迟的最多执行次数，超过后标记为失败
+JOBS_MAX_ATTEMPTS = int(os.environ.get('JOBS_MAX_ATTEMPTS', '5'))
+# 已结束任务的保留时间 (小时)，0 表示不清理
+JOBS_RETENTION_HOURS = float(os.environ.get('JOBS_RETENTION_HOURS', '168'))
+# 批处理 (/v1/batches，需要启用异步任务) 单个输入文件的请求数上限和上传文件大小上限 (MB)
+BATCH_MAX_REQUESTS = int(os.environ.get('BATCH_MAX_REQUESTS', '50000'))
+BATCH_MAX_FILE_MB = int(os.environ.get('BATCH_MAX_FILE_MB', '200'))
+
+# --- 多账号分片网关配置 (shard_gateway.py) ---
+# 每个分片是一个独立的代理服务实例（各自的 Camoufox 浏览器和认证文件），逗号分隔的服务地址
+SHARD_BACKENDS = [url.strip() for url in os.environ.get('SHARD_BACKENDS', '').split(',') if url.strip()]
+# 路由策略: least_loaded (最小负载) 或 conversation_hash (按对话一致性哈希)
+SHARD_ROUTING = os.environ.get('SHARD_ROUTING', 'least_loaded').lower()
+SHARD_HEALTH_INTERVAL_SECONDS = float(os.environ.get('SHARD_HEALTH_INTERVAL_SECONDS', '5'))
+
+# --- 错误快照配置 ---
+# 错误快照 (errors_py/ 下的截图和 HTML) 在后台保存：同类错误在去重窗口内只保存一次 (秒)，
+# 每分钟最多保存的数量 (0 表示不限)，目录总大小上限 (MB，0 表示不限，超出时删除最旧的文件)
+ERROR_SNAPSHOT_DEDUP_SECONDS = float(os.environ.get('ERROR_SNAPSHOT_DEDUP_SECONDS', '300'))
+ERROR_SNAPSHOT_MAX_PER_MINUTE = int(os.environ.get('ERROR_SNAPSHOT_MAX_PER_MINUTE', '6'))
+ERROR_SNAPSHOT_MAX_DIR_MB = float(os.environ.get('ERROR_SNAPSHOT_MAX_DIR_MB', '200'))
+# 以 gzip 压缩保存页面 HTML (.html.gz)
+ERROR_SNAPSHOT_COMPRESS_HTML = os.environ.get('ERROR_SNAPSHOT_COMPRESS_HTML', 'false').lower() in ('true', '1', 'yes')
 
 # --- 代理配置 ---
 # 注意：代理配置现在在 api_utils/app.py 中动态设置，根据 STREAM_PORT 环境变量决定
 NO_PROXY_ENV = os.environ.get('NO_PROXY')
 
+# --- 运行时设置 ---
+# 以下环境变量由 launch_camoufox.py 在导入 server 之后、启动 uvicorn 之前写入，
+# 因此不能在模块导入时读取，而是在首次使用时（lifespan 内）一次性解析为 RuntimeSettings
+@dataclass(frozen=True)
+class RuntimeSettings:
+    """启动器传入的运行时设置"""
+    launch_mode: Optional[str]
+    camoufox_ws_endpoint: Optional[str]
+    active_auth_json_path: Optional[str]
+    server_log_level: str
+    server_redirect_print: str
+    server_port_info: str
+    stream_port: Optional[str]
+    unified_proxy_config: Optional[str]
+    https_proxy: Optional[str]
+    host_os_for_shortcut: Optional[str]
+
+    @classmethod
+    def from_env(cls) -> "RuntimeSettings":
+        return cls(
+            launch_mode=os.environ.get('LAUNCH_MODE'),
+            camoufox_ws_endpoint=os.environ.get('CAMOUFOX_WS_ENDPOINT'),
+            active_auth_json_path=os.environ.get('ACTIVE_AUTH_JSON_PATH'),
+            server_log_level=os.environ.get('SERVER_LOG_LEVEL', 'INFO'),
+            server_redirect_print=os.environ.get('SERVER_REDIRECT_PRINT', 'false'),
+            server_port_info=os.environ.get('SERVER_PORT_INFO', '8000'),
+            stream_port=os.environ.get('STREAM_PORT'),
+            unified_proxy_config=os.environ.get('UNIFIED_PROXY_CONFIG'),
+            https_proxy=os.environ.get('HTTPS_PROXY') or os.environ.get('HTTP_PROXY'),
+            host_os_for_shortcut=os.environ.get('HOST_OS_FOR_SHORTCUT'),
+        )
+
+    @property
+    def browser_required(self) -> bool:
+        """除 direct_debug_no_browser 模式外，浏览器和页面都是服务可用的必要条件"""
+        return self.launch_mode != 'direct_debug_no_browser'
+
+    @property
+    def stream_proxy_enabled(self) -> bool:
+        return self.stream_port != '0'
+
+    @property
+    def stream_proxy_port(self) -> int:
+        return int(self.stream_port or 3120)
+
+
+_runtime_settings: Optional[RuntimeSettings] = None
+
+
+def get_runtime_settings() -> RuntimeSettings:
+    """返回运行时设置，首次调用时解析环境变量"""
+    global _runtime_settings
+    if _runtime_settings is None:
+        _runtime_settings = RuntimeSettings.from_env()
+    return _runtime_settings
+
 def get_environment_variable(key: str, default: str = '') -> str:
     """获取环境变量值"""
     return os.environ.get(key, default)
@@ -4,10 +4,6 @@
 """
 
 import os
-from dotenv import load_dotenv
-
-# 加载 .env 文件
-load_dotenv()
 
 # --- 响应等待配置 ---
 RESPONSE_COMPLETION_TIMEOUT = int(os.environ.get('RESPONSE_COMPLETION_TIMEOUT', '300000'))  # 5 minutes total timeout (in ms)
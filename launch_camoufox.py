@@ -20,8 +20,8 @@ import platform
 import shutil
 
 # --- 新的导入 ---
-import uvicorn
 from server import app # 从 server.py 导入 FastAPI app 对象
+from api_utils import run_uvicorn
 from dotenv import load_dotenv
 
 # 加载 .env 文件
@@ -1046,7 +1046,8 @@ if __name__ == "__main__":
     # --- 步骤 5: 启动 FastAPI/Uvicorn 服务器 (from dev) ---
     logger.info(f"--- 步骤 5: 启动集成的 FastAPI 服务器 (监听端口: {args.server_port}) ---")
     try:
-        uvicorn.run(
+        # 后台启动失败时以状态 1 退出，便于 supervisord/docker 识别
+        run_uvicorn(
             app,
             host="0.0.0.0", # Bind to all interfaces
             port=args.server_port,
@@ -1055,6 +1056,8 @@ if __name__ == "__main__":
         logger.info("Uvicorn 服务器已停止。")
     except SystemExit as e_sysexit:
         logger.info(f"Uvicorn 或其子系统通过 sys.exit({e_sysexit.code}) 退出。")
+        if e_sysexit.code:
+            raise
     except Exception as e_uvicorn:
         logger.critical(f"❌ 运行 Uvicorn 时发生致命错误: {e_uvicorn}", exc_info=True)
         sys.exit(1) # Ensure launcher exits if Uvicorn fails critically
@@ -1,7 +1,14 @@
 # 日志设置功能
-from .setup import setup_server_logging, restore_original_streams
+from .setup import setup_server_logging, restore_original_streams, shutdown_server_logging, get_logging_stats
+from .tracing import JsonLinesFormatter, get_module_logger, is_request_sampled, trace
 
 __all__ = [
     'setup_server_logging',
-    'restore_original_streams'
+    'restore_original_streams',
+    'shutdown_server_logging',
+    'get_logging_stats',
+    'JsonLinesFormatter',
+    'get_module_logger',
+    'is_request_sampled',
+    'trace'
 ] 
\ No newline at end of file
@@ -1,11 +1,99 @@
 import logging
 import logging.handlers
 import os
+import queue
 import sys
-from typing import Tuple
+from typing import Any, Dict, Optional, Tuple
 
-from config import LOG_DIR, ACTIVE_AUTH_DIR, SAVED_AUTH_DIR, APP_LOG_FILE_PATH
+from config import (
+    LOG_DIR, ACTIVE_AUTH_DIR, SAVED_AUTH_DIR, APP_LOG_FILE_PATH, LOG_QUEUE_MAX_SIZE, LOG_QUEUE_BLOCK_TIMEOUT_MS,
+    LOG_FORMAT, LOG_TRACE_SAMPLE_RATE
+)
 from models import StreamToLogger, WebSocketLogHandler, WebSocketConnectionManager
+from .tracing import JsonLinesFormatter, apply_module_log_levels
+
+
+class BoundedQueueHandler(logging.handlers.QueueHandler):
+    """
+    有界队列日志处理器：调用方线程只负责把记录放入队列，消息拼接 (msg % args)、格式化和 I/O 由后台 QueueListener 完成。
+    记录的 args 在后台线程中才会格式化，不要把之后会被修改的可变对象作为日志参数传入。
+    队列已满时 INFO 及以下级别的记录直接丢弃，WARNING 及以上最多等待 block_timeout 秒，丢弃数按级别计数。
+    """
+
+    def __init__(self, log_queue: queue.Queue, block_timeout: float = 0.05):
+        super().__init__(log_queue)
+        self.block_timeout = block_timeout
+        self.enqueued = 0
+        self.dropped: Dict[str, int] = {}
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # 监听器在同一进程内，记录无需像默认实现那样复制并在调用方线程拼接消息、格式化异常，
+        # 原样交给后台线程即可 (exc_info 同样由后台线程的格式化器处理)
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            if record.levelno < logging.WARNING or self.block_timeout <= 0:
+                self._count_drop(record)
+                return
+            try:
+                self.queue.put(record, timeout=self.block_timeout)
+            except queue.Full:
+                self._count_drop(record)
+                return
+        self.enqueued += 1
+
+    def _count_drop(self, record: logging.LogRecord) -> None:
+        self.dropped[record.levelname] = self.dropped.get(record.levelname, 0) + 1
+
+
+class _LogQueueListener(logging.handlers.QueueListener):
+    """停止时阻塞放入结束标记，队列已满也能写完剩余记录"""
+
+    def enqueue_sentinel(self) -> None:
+        self.queue.put(self._sentinel)
+
+
+def build_queue_logging(
+    handlers, max_size: int = LOG_QUEUE_MAX_SIZE, block_timeout_ms: int = LOG_QUEUE_BLOCK_TIMEOUT_MS
+) -> Tuple[BoundedQueueHandler, logging.handlers.QueueListener]:
+    """创建有界队列处理器和在后台线程中驱动 handlers 的监听器（监听器需调用 start()）"""
+    log_queue = queue.Queue(maxsize=max(0, max_size))
+    queue_handler = BoundedQueueHandler(log_queue, block_timeout=block_timeout_ms / 1000)
+    listener = _LogQueueListener(log_queue, *handlers, respect_handler_level=True)
+    return queue_handler, listener
+
+
+_queue_handler: Optional[BoundedQueueHandler] = None
+_queue_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def shutdown_server_logging() -> None:
+    """停止后台日志线程，写完队列中剩余的记录并关闭处理器"""
+    global _queue_handler, _queue_listener
+    listener, _queue_listener = _queue_listener, None
+    _queue_handler = None
+    if listener is None:
+        return
+    listener.stop()
+    for handler in listener.handlers:
+        handler.close()
+
+
+def get_logging_stats() -> Dict[str, Any]:
+    """日志队列状态：当前积压、容量、已入队总数和按级别的丢弃数"""
+    handler = _queue_handler
+    if handler is None:
+        return {"enabled": False}
+    return {
+        "enabled": True,
+        "queued": handler.queue.qsize(),
+        "capacity": handler.queue.maxsize,
+        "enqueued": handler.enqueued,
+        "dropped": dict(handler.dropped),
+    }
 
 
 def setup_server_logging(
@@ -26,6 +114,7 @@ def setup_server_logging(
     Returns:
         Tuple[object, object]: 原始的stdout和stderr流
     """
+    global _queue_handler, _queue_listener
     log_level = getattr(logging, log_level_name.upper(), logging.INFO)
     redirect_print = redirect_print_str.lower() in ('true', '1', 'yes')
     
@@ -34,10 +123,14 @@ def setup_server_logging(
     os.makedirs(ACTIVE_AUTH_DIR, exist_ok=True)
     os.makedirs(SAVED_AUTH_DIR, exist_ok=True)
     
-    # 设置文件日志格式器
-    file_log_formatter = logging.Formatter('%(asctime)s - %(levelname)s - [%(name)s:%(funcName)s:%(lineno)d] - %(message)s')
+    # 设置文件日志格式器 (LOG_FORMAT=json 时每条日志一行 JSON)
+    if LOG_FORMAT == 'json':
+        file_log_formatter = JsonLinesFormatter()
+    else:
+        file_log_formatter = logging.Formatter('%(asctime)s - %(levelname)s - [%(name)s:%(funcName)s:%(lineno)d] - %(message)s')
     
-    # 清理现有的处理器
+    # 清理现有的处理器（重复初始化时先停止之前的后台日志线程）
+    shutdown_server_logging()
     if logger_instance.hasHandlers():
         logger_instance.handlers.clear()
     logger_instance.setLevel(log_level)
@@ -55,7 +148,7 @@ def setup_server_logging(
         APP_LOG_FILE_PATH, maxBytes=5*1024*1024, backupCount=5, encoding='utf-8', mode='w'
     )
     file_handler.setFormatter(file_log_formatter)
-    logger_instance.addHandler(file_handler)
+    handlers = [file_handler]
     
     # 添加WebSocket处理器
     if log_ws_manager is None:
@@ -63,14 +156,19 @@ def setup_server_logging(
     else:
         ws_handler = WebSocketLogHandler(log_ws_manager)
         ws_handler.setLevel(logging.INFO)
-        logger_instance.addHandler(ws_handler)
+        handlers.append(ws_handler)
     
     # 添加控制台处理器
     console_server_log_formatter = logging.Formatter('%(asctime)s - %(levelname)s [SERVER] - %(message)s')
     console_handler = logging.StreamHandler(sys.stderr)
     console_handler.setFormatter(console_server_log_formatter)
     console_handler.setLevel(log_level)
-    logger_instance.addHandler(console_handler)
+    handlers.append(console_handler)
+    
+    # 所有处理器在后台线程中运行，事件循环上的日志调用只做入队
+    _queue_handler, _queue_listener = build_queue_logging(handlers)
+    logger_instance.addHandler(_queue_handler)
+    _queue_listener.start()
     
     # 保存原始流
     original_stdout = sys.stdout
@@ -98,11 +196,19 @@ def setup_server_logging(
     logging.getLogger("playwright").setLevel(logging.WARNING)
     logging.getLogger("asyncio").setLevel(logging.ERROR)
     
+    # 按模块设置子日志器级别 (LOG_MODULE_LEVELS)
+    module_levels = apply_module_log_levels()
+    
     # 记录初始化信息
     logger_instance.info("=" * 5 + " AIStudioProxyServer 日志系统已在 lifespan 中初始化 " + "=" * 5)
     logger_instance.info(f"日志级别设置为: {logging.getLevelName(log_level)}")
-    logger_instance.info(f"日志文件路径: {APP_LOG_FILE_PATH}")
+    logger_instance.info(f"日志文件路径: {APP_LOG_FILE_PATH} (格式: {LOG_FORMAT})")
+    if module_levels:
+        logger_instance.info(f"模块日志级别: {', '.join(f'{name}={logging.getLevelName(level)}' for name, level in module_levels.items())}")
+    if LOG_TRACE_SAMPLE_RATE > 0:
+        logger_instance.info(f"请求追踪采样率: {LOG_TRACE_SAMPLE_RATE:.2%}")
     logger_instance.info(f"控制台日志处理器已添加。")
+    logger_instance.info(f"日志处理器在后台线程中运行 (队列容量: {LOG_QUEUE_MAX_SIZE or '无限制'})。")
     logger_instance.info(f"Print 重定向 (由 SERVER_REDIRECT_PRINT 环境变量控制): {'启用' if redirect_print else '禁用'}")
     
     return original_stdout, original_stderr
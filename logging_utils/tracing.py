@@ -0,0 +1,97 @@
+"""
+结构化日志与采样追踪
+- JsonLinesFormatter: 每条记录输出一行 JSON，包含 req_id、stage、elapsed_ms 等字段，便于按请求检索
+- trace(): 热路径上的调试日志，只有请求被采样且对应日志器启用 DEBUG 时才创建记录，参数延迟格式化
+- 请求采样按 req_id 的哈希决定 (LOG_TRACE_SAMPLE_RATE)，同一请求在不同任务中的判定一致；
+  DEBUG_LOGS_ENABLED 为 true 时追踪所有请求
+- apply_module_log_levels(): 按 LOG_MODULE_LEVELS 为 AIStudioProxyServer 下的子日志器设置级别
+"""
+
+import datetime
+import json
+import logging
+import re
+import zlib
+from typing import Dict
+
+from config import DEBUG_LOGS_ENABLED, LOG_TRACE_SAMPLE_RATE, LOG_MODULE_LEVELS
+
+ROOT_LOGGER_NAME = "AIStudioProxyServer"
+# 由 trace() 写入记录的结构化字段
+STRUCTURED_FIELDS = ("req_id", "stage", "elapsed_ms")
+# 普通日志消息以 "[req_id]" 开头，JSON 输出时从消息中提取
+_REQ_ID_PREFIX = re.compile(r"^\[([a-z0-9]{7})\]")
+_SAMPLE_BUCKETS = 10000
+
+
+def get_module_logger(module_name: str) -> logging.Logger:
+    """模块专用的子日志器（如 browser_utils.operations），可通过 LOG_MODULE_LEVELS 单独设置级别"""
+    return logging.getLogger(f"{ROOT_LOGGER_NAME}.{module_name}")
+
+
+def parse_module_levels(spec: str) -> Dict[str, int]:
+    """解析 "browser_utils.operations=DEBUG,api_utils=WARNING" 形式的配置，忽略无法识别的项"""
+    levels = {}
+    for item in spec.split(","):
+        module_name, _, level_name = item.partition("=")
+        level = logging.getLevelName(level_name.strip().upper())
+        if module_name.strip() and isinstance(level, int):
+            levels[module_name.strip()] = level
+    return levels
+
+
+def apply_module_log_levels(spec: str = LOG_MODULE_LEVELS) -> Dict[str, int]:
+    levels = parse_module_levels(spec)
+    for module_name, level in levels.items():
+        get_module_logger(module_name).setLevel(level)
+    return levels
+
+
+def is_request_sampled(req_id: str, rate: float = LOG_TRACE_SAMPLE_RATE) -> bool:
+    """请求是否被采样追踪（按 req_id 哈希判定，结果稳定）"""
+    if DEBUG_LOGS_ENABLED or rate >= 1:
+        return True
+    if rate <= 0 or not req_id:
+        return False
+    return zlib.crc32(req_id.encode()) % _SAMPLE_BUCKETS < rate * _SAMPLE_BUCKETS
+
+
+def trace(logger: logging.Logger, req_id: str, stage: str, msg: str, *args, elapsed_ms: float = None) -> None:
+    """
+    记录请求的追踪日志。未被采样或日志器未启用 DEBUG 时直接返回，不会格式化 msg % args。
+    文本格式下消息以 "[req_id]" 开头，与普通日志一致。
+    """
+    if not is_request_sampled(req_id) or not logger.isEnabledFor(logging.DEBUG):
+        return
+    extra = {"req_id": req_id, "stage": stage}
+    if elapsed_ms is not None:
+        extra["elapsed_ms"] = round(elapsed_ms, 1)
+    logger.debug("[%s] " + msg, req_id, *args, extra=extra, stacklevel=2)
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """每条日志一行 JSON"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        message = record.getMessage()
+        entry = {
+            "ts": datetime.datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "func": record.funcName,
+            "line": record.lineno,
+        }
+        for field in STRUCTURED_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if "req_id" not in entry:
+            match = _REQ_ID_PREFIX.match(message)
+            if match:
+                entry["req_id"] = match.group(1)
+        entry["msg"] = message
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
@@ -1,5 +1,5 @@
 from typing import List, Optional, Union
-from pydantic import BaseModel
+from pydantic import BaseModel, PrivateAttr
 from config import MODEL_NAME
 
 
@@ -34,4 +34,14 @@ class ChatCompletionRequest(BaseModel):
     temperature: Optional[float] = None
     max_output_tokens: Optional[int] = None
     stop: Optional[Union[str, List[str]]] = None
-    top_p: Optional[float] = None 
\ No newline at end of file
+    top_p: Optional[float] = None
+    # SSE 输出合并策略 (为空时使用全局配置，stream_flush_bytes=0 表示逐事件输出)
+    stream_flush_bytes: Optional[int] = None
+    stream_flush_interval_ms: Optional[int] = None
+    # 最长排队等待时间 (秒)，预计无法在此时间内开始处理时立即返回 503 (为空时使用全局配置)
+    max_queue_wait_seconds: Optional[float] = None
+
+    # prompt token 估算缓存 (由 api_utils.utils.estimate_prompt_tokens 填充)
+    _prompt_tokens: Optional[int] = PrivateAttr(default=None)
+    # 规范化缓存键 (由 api_utils.response_cache.compute_request_cache_key 填充)
+    _cache_key: Optional[str] = PrivateAttr(default=None) 
\ No newline at end of file
@@ -1,3 +1,8 @@
 class ClientDisconnectedError(Exception):
     """客户端断开连接异常"""
+    pass
+
+
+class PageFailoverError(Exception):
+    """处理请求时页面失效（正在或已经切换到备用页面），请求需要重新排队"""
     pass 
\ No newline at end of file
@@ -3,9 +3,12 @@ import datetime
 import json
 import logging
 import sys
-from typing import Dict
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
 from fastapi import WebSocket, WebSocketDisconnect
 
+from config import LOG_WS_BUFFER_SIZE, LOG_WS_FLUSH_INTERVAL_MS
+
 
 class StreamToLogger:
     def __init__(self, logger_instance, log_level=logging.INFO):
@@ -37,15 +40,45 @@ class StreamToLogger:
         return False
 
 
+class _LogClient:
+    """单个日志客户端的发送队列：满时丢弃最旧的记录并计入 lagged"""
+
+    def __init__(self, websocket: WebSocket, queue_size: int):
+        self.websocket = websocket
+        self.queue: Deque[str] = deque(maxlen=max(1, queue_size))
+        self.ready = asyncio.Event()
+        self.lagged = 0
+        self.unreported_lag = 0
+        self.task: Optional[asyncio.Task] = None
+
+    def push(self, records: List[str]) -> None:
+        overflow = len(self.queue) + len(records) - self.queue.maxlen
+        if overflow > 0:
+            self.lagged += overflow
+            self.unreported_lag += overflow
+        self.queue.extend(records)
+        self.ready.set()
+
+
 class WebSocketConnectionManager:
-    def __init__(self):
-        self.active_connections: Dict[str, WebSocket] = {}
+    """
+    日志 WebSocket 广播：日志线程只把记录追加到有界环形缓冲区，
+    单个广播任务每隔 flush_interval_ms 取出缓冲区中的记录分发到各客户端的发送队列，
+    每个客户端由各自的发送任务把积压的记录合并为一帧发送，慢客户端只会丢弃自己队列中最旧的记录。
+    """
+
+    def __init__(self, buffer_size: int = LOG_WS_BUFFER_SIZE, flush_interval_ms: int = LOG_WS_FLUSH_INTERVAL_MS):
+        self.active_connections: Dict[str, _LogClient] = {}
+        self.buffer_size = max(1, buffer_size)
+        self.flush_interval = max(1, flush_interval_ms) / 1000
+        self._buffer: Deque[str] = deque(maxlen=self.buffer_size)
+        self._broadcaster: Optional[asyncio.Task] = None
+        self.published = 0
+        self.dropped = 0
 
     async def connect(self, client_id: str, websocket: WebSocket):
         await websocket.accept()
-        self.active_connections[client_id] = websocket
         logger = logging.getLogger("AIStudioProxyServer")
-        logger.info(f"WebSocket 日志客户端已连接: {client_id}")
         try:
             await websocket.send_text(json.dumps({
                 "type": "connection_status",
@@ -55,38 +88,79 @@ class WebSocketConnectionManager:
             }))
         except Exception as e:
             logger.warning(f"向 WebSocket 客户端 {client_id} 发送欢迎消息失败: {e}")
+        client = _LogClient(websocket, self.buffer_size)
+        client.task = asyncio.create_task(self._send_loop(client_id, client))
+        self.active_connections[client_id] = client
+        if self._broadcaster is None or self._broadcaster.done():
+            self._broadcaster = asyncio.create_task(self._broadcast_loop())
+        logger.info(f"WebSocket 日志客户端已连接: {client_id}")
 
     def disconnect(self, client_id: str):
-        if client_id in self.active_connections:
-            del self.active_connections[client_id]
-            logger = logging.getLogger("AIStudioProxyServer")
-            logger.info(f"WebSocket 日志客户端已断开: {client_id}")
+        client = self.active_connections.pop(client_id, None)
+        if client is None:
+            return
+        if client.task is not None and client.task is not asyncio.current_task():
+            client.task.cancel()
+        logger = logging.getLogger("AIStudioProxyServer")
+        logger.info(f"WebSocket 日志客户端已断开: {client_id}")
 
-    async def broadcast(self, message: str):
+    def publish(self, message: str) -> None:
+        """追加一条日志记录（可在任意线程调用）；缓冲区满时丢弃最旧的记录"""
         if not self.active_connections:
             return
-        disconnected_clients = []
-        active_conns_copy = list(self.active_connections.items())
+        if len(self._buffer) >= self.buffer_size:
+            self.dropped += 1
+        self._buffer.append(message)
+        self.published += 1
+
+    async def _broadcast_loop(self):
+        while self.active_connections:
+            await asyncio.sleep(self.flush_interval)
+            pending = len(self._buffer)
+            if not pending:
+                continue
+            records = [self._buffer.popleft() for _ in range(pending)]
+            for client in list(self.active_connections.values()):
+                client.push(records)
+        self._buffer.clear()
+
+    async def _send_loop(self, client_id: str, client: _LogClient):
         logger = logging.getLogger("AIStudioProxyServer")
-        for client_id, connection in active_conns_copy:
+        while True:
+            await client.ready.wait()
+            client.ready.clear()
+            records = list(client.queue)
+            client.queue.clear()
+            if not records:
+                continue
+            frame = {"type": "log_batch", "records": records}
+            if client.unreported_lag:
+                frame["lagged"] = client.unreported_lag
+                client.unreported_lag = 0
             try:
-                await connection.send_text(message)
+                await client.websocket.send_text(json.dumps(frame, ensure_ascii=False))
             except WebSocketDisconnect:
                 logger.info(f"[WS Broadcast] 客户端 {client_id} 在广播期间断开连接。")
-                disconnected_clients.append(client_id)
             except RuntimeError as e:
-                 if "Connection is closed" in str(e):
-                     logger.info(f"[WS Broadcast] 客户端 {client_id} 的连接已关闭。")
-                     disconnected_clients.append(client_id)
-                 else:
-                     logger.error(f"广播到 WebSocket {client_id} 时发生运行时错误: {e}")
-                     disconnected_clients.append(client_id)
+                if "Connection is closed" in str(e):
+                    logger.info(f"[WS Broadcast] 客户端 {client_id} 的连接已关闭。")
+                else:
+                    logger.error(f"广播到 WebSocket {client_id} 时发生运行时错误: {e}")
             except Exception as e:
                 logger.error(f"广播到 WebSocket {client_id} 时发生未知错误: {e}")
-                disconnected_clients.append(client_id)
-        if disconnected_clients:
-             for client_id_to_remove in disconnected_clients:
-                 self.disconnect(client_id_to_remove)
+            else:
+                continue
+            self.disconnect(client_id)
+            return
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "clients": len(self.active_connections),
+            "buffered": len(self._buffer),
+            "published": self.published,
+            "dropped": self.dropped,
+            "lagged": {client_id: client.lagged for client_id, client in self.active_connections.items()},
+        }
 
 
 class WebSocketLogHandler(logging.Handler):
@@ -96,13 +170,9 @@ class WebSocketLogHandler(logging.Handler):
         self.formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
 
     def emit(self, record: logging.LogRecord):
+        # emit 在后台日志线程中调用，只追加到管理器的缓冲区，由事件循环上的广播任务批量发送
         if self.manager and self.manager.active_connections:
             try:
-                log_entry_str = self.format(record)
-                try:
-                     current_loop = asyncio.get_running_loop()
-                     current_loop.create_task(self.manager.broadcast(log_entry_str))
-                except RuntimeError:
-                     pass
+                self.manager.publish(self.format(record))
             except Exception as e:
                 print(f"WebSocketLogHandler 错误: 广播日志失败 - {e}", file=sys.__stderr__) 
\ No newline at end of file
@@ -1,97 +1,69 @@
 import asyncio
 import multiprocessing
-import random
-import time
-import json
-from typing import List, Optional, Dict, Any, Union, AsyncGenerator, Tuple, Callable, Set
+import importlib
+from typing import List, Optional, Dict, Any, Set, TYPE_CHECKING
 import os
-import traceback
-from contextlib import asynccontextmanager
-import sys
-import platform
 import logging
-import logging.handlers
-import socket # 保留 socket 以便在 __main__ 中进行简单的直接运行提示
-from asyncio import Queue, Lock, Future, Task, Event
-
-from fastapi import FastAPI, Request, HTTPException
-from fastapi.responses import JSONResponse, StreamingResponse, FileResponse
-from fastapi import WebSocket, WebSocketDisconnect
-from pydantic import BaseModel
-from playwright.async_api import Page as AsyncPage, Browser as AsyncBrowser, Playwright as AsyncPlaywright, Error as PlaywrightAsyncError, expect as expect_async, BrowserContext as AsyncBrowserContext, Locator, TimeoutError
-from playwright.async_api import async_playwright
-from urllib.parse import urljoin, urlparse
-import uuid
-import datetime
-import aiohttp
-import stream
-import queue
+from asyncio import Queue, Lock, Task
 
 # --- 配置模块导入 ---
 from config import *
 
-# --- models模块导入 ---
-from models import (
-    FunctionCall,
-    ToolCall,
-    MessageContentItem, 
-    Message,
-    ChatCompletionRequest,
-    ClientDisconnectedError,
-    StreamToLogger,
-    WebSocketConnectionManager,
-    WebSocketLogHandler
-)
-
-# --- logging_utils模块导入 ---
-from logging_utils import setup_server_logging, restore_original_streams
-
-# --- browser_utils模块导入 ---
-from browser_utils import (
-    _initialize_page_logic,
-    _close_page_logic,
-    signal_camoufox_shutdown,
-    _handle_model_list_response,
-    detect_and_extract_page_error,
-    save_error_snapshot,
-    get_response_via_edit_button,
-    get_response_via_copy_button,
-    _wait_for_response_completion,
-    _get_final_response_content,
-    get_raw_text_content,
-    switch_ai_studio_model,
-    load_excluded_models,
-    _handle_initial_model_state_and_storage,
-    _set_model_from_page_display
-)
-
 # --- api_utils模块导入 ---
-from api_utils import (
-    generate_sse_chunk,
-    generate_sse_stop_chunk, 
-    generate_sse_error_chunk,
-    use_helper_get_response,
-    use_stream_response,
-    clear_stream_queue,
-    prepare_combined_prompt,
-    validate_chat_request,
-    _process_request_refactored,
-    create_app,
-    queue_worker
-)
+# 只导入创建应用和 lifespan 需要的名称，其余辅助函数通过模块级 __getattr__ 按需加载
+from api_utils import create_app, queue_worker, run_uvicorn
+
+if TYPE_CHECKING:
+    from playwright.async_api import Page as AsyncPage, Browser as AsyncBrowser, Playwright as AsyncPlaywright
+
+# 为兼容旧代码保留的再导出名称（名称 -> 所在模块），首次访问时才导入
+_LAZY_EXPORTS = {
+    **dict.fromkeys((
+        'FunctionCall', 'ToolCall', 'MessageContentItem', 'Message', 'ChatCompletionRequest',
+        'ClientDisconnectedError', 'StreamToLogger', 'WebSocketConnectionManager', 'WebSocketLogHandler'
+    ), 'models'),
+    **dict.fromkeys(('setup_server_logging', 'restore_original_streams'), 'logging_utils'),
+    **dict.fromkeys((
+        '_initialize_page_logic', '_close_page_logic', 'signal_camoufox_shutdown',
+        '_handle_model_list_response', 'detect_and_extract_page_error', 'save_error_snapshot',
+        'get_response_via_edit_button', 'get_response_via_copy_button', '_wait_for_response_completion',
+        '_get_final_response_content', 'get_raw_text_content', 'switch_ai_studio_model',
+        'load_excluded_models', '_handle_initial_model_state_and_storage', '_set_model_from_page_display'
+    ), 'browser_utils'),
+    **dict.fromkeys((
+        'generate_sse_chunk', 'generate_sse_stop_chunk', 'generate_sse_error_chunk',
+        'use_helper_get_response', 'use_stream_response', 'clear_stream_queue',
+        'prepare_combined_prompt', 'validate_chat_request', '_process_request_refactored'
+    ), 'api_utils'),
+}
+
+
+def __getattr__(name: str) -> Any:
+    module_name = _LAZY_EXPORTS.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module_name), name)
+    globals()[name] = value
+    return value
 
 # --- stream queue ---
 STREAM_QUEUE:Optional[multiprocessing.Queue] = None
 STREAM_PROCESS = None
 
 # --- Global State ---
-playwright_manager: Optional[AsyncPlaywright] = None
-browser_instance: Optional[AsyncBrowser] = None
-page_instance: Optional[AsyncPage] = None
+playwright_manager: Optional["AsyncPlaywright"] = None
+browser_instance: Optional["AsyncBrowser"] = None
+page_instance: Optional["AsyncPage"] = None
 is_playwright_ready = False
 is_browser_connected = False
 is_page_ready = False
 is_initializing = False
+# 后台启动任务、启动失败原因和各启动阶段耗时 (毫秒)，在 lifespan 中设置
+startup_task: Optional[Task] = None
+startup_error: Optional[str] = None
+# 通过 run_uvicorn() 启动时的 uvicorn.Server，启动失败时用于请求停止服务
+uvicorn_server = None
+startup_timings: Dict[str, float] = {}
 
 # --- 全局代理配置 ---
 PLAYWRIGHT_PROXY_SETTINGS: Optional[Dict[str, str]] = None
@@ -108,10 +80,27 @@ excluded_model_ids: Set[str] = set()
 request_queue: Optional[Queue] = None
 processing_lock: Optional[Lock] = None
 worker_task: Optional[Task] = None
+# 模型列表后台刷新任务 (MODEL_LIST_REFRESH_INTERVAL_SECONDS > 0 时在 lifespan 中启动)
+model_list_refresh_task: Optional[Task] = None
 
 page_params_cache: Dict[str, Any] = {}
 params_cache_lock: Optional[Lock] = None
 
+# 响应缓存 (RESPONSE_CACHE_ENABLED 时在 lifespan 中创建)
+response_cache = None
+# 相同请求合并 (REQUEST_COALESCING_ENABLED 时在 lifespan 中创建)
+request_coalescer = None
+# 页面故障检测与备用页面切换 (PAGE_FAILOVER_ENABLED 时在页面就绪后创建)
+page_supervisor = None
+# 按账号/模型的令牌桶与配额冷却状态
+rate_limiter = None
+# 按服务时间估算排队等待的准入控制
+admission_controller = None
+# 持久化异步任务的调度器 (未配置 JOBS_DB_PATH 时为 None)
+job_runner = None
+# 批处理 (/v1/batches) 管理器，随异步任务一起启用
+batch_manager = None
+
 logger = logging.getLogger("AIStudioProxyServer")
 log_ws_manager = None
 
@@ -121,9 +110,8 @@ app = create_app()
 
 # --- Main Guard ---
 if __name__ == "__main__":
-    import uvicorn
     port = int(os.environ.get("PORT", 2048))
-    uvicorn.run(
+    run_uvicorn(
         "server:app",
         host="0.0.0.0",
         port=port,
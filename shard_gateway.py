@@ -0,0 +1,361 @@
+"""
+多账号分片网关
+单个代理服务实例只能驱动一个 Google 账号和一个浏览器页面。分片网关把请求分发到多个独立运行的
+代理服务实例（每个实例使用 auth_profiles/active 中各自的认证文件和各自的 Camoufox 浏览器，
+可以在同一台或多台机器上），吞吐量随账号数量线性增加。
+
+路由策略:
+    least_loaded       选择 (网关在途请求数 + 分片队列长度) 最小的健康分片
+    conversation_hash  按对话 (user 字段，或 system 消息与首条 user 消息) 一致性哈希到固定分片，
+                       分片不健康时顺延到哈希环上的下一个分片
+
+各分片的 /health 定期检查，转发时连接失败或返回 429/503 的分片会被跳过并尝试下一个分片。
+
+用法:
+    python shard_gateway.py --backends http://127.0.0.1:2101,http://127.0.0.1:2102 --port 2048
+    python shard_gateway.py --routing conversation_hash   # 分片地址从 SHARD_BACKENDS 读取
+"""
+
+import argparse
+import asyncio
+import bisect
+import hashlib
+import itertools
+import json
+import logging
+import os
+import sys
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncGenerator, Dict, List, Optional
+
+import aiohttp
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+from config import SHARD_BACKENDS, SHARD_ROUTING, SHARD_HEALTH_INTERVAL_SECONDS
+
+logger = logging.getLogger("ShardGateway")
+
+DEFAULT_GATEWAY_PORT = int(os.environ.get('DEFAULT_FASTAPI_PORT', '2048'))
+
+ROUTING_POLICIES = ("least_loaded", "conversation_hash")
+# 每个分片在哈希环上的虚拟节点数
+_RING_REPLICAS = 64
+# 分片返回这些状态码时请求尚未被处理，可以改投下一个分片
+_RETRYABLE_STATUS_CODES = (429, 503)
+_HOP_BY_HOP_HEADERS = {
+    'connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization', 'te', 'trailers',
+    'transfer-encoding', 'upgrade', 'host', 'content-length', 'content-encoding'
+}
+
+
+def _hash_point(value: str) -> int:
+    return int.from_bytes(hashlib.md5(value.encode('utf-8')).digest()[:8], 'big')
+
+
+def _forward_headers(headers) -> Dict[str, str]:
+    return {k: v for k, v in headers.items() if k.lower() not in _HOP_BY_HOP_HEADERS}
+
+
+def conversation_key(body: Dict[str, Any]) -> str:
+    """对话路由键：优先使用 user 字段，否则取 system 消息和首条 user 消息（多轮对话中保持不变）"""
+    user = body.get("user")
+    if isinstance(user, str) and user:
+        return f"user:{user}"
+    parts = []
+    for message in body.get("messages") or []:
+        if not isinstance(message, dict):
+            continue
+        if message.get("role") == "system" and not parts:
+            parts.append(json.dumps(message.get("content"), ensure_ascii=False, sort_keys=True))
+        elif message.get("role") == "user":
+            parts.append(json.dumps(message.get("content"), ensure_ascii=False, sort_keys=True))
+            break
+    return "\n".join(parts)
+
+
+class ShardBackend:
+    """一个分片（独立运行的代理服务实例）及其健康状态"""
+
+    def __init__(self, url: str):
+        self.url = url.rstrip('/')
+        self.healthy = False
+        self.inflight = 0
+        self.queue_length = 0
+        self.total_requests = 0
+        self.consecutive_failures = 0
+        self.last_error: Optional[str] = None
+        self.last_check: Optional[float] = None
+        self.last_latency_ms: Optional[float] = None
+
+    @property
+    def load(self) -> int:
+        return self.inflight + self.queue_length
+
+    def mark_failure(self, error: str) -> None:
+        if self.healthy:
+            logger.warning(f"分片 {self.url} 标记为不健康: {error}")
+        self.healthy = False
+        self.consecutive_failures += 1
+        self.last_error = error
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "inflight": self.inflight,
+            "queueLength": self.queue_length,
+            "totalRequests": self.total_requests,
+            "consecutiveFailures": self.consecutive_failures,
+            "lastError": self.last_error,
+            "lastCheckAgeSeconds": round(time.time() - self.last_check, 1) if self.last_check else None,
+            "lastLatencyMs": self.last_latency_ms,
+        }
+
+
+class ShardRouter:
+    """按路由策略选择分片、定期检查分片健康状态并转发请求"""
+
+    def __init__(self, urls: List[str], policy: str = "least_loaded", health_interval: float = 5.0):
+        if not urls:
+            raise ValueError("至少需要一个分片地址 (--backends 或 SHARD_BACKENDS)。")
+        if policy not in ROUTING_POLICIES:
+            raise ValueError(f"未知的路由策略 '{policy}'，可选: {', '.join(ROUTING_POLICIES)}")
+        self.backends = [ShardBackend(url) for url in urls]
+        self.policy = policy
+        self.health_interval = health_interval
+        ring = sorted(
+            (_hash_point(f"{backend.url}#{replica}"), index)
+            for index, backend in enumerate(self.backends)
+            for replica in range(_RING_REPLICAS)
+        )
+        self._ring_points = [point for point, _ in ring]
+        self._ring_backends = [index for _, index in ring]
+        self._rotation = itertools.count()
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._health_task: Optional[asyncio.Task] = None
+
+    # --- 生命周期 ---
+    async def start(self) -> None:
+        self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=None, sock_connect=5))
+        await self.check_all()
+        self._health_task = asyncio.create_task(self._health_loop())
+
+    async def close(self) -> None:
+        if self._health_task is not None:
+            self._health_task.cancel()
+            try:
+                await self._health_task
+            except asyncio.CancelledError:
+                pass
+        if self._session is not None:
+            await self._session.close()
+
+    # --- 健康检查 ---
+    async def check_backend(self, backend: ShardBackend) -> None:
+        started = time.perf_counter()
+        try:
+            async with self._session.get(f"{backend.url}/health", timeout=aiohttp.ClientTimeout(total=5)) as resp:
+                payload = await resp.json(content_type=None)
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            backend.last_check = time.time()
+            backend.mark_failure(f"健康检查失败: {e!r}")
+            return
+        backend.last_check = time.time()
+        backend.last_latency_ms = round((time.perf_counter() - started) * 1000, 1)
+        details = payload.get("details", {}) if isinstance(payload, dict) else {}
+        backend.queue_length = max(0, int(details.get("queueLength") or 0))
+        if resp.status == 200:
+            if not backend.healthy:
+                logger.info(f"分片 {backend.url} 已就绪 (队列长度: {backend.queue_length})。")
+            backend.healthy = True
+            backend.consecutive_failures = 0
+            backend.last_error = None
+        else:
+            backend.mark_failure(f"/health 返回 {resp.status}: {payload.get('message') if isinstance(payload, dict) else payload}")
+
+    async def check_all(self) -> None:
+        await asyncio.gather(*(self.check_backend(backend) for backend in self.backends))
+
+    async def _health_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.health_interval)
+            await self.check_all()
+
+    # --- 路由 ---
+    def candidates(self, body: Optional[Dict[str, Any]] = None) -> List[ShardBackend]:
+        """按路由策略排列的候选分片，健康分片在前，不健康的分片作为最后的尝试"""
+        key = conversation_key(body) if body and self.policy == "conversation_hash" else ""
+        if key:
+            start = bisect.bisect(self._ring_points, _hash_point(key)) % len(self._ring_points)
+            ordered = []
+            for offset in range(len(self._ring_backends)):
+                backend = self.backends[self._ring_backends[(start + offset) % len(self._ring_backends)]]
+                if backend not in ordered:
+                    ordered.append(backend)
+                    if len(ordered) == len(self.backends):
+                        break
+        else:
+            # 负载相同时轮转起点，避免总是选中第一个分片
+            rotation = next(self._rotation) % len(self.backends)
+            rotated = self.backends[rotation:] + self.backends[:rotation]
+            ordered = sorted(rotated, key=lambda backend: backend.load)
+        return [b for b in ordered if b.healthy] + [b for b in ordered if not b.healthy]
+
+    # --- 转发 ---
+    async def forward(self, request: Request, path: str, body: Optional[Dict[str, Any]] = None) -> Response:
+        """转发请求到候选分片，连接失败或分片繁忙/不可用时改投下一个分片"""
+        content = await request.body()
+        headers = _forward_headers(request.headers)
+        last_response: Optional[Response] = None
+        last_error = None
+
+        for backend in self.candidates(body):
+            backend.inflight += 1
+            try:
+                resp = await self._session.request(
+                    request.method, f"{backend.url}{path}", data=content, headers=headers,
+                    params=request.query_params
+                )
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                backend.inflight -= 1
+                backend.mark_failure(f"转发失败: {e!r}")
+                last_error = e
+                continue
+
+            backend.total_requests += 1
+            response_headers = _forward_headers(resp.headers)
+            if resp.status in _RETRYABLE_STATUS_CODES:
+                last_response = Response(content=await resp.read(), status_code=resp.status, headers=response_headers)
+                resp.release()
+                backend.inflight -= 1
+                logger.info(f"分片 {backend.url} 返回 {resp.status}，尝试下一个分片。")
+                continue
+
+            if resp.content_type == "text/event-stream":
+                return StreamingResponse(
+                    self._relay_stream(backend, resp), status_code=resp.status,
+                    headers=response_headers, media_type=resp.content_type
+                )
+            try:
+                payload = await resp.read()
+            finally:
+                resp.release()
+                backend.inflight -= 1
+            return Response(content=payload, status_code=resp.status, headers=response_headers)
+
+        if last_response is not None:
+            return last_response
+        return JSONResponse(
+            status_code=503,
+            content={"error": {"message": f"没有可用的分片: {last_error!r}", "type": "server_error", "code": "no_available_shard"}},
+            headers={"Retry-After": "10"}
+        )
+
+    async def _relay_stream(self, backend: ShardBackend, resp: aiohttp.ClientResponse) -> AsyncGenerator[bytes, None]:
+        # 客户端断开时生成器被关闭，随之关闭上游连接，分片据此取消请求
+        try:
+            async for chunk in resp.content.iter_any():
+                yield chunk
+        finally:
+            resp.release()
+            backend.inflight -= 1
+
+    async def broadcast_json(self, method: str, path: str, headers) -> Dict[str, Any]:
+        """向所有分片发送同一请求，返回 {分片地址: (状态码, JSON 内容)}"""
+        async def call(backend: ShardBackend):
+            try:
+                async with self._session.request(method, f"{backend.url}{path}", headers=headers,
+                                                 timeout=aiohttp.ClientTimeout(total=10)) as resp:
+                    return backend.url, (resp.status, await resp.json(content_type=None))
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                return backend.url, (502, {"error": repr(e)})
+
+        return dict(await asyncio.gather(*(call(backend) for backend in self.backends)))
+
+    def stats(self) -> Dict[str, Any]:
+        return {"routing": self.policy, "backends": [backend.stats() for backend in self.backends]}
+
+
+def create_gateway_app(router: ShardRouter) -> FastAPI:
+    """创建分片网关应用：对外提供与单实例相同的 OpenAI 兼容接口"""
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        await router.start()
+        healthy = sum(1 for backend in router.backends if backend.healthy)
+        logger.info(f"分片网关已启动: {healthy}/{len(router.backends)} 个分片健康，路由策略: {router.policy}")
+        try:
+            yield
+        finally:
+            await router.close()
+
+    app = FastAPI(title="AI Studio Proxy Shard Gateway", lifespan=lifespan)
+
+    @app.get("/health")
+    async def health():
+        stats = router.stats()
+        healthy = sum(1 for backend in router.backends if backend.healthy)
+        status = {
+            "status": "OK" if healthy else "Error",
+            "message": f"{healthy}/{len(router.backends)} 个分片健康。",
+            "details": {**stats, "queueLength": sum(backend.load for backend in router.backends)},
+        }
+        return JSONResponse(content=status, status_code=200 if healthy else 503)
+
+    @app.get("/v1/models")
+    async def list_models(request: Request):
+        return await router.forward(request, "/v1/models")
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        try:
+            body = json.loads(await request.body() or b'{}')
+        except ValueError:
+            body = {}
+        return await router.forward(request, "/v1/chat/completions", body if isinstance(body, dict) else {})
+
+    @app.post("/v1/cancel/{req_id}")
+    async def cancel_request(req_id: str, request: Request):
+        # 请求 ID 由分片生成，网关不记录归属，依次询问所有分片
+        results = await router.broadcast_json("POST", f"/v1/cancel/{req_id}", _forward_headers(request.headers))
+        for status_code, payload in results.values():
+            if status_code == 200:
+                return JSONResponse(content=payload)
+        return JSONResponse(status_code=404, content={"success": False, "message": f"Request {req_id} not found in any shard queue."})
+
+    @app.get("/v1/queue")
+    async def queue_status(request: Request):
+        results = await router.broadcast_json("GET", "/v1/queue", _forward_headers(request.headers))
+        return JSONResponse(content={
+            "routing": router.policy,
+            "shards": {url: payload for url, (_, payload) in results.items()},
+        })
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="AI Studio 代理多账号分片网关")
+    parser.add_argument("--backends", default=",".join(SHARD_BACKENDS),
+                        help="逗号分隔的分片服务地址，例如 http://127.0.0.1:2101,http://10.0.0.2:2048 (默认: SHARD_BACKENDS)")
+    parser.add_argument("--routing", choices=ROUTING_POLICIES, default=SHARD_ROUTING, help="路由策略")
+    parser.add_argument("--health-interval", type=float, default=SHARD_HEALTH_INTERVAL_SECONDS, help="分片健康检查间隔 (秒)")
+    parser.add_argument("--host", default="0.0.0.0", help="网关监听地址")
+    parser.add_argument("--port", type=int, default=DEFAULT_GATEWAY_PORT, help="网关监听端口")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s [%(name)s] - %(message)s', stream=sys.stderr)
+    backends = [url.strip() for url in args.backends.split(',') if url.strip()]
+    try:
+        router = ShardRouter(backends, args.routing, args.health_interval)
+    except ValueError as e:
+        parser.error(str(e))
+
+    import uvicorn
+    uvicorn.run(create_gateway_app(router), host=args.host, port=args.port, log_level="info")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+import json
+import struct
+
+# Frame layout (network byte order): version, flags, reason length, body length, extra length,
+# followed by the UTF-8 reason text, the UTF-8 body text and, only when present, a JSON object
+# with the remaining keys (function calls, summary, error)
+FRAME_VERSION = 1
+FLAG_DONE = 0x01
+_HEADER = struct.Struct('!BBIII')
+
+# Keys carried in the fixed part of the frame; everything else goes to the JSON extra section
+_FIXED_KEYS = ("reason", "body", "done")
+
+
+def encode_message(message):
+    """
+    Encode one proxy message ({"reason", "body", "function", "done", ...}) into a frame.
+    The text deltas are copied as raw UTF-8, so the common case needs no JSON encoding at all
+    """
+    reason = message.get("reason", "").encode('utf-8')
+    body = message.get("body", "").encode('utf-8')
+    extra = {key: value for key, value in message.items() if key not in _FIXED_KEYS and value}
+    extra_data = json.dumps(extra, ensure_ascii=False, separators=(',', ':')).encode('utf-8') if extra else b""
+    flags = FLAG_DONE if message.get("done") else 0
+    return _HEADER.pack(FRAME_VERSION, flags, len(reason), len(body), len(extra_data)) + reason + body + extra_data
+
+
+def decode_message(frame):
+    """
+    Decode a frame produced by encode_message() back into the message dict
+    """
+    version, flags, reason_length, body_length, extra_length = _HEADER.unpack_from(frame)
+    if version != FRAME_VERSION:
+        raise ValueError(f"Unsupported stream frame version: {version}")
+    reason_end = _HEADER.size + reason_length
+    body_end = reason_end + body_length
+    if body_end + extra_length != len(frame):
+        raise ValueError(f"Stream frame length mismatch: expected {body_end + extra_length} bytes, got {len(frame)}")
+
+    frame = memoryview(frame)
+    message = {
+        "reason": str(frame[_HEADER.size:reason_end], 'utf-8'),
+        "body": str(frame[reason_end:body_end], 'utf-8'),
+        "function": [],
+        "done": bool(flags & FLAG_DONE),
+    }
+    if extra_length:
+        message.update(json.loads(bytes(frame[body_end:])))
+    return message
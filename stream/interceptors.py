@@ -3,6 +3,10 @@ import logging
 import re
 import zlib
 
+# One model output part (reasoning, body text or function call) in the GenerateContent response stream
+PAYLOAD_PATTERN = re.compile(rb'\[\[\[null,.*?]],"model"]')
+
+
 class HttpInterceptor:
     """
     Class to intercept and process HTTP requests and responses
@@ -51,54 +55,32 @@ class HttpInterceptor:
             # Not JSON or not UTF-8, just pass through
             return request_data
     
-    async def process_response(self, response_data, host, path, headers):
+    def apply_payload(self, match, resp):
         """
-        Process the response data before sending to the client
+        Append the reason/body text or function call carried by one matched payload to resp
         """
+        json_data = json.loads(match)
+
         try:
-            # Handle chunked encoding
-            decoded_data, is_done = self._decode_chunked(bytes(response_data))
-            # Handle gzip encoding
-            decoded_data = self._decompress_zlib_stream(decoded_data)
-            result  = self.parse_response(decoded_data)
-            result["done"] = is_done
-            return result
+            payload = json_data[0][0]
         except Exception as e:
-            raise e
-
-    def parse_response(self, response_data):
-        pattern = rb'\[\[\[null,.*?]],"model"]'
-        matches = []
-        for match_obj in re.finditer(pattern, response_data):
-            matches.append(match_obj.group(0))
-
-
-        resp = {
-            "reason": "",
-            "body": "",
-            "function": [],
-        }
-
-        # Print each full match
-        for match in matches:
-            json_data = json.loads(match)
-
-            try:
-                payload = json_data[0][0]
-            except Exception as e:
-                continue
+            return
 
-            if len(payload)==2: # body
-                resp["body"] = resp["body"] + payload[1]
-            elif len(payload) == 11 and payload[1] is None and type(payload[10]) == list:  # function
-                array_tool_calls = payload[10]
-                func_name = array_tool_calls[0]
-                params = self.parse_toolcall_params(array_tool_calls[1])
-                resp["function"].append({"name":func_name, "params":params})
-            elif len(payload) > 2: # reason
-                resp["reason"] = resp["reason"] + payload[1]
+        if len(payload)==2: # body
+            resp["body"] = resp["body"] + payload[1]
+        elif len(payload) == 11 and payload[1] is None and type(payload[10]) == list:  # function
+            array_tool_calls = payload[10]
+            func_name = array_tool_calls[0]
+            params = self.parse_toolcall_params(array_tool_calls[1])
+            resp["function"].append({"name":func_name, "params":params})
+        elif len(payload) > 2: # reason
+            resp["reason"] = resp["reason"] + payload[1]
 
-        return resp
+    def create_response_parser(self, header_lines, status_code=None):
+        """
+        Create an incremental parser for one intercepted response, given its status line and header lines
+        """
+        return ResponseStreamParser(self, ResponseBodyReader(header_lines, status_code))
 
     def parse_toolcall_params(self, args):
         try:
@@ -123,40 +105,153 @@ class HttpInterceptor:
         except Exception as e:
             raise e
 
-    @staticmethod
-    def _decompress_zlib_stream(compressed_stream):
-        decompressor = zlib.decompressobj(wbits=zlib.MAX_WBITS | 32)  # zlib header
-        decompressed = decompressor.decompress(compressed_stream)
-        return decompressed
 
-    @staticmethod
-    def _decode_chunked(response_body: bytes) -> tuple[bytes, bool]:
-        chunked_data = bytearray()
-        while True:
-            # print(' '.join(format(x, '02x') for x in response_body))
+class ResponseStreamParser:
+    """
+    Incremental parser for one intercepted GenerateContent response body.
+    It keeps the body framing, decompression and payload matching state between reads, so each read is
+    processed once and feed() returns only the reasoning/body text and function calls that are new.
+    """
+    def __init__(self, interceptor, body_reader):
+        self._interceptor = interceptor
+        self._body_reader = body_reader
+        self._decompressor = zlib.decompressobj(wbits=zlib.MAX_WBITS | 32)
+        # Decompressed data after the last complete payload match
+        self._pending = b""
+        # Set when the body could not be decoded; the rest of it is then only followed to its end
+        self._failed = False
+        self.reason_length = 0
+        self.body_length = 0
+        self.function_count = 0
 
-            length_crlf_idx = response_body.find(b"\r\n")
-            if length_crlf_idx == -1:
-                break
+    @property
+    def done(self):
+        return self._body_reader.done
 
-            hex_length = response_body[:length_crlf_idx]
+    def feed(self, data):
+        """
+        Process newly received bytes. Returns (delta, rest): the delta since the previous call
+        ({"reason", "body", "function", "done"}), or None when there is nothing new, and the bytes received
+        after the end of this response's body (the start of the next response). The final delta (done=True)
+        also carries a summary with the total lengths, so the consumer can verify it saw every delta.
+        """
+        body, rest = self._body_reader.read(data)
+        resp = {"reason": "", "body": "", "function": [], "done": self.done}
+        if body and not self._failed:
             try:
-                length = int(hex_length, 16)
-            except ValueError as e:
-                logging.error(f"Parsing chunked length failed: {e}")
-                break
+                self._pending += self._decompressor.decompress(body)
+                consumed = 0
+                for match_obj in PAYLOAD_PATTERN.finditer(self._pending):
+                    self._interceptor.apply_payload(match_obj.group(0), resp)
+                    consumed = match_obj.end()
+                if consumed:
+                    self._pending = self._pending[consumed:]
+            except Exception as e:
+                logging.error(f"Error parsing intercepted response: {e}")
+                self._failed = True
+                resp.update(reason="", body="", function=[])
 
-            if length == 0:
-                length_crlf_idx = response_body.find(b"0\r\n\r\n")
-                if length_crlf_idx != -1:
-                    return chunked_data, True
+        self.reason_length += len(resp["reason"])
+        self.body_length += len(resp["body"])
+        self.function_count += len(resp["function"])
+        if self.done:
+            resp["summary"] = {
+                "reason_length": self.reason_length,
+                "body_length": self.body_length,
+                "function_count": self.function_count,
+            }
+        elif not (resp["reason"] or resp["body"] or resp["function"]):
+            return None, rest
+        return resp, rest
 
-            if length + 2 > len(response_body):
-                break
 
-            chunked_data.extend(response_body[length_crlf_idx + 2:length_crlf_idx + 2 + length])
-            if length_crlf_idx + 2 + length + 2 > len(response_body):
-                break
+class ResponseBodyReader:
+    """
+    Follows the framing (Content-Length or chunked) of one response body to find where it ends, so that a
+    chunked terminator or body bytes arriving in a later read are never taken for the headers of the next
+    response. read() returns the decoded body bytes; feed() only skips them, e.g. for an error response body.
+    """
+    def __init__(self, header_lines, status_code=None):
+        self.done = False
+        self._chunked = False
+        self._remaining = None
+        for line in header_lines[1:]:
+            name, _, value = line.partition(b":")
+            name = name.strip().lower()
+            if name == b"transfer-encoding" and b"chunked" in value.lower():
+                self._chunked = True
+            elif name == b"content-length":
+                try:
+                    self._remaining = int(value.strip())
+                except ValueError:
+                    pass
+        # Chunked decoding state: "size" line, chunk "data", the CRLF after the data ("data_end"),
+        # or "trailer" lines after the last chunk up to the terminating empty line
+        self._state = "size"
+        self._line = bytearray()
+        if status_code is not None and (status_code < 200 or status_code in (204, 304)):
+            # Informational, No Content and Not Modified responses have no body
+            self.done = True
+        elif not self._chunked:
+            # Without a length the body lasts until the connection is closed
+            self.done = self._remaining == 0
+
+    def feed(self, data):
+        """
+        Consume body bytes; returns the bytes after the end of the body (empty while it continues)
+        """
+        return self.read(data)[1]
+
+    def read(self, data):
+        """
+        Consume body bytes; returns (body, rest) with the decoded body bytes of this read
+        and the bytes after the end of the body (empty while it continues)
+        """
+        if self.done:
+            return b"", data
+        if not self._chunked:
+            if self._remaining is None:
+                return data, b""
+            consumed = min(self._remaining, len(data))
+            self._remaining -= consumed
+            self.done = self._remaining == 0
+            return data[:consumed], data[consumed:]
 
-            response_body = response_body[length_crlf_idx + 2 + length + 2:]
-        return chunked_data, False
+        body = bytearray()
+        pos = 0
+        while pos < len(data) and not self.done:
+            if self._state == "data":
+                consumed = min(self._remaining, len(data) - pos)
+                body.extend(data[pos:pos + consumed])
+                self._remaining -= consumed
+                pos += consumed
+                if self._remaining == 0:
+                    self._state = "data_end"
+                continue
+            line_end = data.find(b"\n", pos)
+            if line_end == -1:
+                self._line.extend(data[pos:])
+                pos = len(data)
+                break
+            self._line.extend(data[pos:line_end + 1])
+            pos = line_end + 1
+            line = bytes(self._line).strip()
+            self._line.clear()
+            if self._state == "data_end":
+                self._state = "size"
+                continue
+            if self._state == "trailer":
+                self.done = not line
+                continue
+            try:
+                length = int(line.split(b";", 1)[0], 16)
+            except ValueError as e:
+                logging.error(f"Parsing chunked length failed: {e}")
+                self.done = True
+                break
+            if length == 0:
+                self._state = "trailer"
+            else:
+                self._state = "data"
+                self._remaining = length
+        return bytes(body), data[pos:]
@@ -1,6 +1,5 @@
 import asyncio
 from typing import Optional
-import json
 import logging
 import ssl
 import multiprocessing
@@ -9,7 +8,8 @@ from urllib.parse import urlparse
 
 from stream.cert_manager import CertificateManager
 from stream.proxy_connector import ProxyConnector
-from stream.interceptors import HttpInterceptor
+from stream.interceptors import HttpInterceptor, ResponseBodyReader
+from stream.framing import encode_message
 
 class ProxyServer:
     """
@@ -281,51 +281,71 @@ class ProxyServer:
         # Parse HTTP headers from server
         async def _process_server_data():
             nonlocal server_buffer, should_sniff
-            
+            # Incremental parser of the GenerateContent response being received, once its headers are in
+            response_parser = None
+            # Framing of a response body forwarded without parsing (error responses, requests not sniffed)
+            body_skipper = None
+
             try:
                 while True:
                     data = await server_reader.read(8192)
                     if not data:
                         break
 
-                    server_buffer.extend(data)
-                    if b'\r\n\r\n' in server_buffer:
+                    pending = bytes(data)
+                    while pending:
+                        if response_parser is not None:
+                            # Only the newly received body bytes are parsed; nothing is re-buffered.
+                            # Bytes after the end of the body belong to the next response
+                            pending = self._emit_response_delta(response_parser, pending)
+                            if response_parser.done:
+                                response_parser = None
+                            continue
+                        if body_skipper is not None:
+                            pending = body_skipper.feed(pending)
+                            if body_skipper.done:
+                                body_skipper = None
+                            continue
+
+                        server_buffer.extend(pending)
+                        pending = b""
+                        if b'\r\n\r\n' not in server_buffer:
+                            # Not enough data to parse headers yet
+                            break
+
                         # Split headers and body
                         headers_end = server_buffer.find(b'\r\n\r\n') + 4
-                        headers_data = server_buffer[:headers_end]
-                        body_data = server_buffer[headers_end:]
+                        headers_data = bytes(server_buffer[:headers_end])
+                        pending = bytes(server_buffer[headers_end:])
+                        server_buffer.clear()
 
                         # Parse status line and headers
                         lines = headers_data.split(b'\r\n')
+                        status_code = self._parse_status_code(lines[0])
+
+                        if should_sniff and status_code is not None and status_code >= 400:
+                            # Report error statuses of GenerateContent (e.g. 429 quota exhausted) to the server.
+                            # The body of an error response is not a model response, skip it to its end
+                            if self.queue is not None:
+                                self.queue.put(encode_message({
+                                    "done": True, "reason": "", "body": "", "function": [],
+                                    "error": {"status": status_code, "message": lines[0].decode('utf-8', 'replace')}
+                                }))
+                            body_skipper = ResponseBodyReader(lines, status_code)
+                        elif should_sniff:
+                            response_parser = self.interceptor.create_response_parser(lines, status_code)
+                        else:
+                            body_skipper = ResponseBodyReader(lines, status_code)
+                        if body_skipper is not None and body_skipper.done:
+                            body_skipper = None
+                        if response_parser is not None and response_parser.done:
+                            # A response without a body still ends the sniffed request
+                            self._emit_response_delta(response_parser, b"")
+                            response_parser = None
 
-                        # Parse headers
-                        headers = {}
-                        for i in range(1, len(lines)):
-                            if not lines[i]:
-                                continue
-                            try:
-                                key, value = lines[i].decode('utf-8').split(':', 1)
-                                headers[key.strip()] = value.strip()
-                            except ValueError:
-                                continue
-
-                        # Check if this is a response to a GenerateContent request
-                        if should_sniff:
-                            try:
-                                resp = await self.interceptor.process_response(
-                                    body_data, host, "", headers
-                                )
-
-                                if self.queue is not None:
-                                    self.queue.put(json.dumps(resp))
-                            except Exception as e:
-                                pass
-
-                    # Not enough data to parse headers, forward as is
+                    # Responses are forwarded as is
                     client_writer.write(data)
                     # await client_writer.drain()
-                    if b"0\r\n\r\n" in server_buffer:
-                        server_buffer.clear()
             except Exception as e:
                 self.logger.error(f"Error processing server data: {e}")
             finally:
@@ -342,6 +362,31 @@ class ProxyServer:
         await asyncio.gather(*tasks)
         # await asyncio.gather(client_to_server, server_to_client)
     
+    def _emit_response_delta(self, response_parser, data):
+        """
+        Feed body bytes to the response parser and send only the new reason/body text and
+        function calls to the server, so each part of the answer crosses the queue once.
+        Messages are sent as compact frames (see stream.framing) rather than JSON strings.
+        Returns the bytes after the end of the response body
+        """
+        delta, rest = response_parser.feed(bytes(data))
+        if delta is not None and self.queue is not None:
+            self.queue.put(encode_message(delta))
+        return rest
+
+    @staticmethod
+    def _parse_status_code(status_line):
+        """
+        Parse the status code from an HTTP response status line, None if it is not one
+        """
+        parts = status_line.split(b' ', 2)
+        if len(parts) < 2 or not parts[0].startswith(b'HTTP/'):
+            return None
+        try:
+            return int(parts[1])
+        except ValueError:
+            return None
+
     async def start(self):
         """
         Start the proxy server
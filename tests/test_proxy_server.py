@@ -0,0 +1,131 @@
+import asyncio
+import gzip
+import json
+import logging
+
+from stream.framing import decode_message
+from stream.interceptors import HttpInterceptor
+from stream.proxy_server import ProxyServer
+
+REQUEST = b"POST /$rpc/google.internal.alkali.applications.makersuite.v1.MakerSuiteService/GenerateContent HTTP/1.1\r\nHost: alkalimakersuite-pa.clients6.google.com\r\nContent-Length: 2\r\n\r\n{}"
+
+
+class FakeReader:
+    """Returns the given reads one by one, yielding to the other direction in between"""
+
+    def __init__(self, reads, wait_for=None):
+        self._reads = list(reads)
+        self._wait_for = wait_for
+
+    async def read(self, n=-1):
+        await asyncio.sleep(0.01)
+        if self._reads:
+            return self._reads.pop(0)
+        if self._wait_for is not None:
+            await self._wait_for.wait()
+        return b""
+
+
+class FakeWriter:
+    def __init__(self, closed=None):
+        self.data = bytearray()
+        self._closed = closed
+
+    def write(self, data):
+        self.data.extend(data)
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        if self._closed is not None:
+            self._closed.set()
+
+
+class FakeQueue:
+    def __init__(self):
+        self.messages = []
+
+    def put(self, message):
+        self.messages.append(decode_message(message))
+
+
+def chunked(data, size):
+    out = b""
+    for pos in range(0, len(data), size):
+        piece = data[pos:pos + size]
+        out += b"%x\r\n" % len(piece) + piece + b"\r\n"
+    return out + b"0\r\n\r\n"
+
+
+def make_proxy(queue):
+    proxy = ProxyServer.__new__(ProxyServer)
+    proxy.queue = queue
+    proxy.interceptor = HttpInterceptor()
+    proxy.logger = logging.getLogger('proxy_server')
+    return proxy
+
+
+def run_connection(server_reads):
+    queue = FakeQueue()
+    client_writer = FakeWriter()
+
+    async def scenario():
+        response_done = asyncio.Event()
+        client_reader = FakeReader([REQUEST], wait_for=response_done)
+        server_reader = FakeReader(server_reads)
+        # The client side stays open until the proxy has seen the end of the server side
+        client_writer._closed = response_done
+        await make_proxy(queue)._forward_data_with_interception(
+            client_reader, client_writer, server_reader, FakeWriter(), "alkalimakersuite-pa.clients6.google.com"
+        )
+
+    asyncio.run(scenario())
+    return queue.messages, bytes(client_writer.data)
+
+
+def model_response(text):
+    payload = json.dumps([[[[None, text]], "model"]], separators=(",", ":")).encode()
+    return gzip.compress(payload)
+
+
+def test_error_body_in_later_read_does_not_hide_next_response():
+    error_headers = b"HTTP/1.1 429 Too Many Requests\r\nContent-Type: application/json\r\nTransfer-Encoding: chunked\r\n\r\n"
+    error_body = chunked(b'{"error":{"code":429,"status":"RESOURCE_EXHAUSTED"}}', 16)
+    ok_headers = b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nContent-Encoding: gzip\r\nTransfer-Encoding: chunked\r\n\r\n"
+    ok_body = chunked(model_response("hello"), 20)
+
+    messages, forwarded = run_connection([error_headers, error_body, ok_headers, ok_body])
+
+    assert messages[0]["error"]["status"] == 429
+    assert "".join(m["body"] for m in messages[1:]) == "hello"
+    assert messages[-1]["done"] is True
+    # Everything is forwarded to the browser unchanged
+    assert forwarded == error_headers + error_body + ok_headers + ok_body
+
+
+def test_content_length_error_body_split_across_reads():
+    body = b'{"error":{"code":503}}'
+    error_response = b"HTTP/1.1 503 Service Unavailable\r\nContent-Length: %d\r\n\r\n" % len(body) + body[:5]
+    ok_response = b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n" + chunked(model_response("world"), 7)
+
+    messages, _ = run_connection([error_response, body[5:], ok_response])
+
+    assert messages[0]["error"]["status"] == 503
+    assert "".join(m["body"] for m in messages[1:]) == "world"
+    assert messages[-1]["done"] is True
+
+
+def test_chunked_terminator_in_later_read_does_not_hide_error_response():
+    ok_headers = b"HTTP/1.1 200 OK\r\nContent-Encoding: gzip\r\nTransfer-Encoding: chunked\r\n\r\n"
+    ok_body = chunked(model_response("first"), 9)
+    error_response = b"HTTP/1.1 503 Service Unavailable\r\nContent-Length: 2\r\n\r\n{}"
+
+    # The last-chunk line and the CRLF closing the body arrive in separate reads
+    messages, _ = run_connection([ok_headers, ok_body[:-2], ok_body[-2:] + error_response])
+
+    assert "".join(m["body"] for m in messages[:-1]) == "first"
+    done = [m for m in messages if m["done"]]
+    assert len(done) == 2
+    assert done[0]["summary"]["body_length"] == len("first")
+    assert messages[-1]["error"]["status"] == 503
@@ -349,7 +349,7 @@ function updateLogStatus(message, isError = false) {
     }
 }
 
-function addLogEntry(message) {
+function addLogEntry(message, persist = true) {
     if (!logTerminal) return;
     const logEntry = document.createElement('div');
     logEntry.classList.add('log-entry');
@@ -363,7 +363,9 @@ function addLogEntry(message) {
     while (logHistory.length > maxLogLines) {
         logHistory.shift();
     }
-    saveLogHistory();
+    if (persist) {
+        saveLogHistory();
+    }
     if (logTerminal.scrollHeight - logTerminal.clientHeight <= logTerminal.scrollTop + 50) {
         logTerminal.scrollTop = logTerminal.scrollHeight;
     }
@@ -391,7 +393,30 @@ function initializeLogWebSocket() {
         clearLogButton.disabled = false;
     };
     logWebSocket.onmessage = (event) => {
-        addLogEntry(event.data === "LOG_STREAM_CONNECTED" ? "[信息] 日志流确认连接。" : event.data);
+        let msg = null;
+        try {
+            msg = JSON.parse(event.data);
+        } catch (e) {
+            // 不是 JSON 的帧按纯文本日志显示
+        }
+        if (msg === null || typeof msg !== 'object') {
+            addLogEntry(event.data === "LOG_STREAM_CONNECTED" ? "[信息] 日志流确认连接。" : event.data);
+            return;
+        }
+        switch (msg.type) {
+            case 'log_batch':
+                if (msg.lagged) {
+                    addLogEntry(`[警告] 日志流积压，已跳过 ${msg.lagged} 条日志。`, false);
+                }
+                (msg.records || []).forEach(record => addLogEntry(record, false));
+                saveLogHistory();
+                break;
+            case 'connection_status':
+                addLogEntry(`[信息] ${msg.message || msg.status}`);
+                break;
+            default:
+                addLogEntry(event.data);
+        }
     };
     logWebSocket.onerror = (event) => {
         updateLogStatus("连接错误！", true);